@@ -30,6 +30,8 @@ def gen_cli_args():
     generic_group.add_argument("-t", "--threads", type=int, dest="threads", default=256, help="set how many concurrent threads to use")
     generic_group.add_argument("--timeout", default=None, type=int, help="max timeout in seconds of each thread")
     generic_group.add_argument("--jitter", metavar="INTERVAL", type=str, help="sets a random delay between each authentication")
+    generic_group.add_argument("--max-connections", type=int, default=None, help="max TCP connections open at once, new ones wait for a free slot (default: the open files limit minus a reserve, 0 for no limit)")
+    generic_group.add_argument("--max-host-connections", type=int, default=8, help="max TCP connections open at once to a single host, 0 for no limit")
     
     output_parser = argparse.ArgumentParser(add_help=False, formatter_class=DisplayDefaultsNotNone)
     output_group = output_parser.add_argument_group("Output", "Options to set verbosity levels and control output")
@@ -37,6 +39,9 @@ def gen_cli_args():
     output_group.add_argument("--debug", action="store_true", help="enable debug level information")
     output_group.add_argument("--no-progress", action="store_true", help="do not displaying progress bar during scan")
     output_group.add_argument("--log", metavar="LOG", help="export result into a custom file")
+    output_group.add_argument("--profile", action="store_true", help="print the p50/p95/p99 time of each phase (DNS, connect, host info, logins, modules...) and the slowest targets at the end of the run")
+    output_group.add_argument("--profile-export", metavar="FILE", help="export the timing spans of each target to a file")
+    output_group.add_argument("--profile-format", choices=["json", "chrome"], default="json", help="format of --profile-export, chrome is the trace event format of chrome://tracing and Perfetto")
     
     dns_parser = argparse.ArgumentParser(add_help=False, formatter_class=DisplayDefaultsNotNone)
     dns_group = dns_parser.add_argument_group("DNS")
@@ -98,6 +103,7 @@ def gen_cli_args():
     kerberos_group.add_argument("-k", "--kerberos", action="store_true", help="Use Kerberos authentication")
     kerberos_group.add_argument("--use-kcache", action="store_true", help="Use Kerberos authentication from ccache file (KRB5CCNAME)")
     kerberos_group.add_argument("--aesKey", metavar="AESKEY", nargs="+", help="AES key to use for Kerberos Authentication (128 or 256 bits)")
+    kerberos_group.add_argument("--save-kcache", metavar="CCACHE", help="save the Kerberos tickets obtained during the run to a ccache file")
     kerberos_group.add_argument("--kdcHost", metavar="KDCHOST", help="FQDN of the domain controller. If omitted it will use the domain part (FQDN) specified in the target parameter")
     
     server_group = std_parser.add_argument_group("Servers", "Options for nxc servers")
@@ -9,6 +9,7 @@ from socket import AF_UNSPEC, SOCK_DGRAM, IPPROTO_IP, AI_CANONNAME, getaddrinfo
 
 from nxc.config import pwned_label
 from nxc.helpers.logger import highlight
+from nxc.helpers.profiler import profiler
 from nxc.loaders.moduleloader import ModuleLoader
 from nxc.logger import nxc_logger, NXCAdapter
 from nxc.context import Context
@@ -124,6 +125,8 @@ def dcom_FirewallChecker(iInterface, remoteHost, timeout):
 
 class connection:
     def __init__(self, args, db, target):
+        # Targets imported from Nmap or Nessus reports come with the port the service was found on
+        target, port = target if isinstance(target, tuple) else (target, None)
         self.args = args
         self.db = db
         self.logger = nxc_logger
@@ -145,10 +148,21 @@ class connection:
         self.remoteName = target    # hostname + domain, defaults to target if domain could not be resolved/not specified
         self.kdcHost = self.args.kdcHost
         self.port = self.args.port
+        if port:
+            # WinRM takes a list of ports (http, https)
+            self.port = [str(port)] if isinstance(self.args.port, list) else port
         self.local_ip = None
 
+        profiler.set_target(target)
+        if profiler.enabled:
+            # Instance attributes shadow the methods, so the calls made from within the protocols are timed as well
+            for phase in ("create_conn_obj", "enum_host_info", "get_os_arch", "plaintext_login", "hash_login", "kerberos_login", "check_if_admin"):
+                if hasattr(self, phase):
+                    setattr(self, phase, profiler.wrap(phase, getattr(self, phase)))
+
         # DNS resolution
-        dns_result = self.resolver(target)
+        with profiler.span("dns"):
+            dns_result = self.resolver(target)
         if dns_result:
             self.host, self.is_ipv6, self.is_link_local_ipv6 = dns_result["host"], dns_result["is_ipv6"], dns_result["is_link_local_ipv6"]
         else:
@@ -160,7 +174,8 @@ class connection:
         self.logger.info(f"Socket info: host={self.host}, hostname={self.hostname}, kerberos={self.kerberos}, ipv6={self.is_ipv6}, link-local ipv6={self.is_link_local_ipv6}")
 
         try:
-            self.proto_flow()
+            with profiler.span("proto_flow"):
+                self.proto_flow()
         except Exception as e:
             if "ERROR_DEPENDENT_SERVICES_RUNNING" in str(e):
                 self.logger.error(f"Exception while calling proto_flow() on target {target}: {e}")
@@ -248,7 +263,8 @@ class connection:
         for attr, value in vars(self.args).items():
             if hasattr(self, attr) and callable(getattr(self, attr)) and value is not False and value is not None:
                 self.logger.debug(f"Calling {attr}()")
-                getattr(self, attr)()
+                with profiler.span(f"cmd:{attr}"):
+                    getattr(self, attr)()
 
     def call_modules(self):
         """Calls modules and performs various actions based on the module's attributes.
@@ -278,15 +294,18 @@ class connection:
 
             if hasattr(module, "on_login"):
                 self.logger.debug(f"Module {module.name} has on_login method")
-                module.on_login(context, self)
+                with profiler.span(f"module:{module.name}.on_login"):
+                    module.on_login(context, self)
 
             if self.admin_privs and hasattr(module, "on_admin_login"):
                 self.logger.debug(f"Module {module.name} has on_admin_login method")
-                module.on_admin_login(context, self)
+                with profiler.span(f"module:{module.name}.on_admin_login"):
+                    module.on_admin_login(context, self)
 
             if (not hasattr(module, "on_request") and not hasattr(module, "has_response")) and hasattr(module, "on_shutdown"):
                 self.logger.debug(f"Module {module.name} has on_shutdown method")
-                module.on_shutdown(context, self)
+                with profiler.span(f"module:{module.name}.on_shutdown"):
+                    module.on_shutdown(context, self)
 
     def inc_failed_login(self, username):
         global global_failed_logins
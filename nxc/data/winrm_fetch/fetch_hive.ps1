@@ -0,0 +1,31 @@
+# Outputs a file (a saved registry hive) gzip compressed, as base64 chunks followed by the SHA1 of the compressed data.
+# Saved hives are mostly empty cells and compress to a fraction of their size, which is what goes over WinRM.
+
+$ErrorActionPreference = 'Stop'
+$src_path = $MyInvocation.UnboundArguments[0]
+$chunk_size = [int]$MyInvocation.UnboundArguments[1]
+
+if (-not (Test-Path -LiteralPath $src_path -PathType Leaf)) {
+    throw "The path at '$src_path' does not exist"
+}
+
+$compressed = New-Object -TypeName System.IO.MemoryStream
+$gzip = New-Object -TypeName System.IO.Compression.GZipStream -ArgumentList $compressed, ([System.IO.Compression.CompressionMode]::Compress)
+$fs = [System.IO.File]::OpenRead($src_path)
+try {
+    $buffer = New-Object -TypeName byte[] -ArgumentList 65536
+    while (($read = $fs.Read($buffer, 0, $buffer.Length)) -gt 0) {
+        $gzip.Write($buffer, 0, $read)
+    }
+} finally {
+    $fs.Dispose()
+    $gzip.Dispose()
+}
+
+$bytes = $compressed.ToArray()
+for ($offset = 0; $offset -lt $bytes.Length; $offset += $chunk_size) {
+    Write-Output -InputObject ([System.Convert]::ToBase64String($bytes, $offset, [Math]::Min($chunk_size, $bytes.Length - $offset)))
+}
+
+$algo = [System.Security.Cryptography.SHA1]::Create()
+[System.BitConverter]::ToString($algo.ComputeHash($bytes)).Replace("-", "").ToLowerInvariant()
@@ -1,4 +1,4 @@
-from argparse import ArgumentDefaultsHelpFormatter, SUPPRESS, OPTIONAL, ZERO_OR_MORE
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentTypeError, SUPPRESS, OPTIONAL, ZERO_OR_MORE
 
 class DisplayDefaultsNotNone(ArgumentDefaultsHelpFormatter):
     def _get_help_string(self, action):
@@ -7,4 +7,14 @@ class DisplayDefaultsNotNone(ArgumentDefaultsHelpFormatter):
             defaulting_nargs = [OPTIONAL, ZERO_OR_MORE]
             if (action.option_strings or action.nargs in defaulting_nargs) and action.default:  # Only add default info if it's not None
                 help_string += " (default: %(default)s)"  # NORUFF
-        return help_string
\ No newline at end of file
+        return help_string
+
+def positive_int(value):
+    """Argument type of the options which only make sense with a value of 1 or more"""
+    try:
+        value = int(value)
+    except ValueError:
+        raise ArgumentTypeError(f"invalid int value: '{value}'") from None
+    if value < 1:
+        raise ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
@@ -0,0 +1,207 @@
+import platform
+import socket
+from threading import Condition
+from time import perf_counter
+from weakref import finalize, ref
+
+from nxc.logger import nxc_logger
+
+
+class ConnectionGovernor:
+    """Limits the TCP connections open at once, process-wide and to each host.
+
+    Once installed, every TCP connect of nxc and of the libraries it uses (impacket, paramiko, ldap3, requests...) takes
+    a slot, released when the socket is closed. Connects wait for a free slot instead of failing with "Too many open
+    files" or flooding a single host, as several connections are opened to the same host by a target (SMB, RPC on 135,
+    DCOM, LDAP...). A connect that has waited for wait_timeout seconds goes through anyway, so that a target holding
+    all the slots of its host can't block on itself, and is counted as over budget.
+
+    Slots are tracked by file descriptor: the SSL socket wrapping a connected socket takes its slot over, and the slot
+    of a socket that was garbage collected without being closed is released by its finalizer. Non-blocking sockets
+    (asyncio in VNC, RDP, MSSQL...) are not governed, as waiting for a slot would block their event loop.
+    """
+
+    # Descriptors left for the files, logs and databases when the limit is derived from the open files limit
+    FD_RESERVE = 256
+
+    def __init__(self):
+        self.max_connections = 0
+        self.max_host_connections = 0
+        self.wait_timeout = 30
+        self.installed = False
+        self.condition = Condition()
+        self.sockets = {}
+        self.finalizers = {}
+        self.successors = {}
+        self.hosts = {}
+        self.stats = {"connects": 0, "waits": 0, "wait_time": 0.0, "over_budget": 0, "peak": 0, "peak_host": 0}
+
+    @classmethod
+    def default_max_connections(cls):
+        """Open files limit minus a reserve, no limit on Windows where sockets don't count against it"""
+        if platform.system() == "Windows":
+            return 0
+        import resource
+
+        return max(resource.getrlimit(resource.RLIMIT_NOFILE)[0] - cls.FD_RESERVE, 64)
+
+    def configure(self, max_connections=None, max_host_connections=0):
+        """Sets the limits, 0 meaning no limit, and installs the governor if any is set"""
+        self.max_connections = self.default_max_connections() if max_connections is None else max_connections
+        self.max_host_connections = max_host_connections
+        nxc_logger.debug(f"Connection governor: max {self.max_connections or 'unlimited'} connections, {self.max_host_connections or 'unlimited'} per host")
+        if self.max_connections or self.max_host_connections:
+            self.install()
+
+    def install(self):
+        if self.installed:
+            return
+        self.installed = True
+        governor = self
+        real_init = socket.socket.__init__
+        real_connect = socket.socket.connect
+        real_connect_ex = socket.socket.connect_ex
+        real_detach = socket.socket.detach
+        real_close = socket.socket._real_close
+
+        def __init__(sock, *args, **kwargs):
+            real_init(sock, *args, **kwargs)
+            governor.adopt(sock)
+
+        def connect(sock, address):
+            governor.acquire(sock, address)
+            try:
+                return real_connect(sock, address)
+            except BaseException:
+                governor.release(sock)
+                raise
+
+        def connect_ex(sock, address):
+            governor.acquire(sock, address)
+            result = real_connect_ex(sock, address)
+            if result:
+                governor.release(sock)
+            return result
+
+        def detach(sock):
+            governor.hand_over(sock)
+            return real_detach(sock)
+
+        def _real_close(sock, *args, **kwargs):
+            governor.release(sock)
+            return real_close(sock, *args, **kwargs)
+
+        socket.socket.__init__ = __init__
+        socket.socket.connect = connect
+        socket.socket.connect_ex = connect_ex
+        socket.socket.detach = detach
+        socket.socket._real_close = _real_close
+
+    def available(self, host):
+        if self.max_connections and len(self.sockets) >= self.max_connections:
+            return False
+        return not (self.max_host_connections and self.hosts.get(host, 0) >= self.max_host_connections)
+
+    def acquire(self, sock, address):
+        """Takes a slot for the TCP connection of sock to address, waiting for one to be released if none is free"""
+        if sock.type != socket.SOCK_STREAM or sock.family not in (socket.AF_INET, socket.AF_INET6) or sock.gettimeout() == 0:
+            return
+        fd = sock.fileno()
+        host = address[0]
+        with self.condition:
+            if self.owner(fd) is sock:
+                # connect called again on the same socket
+                return
+            # slot of a socket that was detached or collected
+            self.discard(fd)
+
+            if not self.available(host):
+                self.stats["waits"] += 1
+                start = perf_counter()
+                if not self.condition.wait_for(lambda: self.available(host), timeout=self.wait_timeout):
+                    self.stats["over_budget"] += 1
+                    nxc_logger.debug(f"Connection governor: no slot freed for {host} within {self.wait_timeout}s, connecting anyway")
+                self.stats["wait_time"] += perf_counter() - start
+
+            self.sockets[fd] = host
+            self.finalizers[fd] = finalize(sock, self.collected, fd)
+            self.hosts[host] = self.hosts.get(host, 0) + 1
+            self.stats["connects"] += 1
+            self.stats["peak"] = max(self.stats["peak"], len(self.sockets))
+            self.stats["peak_host"] = max(self.stats["peak_host"], self.hosts[host])
+
+    def release(self, sock):
+        """Releases the slot of sock, if it took one"""
+        fd = sock.fileno()
+        if fd == -1:
+            return
+        with self.condition:
+            self.discard(fd)
+
+    def collected(self, fd):
+        """Releases the slot of a socket garbage collected without being closed"""
+        with self.condition:
+            finalizer = self.finalizers.get(fd)
+            # the descriptor is already closed and may have been taken by a new connection
+            if finalizer is not None and not finalizer.alive:
+                self.discard(fd)
+
+    def owner(self, fd):
+        """Socket holding the slot of fd, None if it was handed over or collected"""
+        finalizer = self.finalizers.get(fd)
+        info = finalizer.peek() if finalizer is not None else None
+        return info[0] if info else None
+
+    def hand_over(self, sock):
+        """Moves the slot of sock to the socket taking its descriptor over when it is detached (SSL wrapping)"""
+        fd = sock.fileno()
+        with self.condition:
+            if self.owner(fd) is sock:
+                self.finalizers[fd].detach()
+                successor = self.successors.pop(fd, lambda: None)()
+                self.finalizers[fd] = finalize(successor, self.collected, fd) if successor is not None else None
+
+    def adopt(self, sock):
+        """Records the socket created on the descriptor of a slot, before or after the previous one is detached"""
+        fd = sock.fileno()
+        with self.condition:
+            if fd not in self.sockets:
+                return
+            if self.finalizers.get(fd) is None:
+                self.finalizers[fd] = finalize(sock, self.collected, fd)
+            elif self.owner(fd) is not sock:
+                self.successors[fd] = ref(sock)
+
+    def discard(self, fd):
+        host = self.sockets.pop(fd, None)
+        self.successors.pop(fd, None)
+        finalizer = self.finalizers.pop(fd, None)
+        if finalizer is not None:
+            finalizer.detach()
+        if host is not None:
+            self.free(host)
+            self.condition.notify_all()
+
+    def free(self, host):
+        self.hosts[host] -= 1
+        if not self.hosts[host]:
+            del self.hosts[host]
+
+    def report(self, display=False):
+        """Logs the number of connections, the peaks and the time connects waited for a slot"""
+        if not self.installed:
+            return
+        with self.condition:
+            stats = dict(self.stats, open=len(self.sockets))
+        summary = (
+            f"Connections: {stats['connects']} opened, peak {stats['peak']} at once (limit {self.max_connections or 'none'}), "
+            f"peak {stats['peak_host']} to a host (limit {self.max_host_connections or 'none'}), "
+            f"{stats['waits']} waited {stats['wait_time']:.3f}s for a slot, {stats['over_budget']} over budget, {stats['open']} still open"
+        )
+        if display or stats["over_budget"]:
+            nxc_logger.display(summary)
+        else:
+            nxc_logger.debug(summary)
+
+
+governor = ConnectionGovernor()
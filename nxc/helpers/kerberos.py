@@ -0,0 +1,110 @@
+from hashlib import sha256
+from threading import Lock
+from time import time
+
+from impacket.krb5 import constants
+from impacket.krb5.ccache import CCache
+from impacket.krb5.kerberosv5 import KerberosError, SessionKeyDecryptionError, getKerberosTGS, getKerberosTGT
+from impacket.krb5.types import Principal
+from impacket.ntlm import compute_lmhash, compute_nthash
+
+from nxc.logger import nxc_logger
+
+
+class TicketCache:
+    """Thread-safe Kerberos ticket cache shared by all targets of a run.
+
+    TGTs are keyed by realm, principal and a digest of the secret, service tickets additionally by SPN, so a principal
+    only does one AS-REQ per run and one TGS-REQ per service. Answers of the KDC that won't change during the run
+    (wrong password, unknown principal, no pre-auth...) are cached as well: a bad secret hits the KDC once instead of
+    once per target, which also keeps the lockout counter of the account from running up.
+    """
+
+    # Tickets expiring within this many seconds are requested again
+    EXPIRY_MARGIN = 300
+
+    def __init__(self):
+        self.lock = Lock()
+        self.key_locks = {}
+        self.tgts = {}
+        self.tgss = {}
+
+    def key_lock(self, key):
+        # Per key lock: concurrent targets for the same principal wait for a single request instead of all asking the KDC
+        with self.lock:
+            return self.key_locks.setdefault(key, Lock())
+
+    @staticmethod
+    def principal_key(username, domain, password, lmhash, nthash, aesKey):
+        secret = sha256(f"{password}:{lmhash}:{nthash}:{aesKey}".encode()).hexdigest()
+        return domain.upper(), username.lower(), secret
+
+    def lookup(self, table, key, request):
+        with self.key_lock(key):
+            entry = table.get(key)
+            if isinstance(entry, Exception):
+                raise entry
+            if entry is not None and entry["endtime"] - self.EXPIRY_MARGIN > time():
+                return entry["ticket"]
+            try:
+                ticket, ccache = request()
+            except (KerberosError, SessionKeyDecryptionError) as e:
+                table[key] = e
+                raise
+            table[key] = {"ticket": ticket, "ccache": ccache, "endtime": ccache.credentials[0]["time"]["endtime"]}
+            return ticket
+
+    def get_tgt(self, username, password, domain, lmhash, nthash, aesKey, kdcHost):
+        """Returns the TGT of the principal in the dict format impacket takes as TGT argument of kerberosLogin()"""
+        def request():
+            principal = Principal(username, type=constants.PrincipalNameType.NT_PRINCIPAL.value)
+            try:
+                tgt, cipher, old_session_key, session_key = getKerberosTGT(principal, password, domain, lmhash, nthash, aesKey, kdcHost)
+            except KerberosError as e:
+                # Same fallback as impacket: if the KDC does not support AES retry with the RC4 key of the password
+                if e.getErrorCode() != constants.ErrorCodes.KDC_ERR_ETYPE_NOSUPP.value or lmhash or nthash or aesKey:
+                    raise
+                tgt, cipher, old_session_key, session_key = getKerberosTGT(principal, password, domain, compute_lmhash(password), compute_nthash(password), aesKey, kdcHost)
+            nxc_logger.debug(f"Got TGT for {username}@{domain.upper()}")
+            ccache = CCache()
+            ccache.fromTGT(tgt, old_session_key, session_key)
+            return {"KDC_REP": tgt, "cipher": cipher, "sessionKey": session_key}, ccache
+
+        return self.lookup(self.tgts, self.principal_key(username, domain, password, lmhash, nthash, aesKey), request)
+
+    def get_tgs(self, spn, username, password, domain, lmhash, nthash, aesKey, kdcHost):
+        """Returns a service ticket for the SPN in the dict format impacket takes as TGS argument of kerberosLogin()"""
+        def request():
+            tgt = self.get_tgt(username, password, domain, lmhash, nthash, aesKey, kdcHost)
+            server = Principal(spn, type=constants.PrincipalNameType.NT_SRV_INST.value)
+            tgs, cipher, old_session_key, session_key = getKerberosTGS(server, domain, kdcHost, tgt["KDC_REP"], tgt["cipher"], tgt["sessionKey"])
+            nxc_logger.debug(f"Got TGS for {spn} as {username}@{domain.upper()}")
+            ccache = CCache()
+            ccache.fromTGS(tgs, old_session_key, session_key)
+            return {"KDC_REP": tgs, "cipher": cipher, "sessionKey": session_key}, ccache
+
+        key = (*self.principal_key(username, domain, password, lmhash, nthash, aesKey), spn.lower())
+        return self.lookup(self.tgss, key, request)
+
+    def export(self, path):
+        """Saves all valid tickets to a ccache file, one file per principal (path_user@REALM) if several were used"""
+        with self.lock:
+            entries = [(key, entry) for key, entry in (*self.tgts.items(), *self.tgss.items()) if isinstance(entry, dict) and entry["endtime"] > time()]
+
+        ccaches = {}
+        for key, entry in entries:
+            realm, username = key[:2]
+            if (username, realm) not in ccaches:
+                ccache = CCache()
+                ccache.headers = entry["ccache"].headers
+                ccache.principal = entry["ccache"].principal
+                ccaches[(username, realm)] = ccache
+            ccaches[(username, realm)].credentials.extend(entry["ccache"].credentials)
+
+        for (username, realm), ccache in ccaches.items():
+            file_name = path if len(ccaches) == 1 else f"{path}_{username}@{realm}"
+            ccache.saveFile(file_name)
+            nxc_logger.display(f"Saved {len(ccache.credentials)} Kerberos ticket(s) of {username}@{realm} to {file_name}")
+
+
+ticket_cache = TicketCache()
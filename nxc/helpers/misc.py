@@ -6,13 +6,13 @@ import os
 
 
 def identify_target_file(target_file):
-    with open(target_file) as target_file_handle:
-        for i, line in enumerate(target_file_handle):
-            if i == 1:
-                if line.startswith("<NessusClientData"):
-                    return "nessus"
-                elif line.endswith("nmaprun>\n"):
-                    return "nmap"
+    # The root element comes after the XML declaration, doctype and stylesheet, whatever the line breaks are
+    with open(target_file, errors="ignore") as target_file_handle:
+        head = target_file_handle.read(4096)
+    if "<NessusClientData" in head:
+        return "nessus"
+    elif "<nmaprun" in head:
+        return "nmap"
 
     return "unknown"
 
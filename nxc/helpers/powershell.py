@@ -8,10 +8,18 @@ from nxc.helpers.misc import which
 from nxc.logger import nxc_logger
 from nxc.paths import NXC_PATH, DATA_PATH
 from base64 import b64encode
+from hashlib import sha256
+from threading import Lock
 import random
 
 obfuscate_ps_scripts = False
 
+# Run-wide caches of the generated payloads, generation is serialized so each payload is only built once
+payload_lock = Lock()
+ps_command_cache = {}
+ps_script_cache = {}
+amsi_bypass_cache = {}
+
 def replace_singles(s):
     """Replaces single quotes with a double quote
     We do this because quoting is very important in PowerShell, and we are doing multiple layers:
@@ -71,7 +79,7 @@ def is_powershell_installed():
 
 def obfs_ps_script(path_to_script):
     """
-    Obfuscates a PowerShell script.
+    Obfuscates a PowerShell script, or strips it if obfuscation is off. The result is cached for the rest of the run.
 
     Args:
     ----
@@ -86,11 +94,20 @@ def obfs_ps_script(path_to_script):
         FileNotFoundError: If the script file does not exist.
         OSError: If there is an error during obfuscation.
     """
+    obfuscate = is_powershell_installed() and obfuscate_ps_scripts
+    key = (path_to_script, obfuscate)
+    with payload_lock:
+        if key not in ps_script_cache:
+            ps_script_cache[key] = _obfs_ps_script(path_to_script, obfuscate)
+        return ps_script_cache[key]
+
+
+def _obfs_ps_script(path_to_script, obfuscate):
     ps_script = path_to_script.split("/")[-1]
     obfs_script_dir = os.path.join(NXC_PATH, "obfuscated_scripts")
     obfs_ps_script = os.path.join(obfs_script_dir, ps_script)
 
-    if is_powershell_installed() and obfuscate_ps_scripts:
+    if obfuscate:
         if os.path.exists(obfs_ps_script):
             nxc_logger.display("Using cached obfuscated Powershell script")
             with open(obfs_ps_script) as script:
@@ -122,10 +139,23 @@ def obfs_ps_script(path_to_script):
 
 
 
+def read_amsi_bypass(custom_amsi):
+    """Returns the content of a custom AMSI bypass file, read once per run"""
+    if custom_amsi not in amsi_bypass_cache:
+        nxc_logger.debug(f"Using custom AMSI bypass script: {custom_amsi}")
+        with open(custom_amsi) as file_in:
+            amsi_bypass_cache[custom_amsi] = file_in.read()
+    return amsi_bypass_cache[custom_amsi]
+
+
 def create_ps_command(ps_command, force_ps32=False, obfs=False, custom_amsi=None, encode=True):
     """
     Generates a PowerShell command based on the provided `ps_command` parameter.
 
+    Commands are cached by the hash of the command and of the AMSI bypass, and by the options, so running the same
+    command against many hosts builds, encodes and obfuscates it only once (obfuscated commands are the same on all
+    hosts of the run).
+
     Args:
     ----
         ps_command (str): The PowerShell command to be executed.
@@ -139,15 +169,15 @@ def create_ps_command(ps_command, force_ps32=False, obfs=False, custom_amsi=None
         str: The generated PowerShell command.
     """
     nxc_logger.debug(f"Creating PS command parameters: {ps_command=}, {force_ps32=}, {obfs=}, {custom_amsi=}, {encode=}")
-    
-    if custom_amsi:
-        nxc_logger.debug(f"Using custom AMSI bypass script: {custom_amsi}")
-        with open(custom_amsi) as file_in:
-            lines = list(file_in)
-            amsi_bypass = "".join(lines)
-    else:
-        amsi_bypass = ""
+    with payload_lock:
+        amsi_bypass = read_amsi_bypass(custom_amsi) if custom_amsi else ""
+        key = (sha256(ps_command.encode()).hexdigest(), sha256(amsi_bypass.encode()).hexdigest(), force_ps32, obfs, encode)
+        if key not in ps_command_cache:
+            ps_command_cache[key] = _create_ps_command(ps_command, force_ps32, obfs, amsi_bypass, encode)
+        return ps_command_cache[key]
 
+
+def _create_ps_command(ps_command, force_ps32, obfs, amsi_bypass, encode):
     # for readability purposes, we do not do a one-liner
     if force_ps32:  # noqa: SIM108
         # https://stackoverflow.com/a/60155248
@@ -185,6 +215,17 @@ def create_ps_command(ps_command, force_ps32=False, obfs=False, custom_amsi=None
     return command
 
 
+def precompute_ps_commands(args):
+    """Builds the -X payloads once before the run, with the options ps_execute() of smb and mssql passes"""
+    payloads = [args.ps_execute]
+    if os.path.isfile(args.ps_execute):
+        with open(args.ps_execute) as commands:
+            payloads = [command.strip() for command in commands]
+    custom_amsi = args.amsi_bypass[0] if args.amsi_bypass else None
+    for payload in payloads:
+        create_ps_command(payload, force_ps32=args.force_ps32, obfs=args.obfs, custom_amsi=custom_amsi, encode=not args.no_encode)
+
+
 def gen_ps_inject(command, context=None, procname="explorer.exe", inject_once=False):
     """
     Generates a PowerShell code block for injecting a command into a specified process.
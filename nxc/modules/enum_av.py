@@ -5,7 +5,9 @@
 
 from impacket.dcerpc.v5 import lsat, lsad, transport
 from impacket.dcerpc.v5.dtypes import NULL, MAXIMUM_ALLOWED, RPC_UNICODE_STRING
-from impacket.dcerpc.v5.rpcrt import RPC_C_AUTHN_GSS_NEGOTIATE
+from impacket.dcerpc.v5.rpcrt import DCERPCException, RPC_C_AUTHN_GSS_NEGOTIATE
+from impacket.dcerpc.v5.samr import SID_NAME_USE
+from concurrent.futures import ThreadPoolExecutor
 import pathlib
 
 
@@ -33,8 +35,12 @@ class NXCModule:
         target = self._get_target(connection)
         context.log.debug(f"Detecting installed services on {target} using LsarLookupNames()...")
 
-        results = self._detect_installed_services(context, connection, target)
-        self.detect_running_processes(context, connection, results)
+        # The LSA lookups run over their own connection, so the pipe listing on the existing SMB session can run meanwhile
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            running = executor.submit(self.detect_running_processes, context, connection, {})
+            results = self._detect_installed_services(context, connection, target)
+        for product, data in running.result().items():
+            results.setdefault(product, {}).update(data)
 
         self.dump_results(results, context)
 
@@ -60,14 +66,12 @@ class NXCModule:
 
             dce, _ = lsa.connect()
             policyHandle = lsa.open_policy(dce)
-            for product in conf["products"]:
-                for service in product["services"]:
-                    try:
-                        lsa.LsarLookupNames(dce, policyHandle, service["name"])
-                        context.log.info(f"Detected installed service on {connection.host}: {product['name']} {service['description']}")
-                        results.setdefault(product["name"], {"services": []})["services"].append(service)
-                    except Exception:
-                        pass
+            candidates = [(product, service) for product in conf["products"] for service in product["services"]]
+            installed = lsa.LsarLookupNames(dce, policyHandle, [service["name"] for _, service in candidates])
+            for (product, service), found in zip(candidates, installed):
+                if found:
+                    context.log.info(f"Detected installed service on {connection.host}: {product['name']} {service['description']}")
+                    results.setdefault(product["name"], {"services": []})["services"].append(service)
         except Exception as e:
             context.log.fail(str(e))
         return results
@@ -88,6 +92,7 @@ class NXCModule:
                 context.log.fail("Error STATUS_ACCESS_DENIED while enumerating pipes, probably due to using SMBv1")
             else:
                 context.log.fail(str(e))
+        return results
 
     def dump_results(self, results, context):
         if not results:
@@ -114,6 +119,7 @@ class LsaLookupNames:
 
     iface_uuid = lsat.MSRPC_UUID_LSAT
     authn = True
+    lookup_batch_size = 1000
 
     def __init__(
         self,
@@ -194,17 +200,34 @@ class LsaLookupNames:
         resp = dce.request(request)
         return resp["PolicyHandle"]
 
-    def LsarLookupNames(self, dce, policyHandle, service):
-        request = lsat.LsarLookupNames()
-        request["PolicyHandle"] = policyHandle
-        request["Count"] = 1
-        name1 = RPC_UNICODE_STRING()
-        name1["Data"] = f"NT Service\\{service}"
-        request["Names"].append(name1)
-        request["TranslatedSids"]["Sids"] = NULL
-        request["LookupLevel"] = lsat.LSAP_LOOKUP_LEVEL.LsapLookupWksta
-        return dce.request(request)
+    def LsarLookupNames(self, dce, policyHandle, services):
+        r"""Looks up the "NT Service\<name>" accounts of all services in batched calls.
 
+        Returns a list of booleans telling for each service if its account, and so the service, exists on the host.
+        """
+        found = []
+        for i in range(0, len(services), self.lookup_batch_size):
+            batch = services[i:i + self.lookup_batch_size]
+            request = lsat.LsarLookupNames()
+            request["PolicyHandle"] = policyHandle
+            request["Count"] = len(batch)
+            for service in batch:
+                name = RPC_UNICODE_STRING()
+                name["Data"] = f"NT Service\\{service}"
+                request["Names"].append(name)
+            request["TranslatedSids"]["Sids"] = NULL
+            request["LookupLevel"] = lsat.LSAP_LOOKUP_LEVEL.LsapLookupWksta
+            try:
+                resp = dce.request(request)
+            except DCERPCException as e:
+                if str(e).find("STATUS_NONE_MAPPED") >= 0:
+                    found.extend([False] * len(batch))
+                    continue
+                if str(e).find("STATUS_SOME_NOT_MAPPED") < 0:
+                    raise
+                resp = e.get_packet()
+            found.extend(sid["Use"] != SID_NAME_USE.SidTypeUnknown for sid in resp["TranslatedSids"]["Sids"])
+        return found
 
 conf = {
     "products": [
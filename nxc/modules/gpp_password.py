@@ -88,7 +88,7 @@ class NXCModule:
                                     if k != "cpassword":
                                         context.log.highlight(f"{k}: {v}")
 
-                                hostid = context.db.get_hosts(connection.host)[0][0]
+                                hostid = context.db.get_host_id(connection.host)
                                 context.db.add_credential(
                                     "plaintext",
                                     "",
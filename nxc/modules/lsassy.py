@@ -158,7 +158,7 @@ class NXCModule:
 
     @staticmethod
     def save_credentials(context, connection, domain, username, password, lmhash, nthash):
-        host_id = context.db.get_hosts(connection.host)[0][0]
+        host_id = context.db.get_host_id(connection.host)
         if password is not None:
             credential_type = "plaintext"
         else:
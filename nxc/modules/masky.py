@@ -93,7 +93,7 @@ class NXCModule:
         return True
 
     def process_credentials(self, connection, context, user):
-        host = context.db.get_hosts(connection.host)[0][0]
+        host = context.db.get_host_id(connection.host)
         context.db.add_credential(
             "hash",
             user.domain,
@@ -108,7 +108,7 @@ class NXCModule:
         boot_key = local_operations.getBootKey()
         no_lm_hash = local_operations.checkNoLMHashPolicy()
 
-        host_id = context.db.get_hosts(filter_term=connection.host)[0][0]
+        host_id = context.db.get_host_id(connection.host)
 
         def add_ntds_hash(ntds_hash, host_id):
             add_ntds_hash.ntds_hashes += 1
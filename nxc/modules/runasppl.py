@@ -1,3 +1,5 @@
+from impacket.dcerpc.v5.rrp import DCERPCSessionError
+
 
 class NXCModule:
     name = "runasppl"
@@ -14,10 +16,10 @@ class NXCModule:
         """"""
 
     def on_admin_login(self, context, connection):
-        command = r"reg query HKEY_LOCAL_MACHINE\SYSTEM\CurrentControlSet\Control\Lsa\ /v RunAsPPL"
-        context.log.debug(f"Executing command: {command}")
-        p = connection.execute(command, True)
-        if "The system was unable to find the specified registry key or value" in p:
-            context.log.debug("Unable to find RunAsPPL Registry Key")
+        try:
+            with connection.registry as reg:
+                _, run_as_ppl = reg.query_value("HKLM\\SYSTEM\\CurrentControlSet\\Control\\Lsa", "RunAsPPL")
+        except DCERPCSessionError as e:
+            context.log.debug(f"Unable to find RunAsPPL Registry Key: {e}")
         else:
-            context.log.highlight(p)
+            context.log.highlight(f"RunAsPPL: {run_as_ppl}")
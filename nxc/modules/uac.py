@@ -1,8 +1,5 @@
 import logging
 
-from impacket.dcerpc.v5 import rrp
-from impacket.examples.secretsdump import RemoteOperations
-
 
 class NXCModule:
     name = "uac"
@@ -20,23 +17,10 @@ class NXCModule:
         """ """
 
     def on_admin_login(self, context, connection):
-        remoteOps = RemoteOperations(connection.conn, False)
-        remoteOps.enableRegistry()
-
-        ans = rrp.hOpenLocalMachine(remoteOps._RemoteOperations__rrp)
-        regHandle = ans["phKey"]
-        ans = rrp.hBaseRegOpenKey(
-            remoteOps._RemoteOperations__rrp,
-            regHandle,
-            "SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Policies\\System",
-        )
-        keyHandle = ans["phkResult"]
-        dataType, uac_value = rrp.hBaseRegQueryValue(remoteOps._RemoteOperations__rrp, keyHandle, "EnableLUA")
+        with connection.registry as reg:
+            dataType, uac_value = reg.query_value("HKLM\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Policies\\System", "EnableLUA")
 
         if uac_value == 1:
             context.log.highlight("UAC Status: 1 (UAC Enabled)")
         elif uac_value == 0:
             context.log.highlight("UAC Status: 0 (UAC Disabled)")
-
-        rrp.hBaseRegCloseKey(remoteOps._RemoteOperations__rrp, keyHandle)
-        remoteOps.finish()
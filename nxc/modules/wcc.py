@@ -7,10 +7,9 @@ from impacket.system_errors import ERROR_NO_MORE_ITEMS, ERROR_FILE_NOT_FOUND, ER
 from termcolor import colored
 
 from nxc.logger import nxc_logger
-from impacket.dcerpc.v5 import rrp, samr, scmr
+from impacket.dcerpc.v5 import samr, scmr
 from impacket.dcerpc.v5.rrp import DCERPCSessionError
 from impacket.smbconnection import SessionError as SMBSessionError
-from impacket.examples.secretsdump import RemoteOperations
 
 # Configuration variables
 OUTDATED_THRESHOLD = 30
@@ -153,13 +152,14 @@ class HostChecker:
     def __init__(self, context, connection):
         self.context = context
         self.connection = connection
-        remoteOps = RemoteOperations(smbConnection=connection.conn, doKerberos=False)
-        remoteOps.enableRegistry()
-        self.dce = remoteOps._RemoteOperations__rrp
+        self.registry = connection.registry
+        self.key_values = {}
+        self.samr = None
 
     def run(self):
-        self.init_checks()
-        self.check_config()
+        with self.registry:
+            self.init_checks()
+            self.check_config()
         
     def init_checks(self):
         # Declare the checks to do and how to do them
@@ -268,7 +268,7 @@ class HostChecker:
                     reasons = ["Check could not be performed (invalid specification provided)"]
                     return ok, reasons
             except Exception as e:
-                self.module.log.error(f"Check could not be performed. Details: specs={specs}, dce={self.dce}, error: {e}")
+                self.module.log.error(f"Check could not be performed. Details: specs={specs}, host={self.connection.host}, error: {e}")
                 return ok, reasons
 
             if op == operator.eq:
@@ -296,7 +296,7 @@ class HostChecker:
                 opstring = f"{op.__name__}({{left}}, {{right}}) == True"
                 nopstring = f"{op.__name__}({{left}}, {{right}}) == True"
 
-            value = self.reg_query_value(self.dce, self.connection, key, value_name)
+            value = self.reg_query_value(key, value_name)
 
             if type(value) == DCERPCSessionError:
                 if options["KOIfMissing"]:
@@ -331,37 +331,26 @@ class HostChecker:
         lapsv2_aad_key_name = "Software\\Microsoft\\Policies\\LAPS"
 
         # Checking LAPSv2
-        ans = self._open_root_key(self.dce, self.connection, "HKLM")
-
-        if ans is None:
-            return False, ["Could not query remote registry"]
-
-        root_key_handle = ans["phKey"]
-        try:
-            ans = rrp.hBaseRegOpenKey(self.dce, root_key_handle, lapsv2_ad_key_name)
-            reasons.append(f"HKLM\\{lapsv2_ad_key_name} found, LAPSv2 AD installed")
-            success = True
-            return success, reasons
-        except DCERPCSessionError as e:
-            if e.error_code != ERROR_FILE_NOT_FOUND:
-                reasons.append(f"HKLM\\{lapsv2_ad_key_name} not found")
-
-        try:
-            ans = rrp.hBaseRegOpenKey(self.dce, root_key_handle, lapsv2_aad_key_name)
-            reasons.append(f"HKLM\\{lapsv2_aad_key_name} found, LAPSv2 AAD installed")
-            success = True
-            return success, reasons
-        except DCERPCSessionError as e:
-            if e.error_code != ERROR_FILE_NOT_FOUND:
-                reasons.append(f"HKLM\\{lapsv2_aad_key_name} not found")
+        for key_name, flavour in ((lapsv2_ad_key_name, "AD"), (lapsv2_aad_key_name, "AAD")):
+            try:
+                self.registry.open_key(f"HKLM\\{key_name}")
+                reasons.append(f"HKLM\\{key_name} found, LAPSv2 {flavour} installed")
+                success = True
+                return success, reasons
+            except DCERPCSessionError as e:
+                if e.error_code != ERROR_FILE_NOT_FOUND:
+                    reasons.append(f"HKLM\\{key_name} not found")
+            except Exception as e:
+                self.context.log.error(f"HostChecker.check_laps():{self.connection.host}: Error while trying to open HKLM\\{key_name}: {e}")
+                return False, ["Could not query remote registry"]
 
         # LAPSv2 does not seems to be installed, checking LAPSv1
         lapsv1_key_name = "HKLM\\Software\\Microsoft\\Windows NT\\CurrentVersion\\Winlogon\\GPextensions"
-        subkeys = self.reg_get_subkeys(self.dce, self.connection, lapsv1_key_name)
+        subkeys = self.reg_get_subkeys(lapsv1_key_name)
         laps_path = "\\Program Files\\LAPS\\CSE"
 
         for subkey in subkeys:
-            value = self.reg_query_value(self.dce, self.connection, lapsv1_key_name + "\\" + subkey, "DllName")
+            value = self.reg_query_value(lapsv1_key_name + "\\" + subkey, "DllName")
             if isinstance(value, str) and "laps\\cse\\admpwd.dll" in value.lower():
                 reasons.append(f"{lapsv1_key_name}\\...\\DllName matches AdmPwd.dll")
                 success = True
@@ -444,13 +433,13 @@ class HostChecker:
 
     def check_nbtns(self):
         key_name = "HKLM\\SYSTEM\\CurrentControlSet\\Services\\NetBT\\Parameters\\Interfaces"
-        subkeys = self.reg_get_subkeys(self.dce, self.connection, key_name)
+        subkeys = self.reg_get_subkeys(key_name)
         success = False
         reasons = []
         missing = 0
         nbtns_enabled = 0
         for subkey in subkeys:
-            value = self.reg_query_value(self.dce, self.connection, key_name + "\\" + subkey, "NetbiosOptions")
+            value = self.reg_query_value(key_name + "\\" + subkey, "NetbiosOptions")
             if type(value) == DCERPCSessionError:
                 if value.error_code == ERROR_OBJECT_NOT_FOUND:
                     missing += 1
@@ -468,161 +457,100 @@ class HostChecker:
 
     def check_applocker(self):
         key_name = "HKLM\\SOFTWARE\\Policies\\Microsoft\\Windows\\SrpV2"
-        subkeys = self.reg_get_subkeys(self.dce, self.connection, key_name)
+        subkeys = self.reg_get_subkeys(key_name)
         rule_count = 0
         for collection in subkeys:
             collection_key_name = key_name + "\\" + collection
-            rules = self.reg_get_subkeys(self.dce, self.connection, collection_key_name)
+            rules = self.reg_get_subkeys(collection_key_name)
             rule_count += len(rules)
         success = rule_count > 0
         reasons = [f"Found {rule_count} AppLocker rules defined"]
 
         return success, reasons
 
-    def _open_root_key(self, dce, connection, root_key):
-        ans = None
-        retries = 1
-        opener = {"HKLM": rrp.hOpenLocalMachine, "HKCR": rrp.hOpenClassesRoot, "HKU": rrp.hOpenUsers, "HKCU": rrp.hOpenCurrentUser, "HKCC": rrp.hOpenCurrentConfig}
-
-        while retries > 0:
-            try:
-                ans = opener[root_key.upper()](dce)
-                break
-            except KeyError:
-                self.context.log.error(f"HostChecker._open_root_key():{connection.host}: Invalid root key. Must be one of HKCR, HKCC, HKCU, HKLM or HKU")
-                break
-            except Exception as e:
-                self.context.log.error(f"HostChecker._open_root_key():{connection.host}: Error while trying to open {root_key.upper()}: {e}")
-                if "Broken pipe" in e.args:
-                    self.context.log.error("Retrying")
-                    retries -= 1
-        return ans
-
-    def reg_get_subkeys(self, dce, connection, key_name):
-        root_key, subkey = key_name.split("\\", 1)
-        ans = self._open_root_key(dce, connection, root_key)
-        subkeys = []
-        if ans is None:
-            return subkeys
-
-        root_key_handle = ans["phKey"]
+    def reg_get_subkeys(self, key_name):
         try:
-            ans = rrp.hBaseRegOpenKey(dce, root_key_handle, subkey)
+            return self.registry.subkeys(key_name)
         except DCERPCSessionError as e:
             if e.error_code != ERROR_FILE_NOT_FOUND:
-                self.context.log.error(f"HostChecker.reg_get_subkeys(): Could not retrieve subkey {subkey}: {e}\n")
-            return subkeys
+                self.context.log.error(f"HostChecker.reg_get_subkeys(): Could not retrieve subkeys of {key_name}: {e}\n")
         except Exception as e:
-            self.context.log.error(f"HostChecker.reg_get_subkeys(): Error while trying to retrieve subkey {subkey}: {e}\n")
-            return subkeys
-
-        subkey_handle = ans["phkResult"]
-        i = 0
-        while True:
-            try:
-                ans = rrp.hBaseRegEnumKey(dce=dce, hKey=subkey_handle, dwIndex=i)
-                subkeys.append(ans["lpNameOut"][:-1])
-                i += 1
-            except DCERPCSessionError:
-                break
-        return subkeys
+            self.context.log.error(f"HostChecker.reg_get_subkeys(): Error while trying to retrieve subkeys of {key_name}: {e}\n")
+        return []
 
-    def reg_query_value(self, dce, connection, keyName, valueName=None):
-        """Query remote registry data for a given registry value"""
+    def reg_key_values(self, key_name):
+        """Returns the (name, data) tuples of all values of a registry key, converted depending on their type.
 
-        def subkey_values(subkey_handle):
-            dw_index = 0
-            while True:
-                try:
-                    value_type, value_name, value_data = get_value(subkey_handle, dw_index)
-                    yield value_type, value_name, value_data
-                    dw_index += 1
-                except DCERPCSessionError as e:
-                    if e.error_code == ERROR_NO_MORE_ITEMS:
-                        break
-                    else:
-                        self.context.log.error(f"HostChecker.reg_query_value()->sub_key_values(): Received error code {e.error_code}")
-                        return
-
-        def get_value(subkey_handle, dwIndex=0):
-            ans = rrp.hBaseRegEnumValue(dce=dce, hKey=subkey_handle, dwIndex=dwIndex)
-            value_type = ans["lpType"]
-            value_name = ans["lpValueNameOut"]
-            value_data = ans["lpData"]
-
-            # Do any conversion necessary depending on the registry value type
-            if value_type in (REG_VALUE_TYPE_UNICODE_STRING, REG_VALUE_TYPE_UNICODE_STRING_WITH_ENV, REG_VALUE_TYPE_UNICODE_STRING_SEQUENCE):
-                value_data = b"".join(value_data).decode("utf-16")
-            else:
-                value_data = b"".join(value_data)
-                if value_type in (REG_VALUE_TYPE_32BIT_LE, REG_VALUE_TYPE_64BIT_LE):
+        All values of a key are read at once and kept, the checks reading several values of the same key reuse them.
+        """
+        path = key_name.lower()
+        if path not in self.key_values:
+            values = []
+            for value_name, value_type, value_data in self.registry.enum_values(key_name):
+                # Do any conversion necessary depending on the registry value type
+                if value_type in (REG_VALUE_TYPE_UNICODE_STRING, REG_VALUE_TYPE_UNICODE_STRING_WITH_ENV, REG_VALUE_TYPE_UNICODE_STRING_SEQUENCE):
+                    value_data = value_data.decode("utf-16")
+                elif value_type in (REG_VALUE_TYPE_32BIT_LE, REG_VALUE_TYPE_64BIT_LE):
                     value_data = int.from_bytes(value_data, "little")
                 elif value_type == REG_VALUE_TYPE_32BIT_BE:
                     value_data = int.from_bytes(value_data, "big")
+                values.append((value_name, value_data))
+            self.key_values[path] = values
+        return self.key_values[path]
 
-            return value_type, value_name[:-1], value_data
-
-        try:
-            root_key, subkey = keyName.split("\\", 1)
-        except ValueError:
-            self.context.log.error(f"HostChecker.reg_query_value(): Could not split keyname {keyName}")
-
-        ans = self._open_root_key(dce, connection, root_key)
-        if ans is None:
-            return ans
-
-        root_key_handle = ans["phKey"]
+    def reg_query_value(self, keyName, valueName=None):
+        """Query remote registry data for a given registry value"""
         try:
-            ans = rrp.hBaseRegOpenKey(dce, root_key_handle, subkey)
+            values = self.reg_key_values(keyName)
         except DCERPCSessionError as e:
-            if e.error_code == ERROR_FILE_NOT_FOUND:
-                return e
-
-        subkey_handle = ans["phkResult"]
+            if e.error_code != ERROR_FILE_NOT_FOUND:
+                self.context.log.error(f"HostChecker.reg_query_value(): Received error code {e.error_code} reading {keyName}")
+            return e
+        except Exception as e:
+            self.context.log.error(f"HostChecker.reg_query_value():{self.connection.host}: Error while reading {keyName}: {e}")
+            return None
 
-        if valueName is None:
-            return get_value(subkey_handle)[2]
-        else:
-            for _, name, data in subkey_values(subkey_handle):
-                if name.upper() == valueName.upper():
-                    return data
-            return DCERPCSessionError(error_code=ERROR_OBJECT_NOT_FOUND)
+        for name, data in values:
+            if valueName is None or name.upper() == valueName.upper():
+                return data
+        return DCERPCSessionError(error_code=ERROR_OBJECT_NOT_FOUND)
 
     def get_service(self, service_name, connection):
         """Get the service status and configuration for specified service"""
-        remoteOps = RemoteOperations(smbConnection=connection.conn, doKerberos=False)
-        machine_name, _ = remoteOps.getMachineNameAndDomain()
-        remoteOps._RemoteOperations__connectSvcCtl()
-        dce = remoteOps._RemoteOperations__scmr
+        # Reuse the svcctl binding of the registry session instead of binding the pipe again
+        remote_ops = self.registry.get_remote_ops()
+        machine_name, _ = remote_ops.getMachineNameAndDomain()
+        dce = remote_ops._RemoteOperations__scmr
         scm_handle = scmr.hROpenSCManagerW(dce, machine_name)["lpScHandle"]
         service_handle = scmr.hROpenServiceW(dce, scm_handle, service_name)["lpServiceHandle"]
         service_config = scmr.hRQueryServiceConfigW(dce, service_handle)["lpServiceConfig"]
         service_status = scmr.hRQueryServiceStatus(dce, service_handle)["lpServiceStatus"]["dwCurrentState"]
-        remoteOps.finish()
+        scmr.hRCloseServiceHandle(dce, service_handle)
+        scmr.hRCloseServiceHandle(dce, scm_handle)
 
         return service_config, service_status
 
     def get_user_info(self, connection, rid=501):
         """Get user information for the user with the specified RID"""
-        remote_ops = RemoteOperations(smbConnection=connection.conn, doKerberos=False)
-        machine_name, domain_name = remote_ops.getMachineNameAndDomain()
+        if self.samr is None:
+            remote_ops = self.registry.get_remote_ops()
+            machine_name, domain_name = remote_ops.getMachineNameAndDomain()
 
-        try:
-            remote_ops.connectSamr(machine_name)
-        except samr.DCERPCSessionError:
-            # If connecting to machine_name didn't work, it's probably because
-            # we're dealing with a domain controller, so we need to use the
-            # actual domain name instead of the machine name, because DCs don't
-            # use the SAM
-            remote_ops.connectSamr(domain_name)
-
-        dce = remote_ops._RemoteOperations__samr
-        domain_handle = remote_ops._RemoteOperations__domainHandle
+            try:
+                remote_ops.connectSamr(machine_name)
+            except samr.DCERPCSessionError:
+                # If connecting to machine_name didn't work, it's probably because
+                # we're dealing with a domain controller, so we need to use the
+                # actual domain name instead of the machine name, because DCs don't
+                # use the SAM
+                remote_ops.connectSamr(domain_name)
+            self.samr = (remote_ops._RemoteOperations__samr, remote_ops._RemoteOperations__domainHandle)
+
+        dce, domain_handle = self.samr
         user_handle = samr.hSamrOpenUser(dce, domain_handle, userId=rid)["UserHandle"]
         user_info = samr.hSamrQueryInformationUser2(dce, user_handle, samr.USER_INFORMATION_CLASS.UserAllInformation)
-        user_info = user_info["Buffer"]["All"]
-        remote_ops.finish()
-        return user_info
+        samr.hSamrCloseHandle(dce, user_handle)
+        return user_info["Buffer"]["All"]
 
     def ls(self, smb, path="\\", share="C$"):
         file_listing = []
@@ -1,5 +1,8 @@
 import sys
 from nxc.helpers.logger import highlight
+from nxc.helpers.kerberos import ticket_cache
+from nxc.helpers.profiler import profiler
+from nxc.helpers.governor import governor
 from nxc.helpers.misc import identify_target_file
 from nxc.parsers.ip import parse_targets
 from nxc.parsers.nmap import parse_nmap_xml
@@ -13,7 +16,9 @@ from nxc.console import nxc_console
 from nxc.logger import nxc_logger
 from nxc.config import nxc_config, nxc_workspace, config_log, ignore_opsec
 from nxc.database import create_db_engine
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from threading import BoundedSemaphore
 import asyncio
 from nxc.helpers import powershell
 import shutil
@@ -39,31 +44,39 @@ if platform.system() != "Windows":
     resource.setrlimit(resource.RLIMIT_NOFILE, file_limit)
 
 
+def run_target(protocol_obj, args, db, target):
+    """Runs the protocol against a single target, the connection object is released as soon as it returns"""
+    try:
+        protocol_obj(args, db, target)
+    except Exception as e:
+        nxc_logger.exception(f"Exception for target {target}: {e}")
+
+
 async def start_run(protocol_obj, args, db, targets):
-    futures = []
     nxc_logger.debug("Creating ThreadPoolExecutor")
-    if args.no_progress or len(targets) == 1:
-        with ThreadPoolExecutor(max_workers=args.threads) as executor:
-            nxc_logger.debug(f"Creating thread for {protocol_obj}")
-            futures = [executor.submit(protocol_obj, args, db, target) for target in targets]
-    else:
-        with Progress(console=nxc_console) as progress, ThreadPoolExecutor(max_workers=args.threads) as executor:
-            current = 0
-            total = len(targets)
-            tasks = progress.add_task(
+    total = len(targets)
+    # Targets are only submitted as threads free up and the futures are not kept, so neither the queue of pending
+    # targets nor the finished connections (with their sockets, loggers and module state) grow with the target count
+    slots = BoundedSemaphore(args.threads * 2)
+    with ExitStack() as stack:
+        progress = None
+        if not args.no_progress and total > 1:
+            progress = stack.enter_context(Progress(console=nxc_console))
+            task = progress.add_task(
                 f"[green]Running nxc against {total} {'target' if total == 1 else 'targets'}",
                 total=total,
             )
-            nxc_logger.debug(f"Creating thread for {protocol_obj}")
-            futures = [executor.submit(protocol_obj, args, db, target) for target in targets]
-            for _ in as_completed(futures):
-                current += 1
-                progress.update(tasks, completed=current)
-    for future in as_completed(futures):
-        try:
-            future.result()
-        except Exception:
-            nxc_logger.exception(f"Exception for target {targets[futures.index(future)]}: {future.exception()}")
+
+        def target_done(_):
+            slots.release()
+            if progress:
+                progress.advance(task)
+
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=args.threads))
+        nxc_logger.debug(f"Creating thread for {protocol_obj}")
+        for target in targets:
+            slots.acquire()
+            executor.submit(run_target, protocol_obj, args, db, target).add_done_callback(target_done)
 
 
 def main():
@@ -219,6 +232,18 @@ def main():
     if args.jitter and len(targets) > 1:
         nxc_logger.highlight(highlight("[!] Jitter is only throttling authentications per target!", "red"))
 
+    if hasattr(args, "ps_execute") and args.ps_execute and hasattr(args, "obfs"):
+        # Build (and obfuscate) the payload once here instead of in every thread running it
+        powershell.precompute_ps_commands(args)
+
+    if args.protocol == "mssql":
+        # Ask the SQL Browser of every target for its instances at once, they are then run against the instance ports
+        from nxc.protocols.mssql.browser import sql_browser
+        targets = asyncio.run(sql_browser.discover(targets, args))
+
+    profiler.enabled = args.profile or bool(args.profile_export)
+    governor.configure(args.max_connections, args.max_host_connections)
+
     try:
         asyncio.run(start_run(protocol_object, args, db, targets))
     except KeyboardInterrupt:
@@ -226,6 +251,13 @@ def main():
     finally:
         if module_server:
             module_server.shutdown()
+        if args.save_kcache:
+            ticket_cache.export(args.save_kcache)
+        if args.profile:
+            profiler.report()
+        governor.report(display=args.profile)
+        if args.profile_export:
+            profiler.export(args.profile_export, args.profile_format)
         db_engine.dispose()
 
 
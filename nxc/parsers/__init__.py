@@ -0,0 +1,9 @@
+def port_rank(protocol_dict, port, service, protocol):
+    """Returns the preference of a reported port for the protocol of protocol_dict (lower is better) or None if it does not match"""
+    ports = protocol_dict.get(protocol, {}).get("ports", [])
+    if port in ports:
+        return ports.index(port)
+    # Services reported on other ports, e.g. a web server on 8000, are only matched if the port itself is unknown
+    if service in protocol_dict.get(protocol, {}).get("services", []):
+        return len(ports)
+    return None
@@ -1,41 +1,51 @@
-import xmltodict
+from xml.etree.ElementTree import iterparse
 
-# Ideally i'd like to be able to pull this info out dynamically from each protocol object but i'm a lazy bastard
+from nxc.logger import nxc_logger
+from nxc.parsers import port_rank
+
+# Ports are listed by preference, the first one found open on a host is the one connected to
 protocol_dict = {
-    "smb": {"ports": [445, 139], "services": ["smb", "cifs"]},
+    "ftp": {"ports": [21], "services": ["ftp"]},
+    "smb": {"ports": [445, 139], "services": ["cifs", "smb"]},
     "mssql": {"ports": [1433], "services": ["mssql"]},
     "ssh": {"ports": [22], "services": ["ssh"]},
-    "winrm": {"ports": [5986, 5985], "services": ["www", "https?"]},
+    "ldap": {"ports": [389, 636], "services": ["ldap"]},
+    "rdp": {"ports": [3389], "services": ["msrdp"]},
+    "winrm": {"ports": [5985, 5986], "services": ["www", "https?"]},
+    "vnc": {"ports": [5900, 5901, 5902, 5903, 5904, 5905, 5906], "services": ["vnc"]},
     "http": {"ports": [80, 443, 8443, 8008, 8080, 8081], "services": ["www", "https?"]},
 }
 
 
 def parse_nessus_file(nessus_file, protocol):
-    targets = []
-
-    def handle_nessus_file(path, item):
-        # Must return True otherwise xmltodict will throw a ParsingIterrupted() exception
-        # https://github.com/martinblech/xmltodict/blob/master/xmltodict.py#L219
-
-        if any("ReportHost" and "ReportItem" in values for values in path):
-            item = dict(path)
-            ip = item["ReportHost"]["name"]
-            if ip in targets:
-                return True
-
-            port = item["ReportItem"]["port"]
-            svc_name = item["ReportItem"]["svc_name"]
-
-            if port in protocol_dict[protocol]["ports"]:
-                targets.append(ip)
-            if svc_name in protocol_dict[protocol]["services"]:
-                targets.append(ip)
-
-            return True
-        else:
-            return True
-
-    with open(nessus_file) as file_handle:
-        xmltodict.parse(file_handle, item_depth=4, item_callback=handle_nessus_file)
-
-    return targets
+    """Yields a (host, port) tuple for each host of the report with a service of the protocol.
+
+    The report is streamed, every ReportItem is cleared once handled so multi-GB exports are imported with constant
+    memory. Hosts are only yielded once, with the preferred port found.
+    """
+    seen = set()
+    best = None
+    report = None
+
+    for event, elem in iterparse(nessus_file, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "Report":
+                report = elem
+            elif elem.tag == "ReportHost":
+                best = None
+            continue
+
+        if elem.tag == "ReportItem":
+            port = int(elem.get("port", 0))
+            rank = port_rank(protocol_dict, port, elem.get("svc_name"), protocol) if port else None
+            if rank is not None and (best is None or rank < best[0]):
+                best = (rank, port)
+            elem.clear()
+        elif elem.tag == "ReportHost":
+            host = elem.get("name")
+            if best is not None and host and host not in seen:
+                seen.add(host)
+                nxc_logger.debug(f"Target parsed from Nessus scan: {host}:{best[1]}")
+                yield host, best[1]
+            # Drop the handled host from its report, otherwise the report keeps one element per host
+            report.clear()
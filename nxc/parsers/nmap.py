@@ -1,28 +1,53 @@
-from libnmap.parser import NmapParser
+from xml.etree.ElementTree import iterparse
+
 from nxc.logger import nxc_logger
+from nxc.parsers import port_rank
 
-# right now we are only referencing the port numbers, not the service name, but this should be sufficient for 99% cases
+# Ports are listed by preference, the first one found open on a host is the one connected to
 protocol_dict = {
-    "Ftp": {"ports": [21], "services": ["Ftp"]},
+    "ftp": {"ports": [21], "services": ["ftp"]},
     "ssh": {"ports": [22, 2222], "services": ["ssh"]},
-    "smb": {"ports": [139, 445], "services": ["netbios-ssn", "microsoft-ds"]},
+    "smb": {"ports": [445, 139], "services": ["microsoft-ds", "netbios-ssn"]},
     "ldap": {"ports": [389, 636], "services": ["ldap", "ldaps"]},
     "mssql": {"ports": [1433], "services": ["ms-sql-s"]},
     "rdp": {"ports": [3389], "services": ["ms-wbt-server"]},
     "winrm": {"ports": [5985, 5986], "services": ["wsman"]},
     "vnc": {"ports": [5900, 5901, 5902, 5903, 5904, 5905, 5906], "services": ["vnc"]},
+    "wmi": {"ports": [135], "services": ["msrpc"]},
 }
 
 
 def parse_nmap_xml(nmap_output_file, protocol):
-    nmap_report = NmapParser.parse_fromfile(nmap_output_file)
-    targets = []
+    """Yields a (ip, port) tuple for each host of the report with a port open for the protocol.
+
+    The report is streamed, every host element is cleared once handled so the memory used does not depend on the size
+    of the report. Hosts are only yielded once, with the preferred port found open.
+    """
+    seen = set()
+    best = None
+    events = iterparse(nmap_output_file, events=("start", "end"))
+    _, root = next(events)
 
-    for host in nmap_report.hosts:
-        for port, _proto in host.get_open_ports():
-            if port in protocol_dict[protocol]["ports"]:
-                targets.append(host.ipv4)
-                break
-    nxc_logger.debug(f"Targets parsed from Nmap scan: {targets}")
+    for event, elem in events:
+        if event == "start":
+            if elem.tag == "host":
+                best = None
+            continue
 
-    return targets
+        if elem.tag == "port":
+            state = elem.find("state")
+            service = elem.find("service")
+            if state is not None and state.get("state") == "open":
+                port = int(elem.get("portid"))
+                rank = port_rank(protocol_dict, port, service.get("name") if service is not None else None, protocol)
+                if rank is not None and (best is None or rank < best[0]):
+                    best = (rank, port)
+            elem.clear()
+        elif elem.tag == "host":
+            addresses = {address.get("addrtype"): address.get("addr") for address in elem.iter("address")}
+            ip = addresses.get("ipv4", addresses.get("ipv6"))
+            if best is not None and ip and ip not in seen:
+                seen.add(ip)
+                nxc_logger.debug(f"Target parsed from Nmap scan: {ip}:{best[1]}")
+                yield ip, best[1]
+            root.clear()
@@ -1,14 +1,23 @@
 import os
+import posixpath
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock, local
 from nxc.config import process_secret
 from nxc.connection import connection
 from nxc.helpers.logger import highlight
 from nxc.logger import NXCAdapter
-from ftplib import FTP, error_perm
+from ftplib import FTP, all_errors, error_perm, error_temp
+
+# Block size of --get/--put, ftplib defaults to 8 KB
+TRANSFER_BLOCK_SIZE = 1024 * 1024
 
 class ftp(connection):
     def __init__(self, args, db, host):
         self.protocol = "FTP"
         self.remote_version = None
+        self.mlsd = None
 
         super().__init__(args, db, host)
 
@@ -47,13 +56,29 @@ class ftp(connection):
             return False
         return True
 
+    def authenticate(self, username, password):
+        """Sends USER/PASS over the control connection, which is kept open after a failed login for the next attempt.
+
+        Servers closing the connection after some failures (or answering 421) get a new one and the login is retried once.
+        """
+        for attempt in range(2):
+            if not self.conn.sock and not self.create_conn_obj():
+                raise EOFError("could not reconnect to the FTP service")
+            try:
+                return self.conn.login(user=username, passwd=password)
+            except (EOFError, OSError, error_temp) as e:
+                self.conn.close()
+                if attempt:
+                    raise
+                self.logger.debug(f"Control connection closed by the server ({e}), reconnecting")
+
     def plaintext_login(self, username, password):
-        if not self.conn.sock:
-            self.create_conn_obj()
         try:
-            self.logger.debug(self.conn.sock)
-            resp = self.conn.login(user=username, passwd=password)
+            resp = self.authenticate(username, password)
             self.logger.debug(f"Response: {resp}")
+        except error_perm as e:
+            self.logger.fail(f"{username}:{process_secret(password)} (Response:{e})")
+            return False
         except Exception as e:
             self.logger.fail(f"{username}:{process_secret(password)} (Response:{e})")
             self.conn.close()
@@ -76,29 +101,25 @@ class ftp(connection):
 
         if self.args.ls:
             # If the default directory is specified, then we will list the current directory
-            if self.args.ls == ".":
-                files = self.list_directory_full()
-                # If files is false, then we encountered an exception
-                if not files:
-                    return False
-                # If there are files, then we can list the files
-                self.logger.display("Directory Listing")
-                for file in files:
-                    self.logger.highlight(file)
-            else:
-                # If the default directory is not specified, then we will list the specified directory
-                self.logger.display(f"Directory Listing for {self.args.ls}")
+            root = "" if self.args.ls == "." else self.args.ls
+            if root:
                 # Change to the specified directory
                 try:
-                    self.conn.cwd(self.args.ls)
+                    self.conn.cwd(root)
                 except error_perm as error_message:
                     self.logger.fail(f"Failed to change directory. Response: ({error_message})")
                     self.conn.close()
                     return False
-                # List the files in the specified directory
-                files = self.list_directory_full()
-                for file in files:
-                    self.logger.highlight(file)
+            self.logger.display(f"Directory Listing for {root}" if root else "Directory Listing")
+            # Entries are printed as they come in instead of once the whole listing was received
+            try:
+                directories = self.list_directory(callback=self.logger.highlight, directories=bool(self.args.depth))
+            except error_perm as error_message:
+                self.logger.fail(f"Failed to list directory. Response: ({error_message})")
+                self.conn.close()
+                return False
+            if self.args.depth:
+                self.walk([posixpath.join(root, directory) for directory in directories], username, password)
 
         if self.args.get:
             self.get_file(f"{self.args.get}")
@@ -111,17 +132,75 @@ class ftp(connection):
             return True
         self.conn.close()
 
-    def list_directory_full(self):
-        # in the future we can use mlsd/nlst if we want, but this gives a full output like `ls -la`
-        # ftplib's "dir" prints directly to stdout, and "nlst" only returns the folder name, not full details
-        files = []
+    def list_directory(self, path="", callback=None, conn=None, directories=False):
+        """Streams the LIST output of a directory, `ls -la` like with permissions and owners, to callback as it arrives.
+
+        With directories, the names of its subdirectories are returned. They are taken from the MLSD facts where the
+        server supports it, which tell the directories apart reliably, otherwise parsed from the LIST output.
+        """
+        conn = conn or self.conn
+        listed = []
+
+        def list_entry(line):
+            fields = line.split(None, 8)
+            if line.startswith("d") and len(fields) == 9 and fields[8] not in (".", ".."):
+                listed.append(fields[8])
+            callback(f"{path}: {line}" if path else line)
+
+        conn.retrlines(f"LIST {path}".strip(), callback=list_entry)
+        if not directories or self.mlsd is False:
+            return listed
+
+        found = []
+
+        def mlsd_entry(line):
+            facts, _, name = line.partition(" ")
+            facts = {fact.lower(): value for fact, _, value in (item.partition("=") for item in facts.split(";") if item)}
+            if facts.get("type", "").lower() == "dir":
+                found.append(name)
+
         try:
-            self.conn.retrlines("LIST", callback=files.append)
-        except error_perm as error_message:
-            self.logger.fail(f"Failed to list directory. Response: ({error_message})")
-            self.conn.close()
-            return False
-        return files
+            conn.retrlines(f"MLSD {path}".strip(), callback=mlsd_entry)
+        except error_perm as e:
+            # 500/502: the command is not implemented
+            if str(e)[:3] in ("500", "502"):
+                self.mlsd = False
+            self.logger.debug(f"MLSD failed ({e}), taking the directories from LIST")
+            return listed
+        self.mlsd = True
+        return found
+
+    def walk(self, directories, username, password):
+        """Lists the subdirectories down to --depth, one level at a time spread over --ls-workers control connections"""
+        workers = local()
+        connections = []
+        lock = Lock()
+
+        def list_subdirectory(path, directories):
+            try:
+                if not hasattr(workers, "conn"):
+                    worker_conn = FTP()
+                    worker_conn.connect(host=self.host, port=self.port)
+                    with lock:
+                        connections.append(worker_conn)
+                    worker_conn.login(user=username, passwd=password)
+                    workers.conn = worker_conn
+                return [posixpath.join(path, directory) for directory in self.list_directory(path, self.logger.highlight, workers.conn, directories)]
+            except all_errors as e:
+                self.logger.fail(f"Failed to list directory {path}. Response: ({e})")
+                return []
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.args.ls_workers) as executor:
+                for level in range(self.args.depth):
+                    if not directories:
+                        break
+                    # The subdirectories of the last level listed are not needed
+                    lister = partial(list_subdirectory, directories=level < self.args.depth - 1)
+                    directories = [directory for subdirectories in executor.map(lister, directories) for directory in subdirectories]
+        finally:
+            for worker_conn in connections:
+                worker_conn.close()
 
     def get_file(self, filename):
         # Extract the filename from the path
@@ -131,10 +210,16 @@ class ftp(connection):
             if self.conn.encoding == "utf-8":
                 # Switch the connection to binary
                 self.conn.sendcmd("TYPE I")
-            # Check if the file exists 
-            self.conn.size(filename)
+            # Check if the file exists
+            remote_size = self.conn.size(filename)
+            # With --resume, restart the download (REST) where the local partial file ends
+            offset = os.path.getsize(downloaded_file) if self.args.resume and os.path.isfile(downloaded_file) else 0
+            if offset and remote_size is not None and offset >= remote_size:
+                self.logger.success(f"Already downloaded: {filename}")
+                return True
             # Attempt to download the file
-            self.conn.retrbinary(f"RETR {filename}", open(downloaded_file, "wb").write)  # noqa: SIM115
+            with open(downloaded_file, "ab" if offset else "wb") as local_file:
+                self.conn.retrbinary(f"RETR {filename}", local_file.write, blocksize=TRANSFER_BLOCK_SIZE, rest=offset or None)
         except error_perm as error_message:
             self.logger.fail(f"Failed to download the file. Response: ({error_message})")
             self.conn.close()
@@ -151,8 +236,16 @@ class ftp(connection):
 
     def put_file(self, local_file, remote_file):
         try:
+            offset = 0
+            if self.args.resume:
+                # With --resume, restart the upload (REST) where the remote partial file ends
+                with contextlib.suppress(error_perm):
+                    self.conn.sendcmd("TYPE I")
+                    offset = self.conn.size(remote_file) or 0
             # Attempt to upload the file
-            self.conn.storbinary(f"STOR {remote_file}", open(local_file, "rb"))  # noqa: SIM115
+            with open(local_file, "rb") as upload:
+                upload.seek(offset)
+                self.conn.storbinary(f"STOR {remote_file}", upload, blocksize=TRANSFER_BLOCK_SIZE, rest=offset or None)
         except error_perm as error_message:
             self.logger.fail(f"Failed to upload file. Response: ({error_message})")
             return False
@@ -1,4 +1,4 @@
-from nxc.helpers.args import DisplayDefaultsNotNone
+from nxc.helpers.args import DisplayDefaultsNotNone, positive_int
 
 
 def proto_args(parser, parents):
@@ -9,4 +9,7 @@ def proto_args(parser, parents):
     cgroup.add_argument("--ls", metavar="DIRECTORY", nargs="?", const=".", help="List files in the directory")
     cgroup.add_argument("--get", metavar="FILE", help="Download a file")
     cgroup.add_argument("--put", metavar=("LOCAL_FILE", "REMOTE_FILE"), nargs=2, help="Upload a file")
+    cgroup.add_argument("--depth", type=int, default=0, help="Recurse into the subdirectories of --ls down to this depth")
+    cgroup.add_argument("--ls-workers", type=positive_int, default=4, help="Number of control connections listing the subdirectories with --depth")
+    cgroup.add_argument("--resume", action="store_true", help="Resume --get/--put from the size of the partial file (REST)")
     return parser
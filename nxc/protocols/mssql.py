@@ -9,8 +9,10 @@ from nxc.connection import connection
 from nxc.connection import requires_admin
 from nxc.logger import NXCAdapter
 from nxc.helpers.bloodhound import add_user_bh
+from nxc.helpers.kerberos import ticket_cache
 from nxc.helpers.ntlm_parser import parse_challenge
 from nxc.helpers.powershell import create_ps_command
+from nxc.protocols.mssql.browser import sql_browser
 from nxc.protocols.mssql.mssqlexec import MSSQLEXEC
 
 from impacket import tds, ntlm
@@ -31,7 +33,8 @@ from impacket.tds import (
 
 class mssql(connection):
     def __init__(self, args, db, host):
-        self.mssql_instances = []
+        # Instances reported by the SQL Browser sweep run before the targets
+        self.mssql_instances = sql_browser.instances.get(host[0] if isinstance(host, tuple) else host, [])
         self.domain = ""
         self.targetDomain = ""
         self.server_os = None
@@ -56,18 +59,15 @@ class mssql(connection):
         try:
             self.conn = tds.MSSQL(self.host, self.port, self.remoteName)
             # Default has not timeout option in tds.MSSQL.connect() function, let rewrite it.
-            af, socktype, proto, canonname, sa = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0]
-            sock = socket.socket(af, socktype, proto)
+            # The target was already resolved by the connection, self.host is an address unless using kerberos
+            sock = socket.socket(socket.AF_INET6 if self.is_ipv6 else socket.AF_INET, socket.SOCK_STREAM)
             sock.settimeout(self.args.mssql_timeout)
-            sock.connect(sa)
+            sock.connect((self.host, self.port))
             self.conn.socket = sock
-            if not self.is_mssql:
-                self.conn.preLogin()
         except Exception as e:
             self.logger.debug(f"Error connecting to MSSQL service on host: {self.host}, reason: {e}")
             return False
         else:
-            self.is_mssql = True
             return True
 
     def reconnect_mssql(func):
@@ -89,9 +89,7 @@ class mssql(connection):
             if is_admin:
                 self.admin_privs = True
     
-    @reconnect_mssql
     def enum_host_info(self):
-        challenge = None
         try:
             login = tds.TDS_LOGIN()
             login["HostName"] = ""
@@ -107,25 +105,32 @@ class mssql(connection):
             login["SSPI"] = auth.getData()
             login["Length"] = len(login.getData())
 
-            # Get number of mssql instance
-            self.mssql_instances = self.conn.getInstances(0)
-
             # Send the NTLMSSP Negotiate or SQL Auth Packet
             self.conn.sendTDS(tds.TDS_LOGIN7, login.getData())
 
             tdsx = self.conn.recvTDS()
+        except Exception as e:
+            self.logger.info(f"Failed to receive the answer to the login, reason: {e!s}")
+            return False
+
+        # Any TDS answer to the login tells the port is MSSQL, no separate pre-login probe is needed. Servers without
+        # usable SSPI answer with an error instead of the challenge, SQL logins are still tried against them
+        if tdsx["Type"] != tds.TDS_TABULAR:
+            self.logger.info(f"Unexpected answer to the login, packet type: {tdsx['Type']}")
+            return False
+        self.is_mssql = True
+        try:
             challenge = tdsx["Data"][3:]
             self.logger.info(f"NTLM challenge: {challenge!s}")
+            ntlm_info = parse_challenge(challenge)
         except Exception as e:
             self.logger.info(f"Failed to receive NTLM challenge, reason: {e!s}")
-            return False
         else:
-            ntlm_info = parse_challenge(challenge)
             self.targetDomain = self.domain = ntlm_info["domain"]
             self.hostname = ntlm_info["hostname"]
             self.server_os = ntlm_info["os_version"]
             self.logger.extra["hostname"] = self.hostname
-            self.db.add_host(self.host, self.hostname, self.targetDomain, self.server_os, len(self.mssql_instances),)
+        self.db.add_host(self.host, self.hostname, self.targetDomain, self.server_os, len(self.mssql_instances),)
 
         if self.args.domain:
             self.domain = self.args.domain
@@ -140,6 +145,8 @@ class mssql(connection):
             self.logger.info(f"Resolved domain: {self.domain} with dns, kdcHost: {self.kdcHost}")
 
     def print_host_info(self):
+        if not self.is_mssql:
+            return False
         self.logger.display(f"{self.server_os} (name:{self.hostname}) (domain:{self.targetDomain})")
         return True
 
@@ -176,6 +183,9 @@ class mssql(connection):
 
         used_ccache = " from ccache" if useCache else f":{process_secret(kerb_pass)}"
         try:
+            tgs = None
+            if not useCache and self.username:
+                tgs = ticket_cache.get_tgs(f"MSSQLSvc/{self.remoteName}:{self.port}", self.username, self.password, self.domain, "", self.nthash, aesKey, kdcHost)
             res = self.conn.kerberosLogin(
                 None,
                 self.username,
@@ -184,6 +194,7 @@ class mssql(connection):
                 hashes,
                 aesKey,
                 kdcHost=kdcHost,
+                TGS=tgs,
                 useCache=useCache,
             )
             if res is not True:
@@ -0,0 +1,110 @@
+import asyncio
+import socket
+from ipaddress import ip_address
+
+from impacket.tds import SQLR, SQLR_CLNT_UCAST_EX, SQLR_PORT, SQLR_Response
+
+from nxc.logger import nxc_logger
+
+
+class BrowserProtocol(asyncio.DatagramProtocol):
+    def __init__(self, responses):
+        self.responses = responses
+
+    def datagram_received(self, data, addr):
+        self.responses.setdefault(addr[0], data)
+
+    def error_received(self, exc):
+        # ICMP port unreachable of hosts without a SQL Browser
+        nxc_logger.debug(f"SQL Browser sweep: {exc}")
+
+
+class SQLBrowser:
+    """Instances reported by the SQL Server Browser service (UDP 1434) of all the targets, collected by one sweep.
+
+    The CLNT_UCAST_EX probes are sent to every target from a single socket before the run and the answers are collected
+    as they come in, instead of one blocking query from within the thread of each host. Targets are then run against the
+    TCP port of each of their instances, named instances on dynamic ports included.
+    """
+
+    def __init__(self):
+        self.instances = {}
+
+    @staticmethod
+    def parse(data):
+        """Parses a SVR_RESP into a list of dicts, one per instance (ServerName, InstanceName, Version, tcp...)"""
+        instances = []
+        for entry in SQLR_Response(data)["Data"].split(b";;")[:-1]:
+            fields = entry.decode("utf-8", errors="replace").split(";")
+            instances.append(dict(zip(fields[::2], fields[1::2])))
+        return instances
+
+    @staticmethod
+    async def resolve(loop, target):
+        try:
+            return ip_address(target).compressed
+        except ValueError:
+            try:
+                return (await loop.getaddrinfo(target, SQLR_PORT, type=socket.SOCK_DGRAM))[0][4][0]
+            except OSError as e:
+                nxc_logger.debug(f"SQL Browser sweep: could not resolve {target}: {e}")
+
+    async def sweep(self, targets, timeout):
+        """Queries the SQL Browser of all the targets, the answers are waited for up to timeout seconds after the last probe"""
+        loop = asyncio.get_running_loop()
+        addresses = await asyncio.gather(*(self.resolve(loop, target) for target in targets))
+
+        responses = {}
+        transports = {}
+        probe = SQLR()
+        probe["OpCode"] = SQLR_CLNT_UCAST_EX
+        probe = probe.getData()
+        probed = set()
+        try:
+            for i, address in enumerate(addresses):
+                if address is None:
+                    continue
+                probed.add(address)
+                family = socket.AF_INET6 if ":" in address else socket.AF_INET
+                if family not in transports:
+                    transports[family], _ = await loop.create_datagram_endpoint(lambda: BrowserProtocol(responses), family=family)
+                transports[family].sendto(probe, (address, SQLR_PORT))
+                # Let the answers of the first targets in while probing the next ones
+                if i % 256 == 255:
+                    await asyncio.sleep(0)
+            deadline = loop.time() + timeout
+            while len(responses) < len(probed) and loop.time() < deadline:
+                await asyncio.sleep(0.05)
+        finally:
+            for transport in transports.values():
+                transport.close()
+
+        for target, address in zip(targets, addresses):
+            if address in responses:
+                try:
+                    self.instances[target] = self.parse(responses[address])
+                except Exception as e:
+                    nxc_logger.debug(f"SQL Browser sweep: invalid answer from {target}: {e}")
+        nxc_logger.debug(f"SQL Browser sweep: {len(self.instances)} of {len(targets)} targets answered")
+
+    async def discover(self, targets, args):
+        """Returns the targets with a (target, port) tuple for each instance listening on TCP.
+
+        Targets which already come with a port, or all of them if --port was given, are left as they are.
+        """
+        await self.sweep([target for target in targets if not isinstance(target, tuple)], args.browser_timeout)
+        if args.port is not None:
+            return targets
+        args.port = 1433
+
+        discovered = []
+        for target in targets:
+            ports = [] if isinstance(target, tuple) else list(dict.fromkeys(int(instance["tcp"]) for instance in self.instances.get(target, []) if instance.get("tcp", "").isdigit()))
+            if ports:
+                discovered.extend((target, port) for port in ports)
+            else:
+                discovered.append(target)
+        return discovered
+
+
+sql_browser = SQLBrowser()
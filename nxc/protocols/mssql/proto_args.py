@@ -4,7 +4,8 @@ from nxc.helpers.args import DisplayDefaultsNotNone
 def proto_args(parser, parents):
     mssql_parser = parser.add_parser("mssql", help="own stuff using MSSQL", parents=parents, formatter_class=DisplayDefaultsNotNone)
     mssql_parser.add_argument("-H", "--hash", metavar="HASH", dest="hash", nargs="+", default=[], help="NTLM hash(es) or file(s) containing NTLM hashes")
-    mssql_parser.add_argument("--port", default=1433, type=int, metavar="PORT", help="MSSQL port")
+    mssql_parser.add_argument("--port", type=int, metavar="PORT", help="MSSQL port (default: 1433, or the ports of the instances reported by the SQL Browser)")
+    mssql_parser.add_argument("--browser-timeout", type=int, default=2, help="seconds to wait for the SQL Browser (UDP 1434) of the targets to answer")
     mssql_parser.add_argument("--mssql-timeout", help="SQL server connection timeout", type=int, default=5)
     mssql_parser.add_argument("-q", "--query", dest="mssql_query", metavar="QUERY", type=str, help="execute the specified query against the MSSQL DB")
 
@@ -1,4 +1,5 @@
 import asyncio
+import inspect
 import os
 from datetime import datetime
 from os import getenv
@@ -16,12 +17,19 @@ from aardwolf.connection import RDPConnection
 from aardwolf.commons.queuedata.constants import VIDEO_FORMAT
 from aardwolf.commons.iosettings import RDPIOSettings
 from aardwolf.commons.target import RDPTarget
-from aardwolf.protocol.x224.constants import SUPP_PROTOCOLS
+from aardwolf.network.tpkt import TPKTPacketizer
+from aardwolf.network.x224 import X224Network
+from aardwolf.protocol.x224.constants import SUPP_PROTOCOLS, FAIL_CODE
 from asyauth.common.credentials.ntlm import NTLMCredential
 from asyauth.common.credentials.kerberos import KerberosCredential
 from asyauth.common.constants import asyauthSecret
+from asysocks.unicomm.client import UniClient
 from asysocks.unicomm.common.target import UniTarget, UniProto
 
+# aardwolf only stops after the CredSSP exchange with connect(auth_only=True) since 0.2.16, older releases go on
+# with the whole connection, which fails on the fake credentials of the fingerprint once the NTLM info is in
+AUTH_ONLY = "auth_only" in inspect.signature(RDPConnection.connect).parameters
+
 
 class rdp(connection):
     def __init__(self, args, db, host):
@@ -31,18 +39,6 @@ class rdp(connection):
         self.iosettings.channels = []
         self.iosettings.video_out_format = VIDEO_FORMAT.RAW
         self.iosettings.clipboard_use_pyperclip = False
-        self.protoflags_nla = [
-            SUPP_PROTOCOLS.SSL | SUPP_PROTOCOLS.RDP,
-            SUPP_PROTOCOLS.SSL,
-            SUPP_PROTOCOLS.RDP,
-        ]
-        self.protoflags = [
-            SUPP_PROTOCOLS.SSL | SUPP_PROTOCOLS.RDP,
-            SUPP_PROTOCOLS.SSL,
-            SUPP_PROTOCOLS.RDP,
-            SUPP_PROTOCOLS.SSL | SUPP_PROTOCOLS.HYBRID,
-            SUPP_PROTOCOLS.SSL | SUPP_PROTOCOLS.HYBRID_EX,
-        ]
         width, height = args.res.upper().split("X")
         height = int(height)
         width = int(width)
@@ -109,7 +105,7 @@ class rdp(connection):
     def print_host_info(self):
         nla = colored(f"nla:{self.nla}", host_info_colors[3], attrs=["bold"]) if self.nla else colored(f"nla:{self.nla}", host_info_colors[2], attrs=["bold"])
         if self.domain is None:
-            self.logger.display("Probably old, doesn't not support HYBRID or HYBRID_EX ({nla})")
+            self.logger.display(f"Probably old, doesn't not support HYBRID or HYBRID_EX ({nla})")
         else:
             self.logger.display(f"{self.server_os} (name:{self.hostname}) (domain:{self.domain}) ({nla})")
         return True
@@ -118,35 +114,38 @@ class rdp(connection):
         self.target = RDPTarget(ip=self.host, domain="FAKE", port=self.port, timeout=self.args.rdp_timeout)
         self.auth = NTLMCredential(secret="pass", username="user", domain="FAKE", stype=asyauthSecret.PASS)
 
-        self.check_nla()
-
-        for proto in reversed(self.protoflags):
+        # One connection offering every security protocol: the server picks HYBRID(_EX) if it supports it at all, in
+        # which case the NTLM challenge of the CredSSP exchange tells the hostname, domain and OS build
+        self.iosettings.supported_protocols = SUPP_PROTOCOLS.SSL | SUPP_PROTOCOLS.HYBRID | SUPP_PROTOCOLS.HYBRID_EX
+        self.conn = RDPConnection(iosettings=self.iosettings, target=self.target, credentials=self.auth)
+        try:
+            asyncio.run(self.connect_rdp(auth_only=True))
+        except Exception as e:
+            self.logger.debug(f"RDP fingerprint: {e}")
+            if "Server refused our connection request" in str(e):
+                # Standard RDP security only (SSL_NOT_ALLOWED_BY_SERVER, SSL_CERT_NOT_ON_SERVER)
+                self.conn.x224_protocol = SUPP_PROTOCOLS.RDP
+            elif self.conn.x224_protocol is None:
+                return False
+
+        selected = self.conn.x224_protocol
+        self.logger.debug(f"Server selected protocol: {selected!r}")
+        if SUPP_PROTOCOLS.HYBRID in selected or SUPP_PROTOCOLS.HYBRID_EX in selected:
+            self.iosettings.supported_protocols = SUPP_PROTOCOLS.SSL | selected
             try:
-                self.iosettings.supported_protocols = proto
-                self.conn = RDPConnection(
-                    iosettings=self.iosettings,
-                    target=self.target,
-                    credentials=self.auth,
-                )
-                asyncio.run(self.connect_rdp())
-            except OSError as e:
-                if "Errno 104" not in str(e):
-                    return False
+                info_domain = self.conn.get_extra_info()
             except Exception as e:
-                if "TCPSocket" in str(e):
-                    return False
-                if "Reason:" not in str(e):
-                    try:
-                        info_domain = self.conn.get_extra_info()
-                    except Exception:
-                        pass
-                    else:
-                        self.domain = info_domain["dnsdomainname"]
-                        self.hostname = info_domain["computername"]
-                        self.server_os = info_domain["os_guess"] + " Build " + str(info_domain["os_build"])
-                        self.logger.extra["hostname"] = self.hostname
-                        self.output_filename = os.path.expanduser(f"~/.nxc/logs/{self.hostname}_{self.host}_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}".replace(":", "-"))
-                    break
+                self.logger.debug(f"Could not get the NTLM info: {e}")
+            else:
+                self.domain = info_domain["dnsdomainname"]
+                self.hostname = info_domain["computername"]
+                self.server_os = info_domain["os_guess"] + " Build " + str(info_domain["os_build"])
+                self.logger.extra["hostname"] = self.hostname
+                self.output_filename = os.path.expanduser(f"~/.nxc/logs/{self.hostname}_{self.host}_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}".replace(":", "-"))
+            self.check_nla()
+        else:
+            self.iosettings.supported_protocols = selected
+            self.nla = False
 
         if self.args.domain:
             self.domain = self.args.domain
@@ -172,23 +171,28 @@ class rdp(connection):
         return True
 
     def check_nla(self):
-        for proto in self.protoflags_nla:
-            try:
-                self.iosettings.supported_protocols = proto
-                self.conn = RDPConnection(
-                    iosettings=self.iosettings,
-                    target=self.target,
-                    credentials=self.auth,
-                )
-                asyncio.run(self.connect_rdp())
-                if str(proto) == "SUPP_PROTOCOLS.RDP" or str(proto) == "SUPP_PROTOCOLS.SSL" or str(proto) == "SUPP_PROTOCOLS.SSL|SUPP_PROTOCOLS.RDP":
-                    self.nla = False
-                    return
-            except Exception:
-                pass
-
-    async def connect_rdp(self):
-        _, err = await asyncio.wait_for(self.conn.connect(), timeout=self.args.rdp_timeout)
+        """Whether the server also accepts a client without CredSSP, only the X.224 negotiation is done for that"""
+        try:
+            neg_data = asyncio.run(asyncio.wait_for(self.negotiate(SUPP_PROTOCOLS.RDP | SUPP_PROTOCOLS.SSL), timeout=self.args.rdp_timeout))
+        except Exception as e:
+            self.logger.debug(f"Error checking NLA: {e}")
+            return
+        self.nla = neg_data is not None and neg_data.type == 3 and neg_data.failureCode == FAIL_CODE.HYBRID_REQUIRED_BY_SERVER
+
+    async def negotiate(self, protocols):
+        """Sends the X.224 Connection Request and returns the negotiation response or failure of the server"""
+        connection = await UniClient(self.target, TPKTPacketizer()).connect()
+        try:
+            reply, err = await X224Network(connection).client_negotiate(0, protocols, to_raise=False)
+            if err is not None:
+                raise err
+            return reply.rdpNegData
+        finally:
+            await connection.close()
+
+    async def connect_rdp(self, auth_only=False):
+        connect = self.conn.connect(auth_only=auth_only) if AUTH_ONLY else self.conn.connect()
+        _, err = await asyncio.wait_for(connect, timeout=self.args.rdp_timeout)
         if err is not None:
             raise err
 
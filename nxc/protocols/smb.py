@@ -7,6 +7,19 @@ from Cryptodome.Hash import MD4
 
 from impacket.smbconnection import SMBConnection, SessionError
 from impacket.smb import SMB_DIALECT
+from impacket.smb3structs import (
+    FILE_ACCESS_INFORMATION,
+    FILE_ADD_FILE,
+    FILE_ADD_SUBDIRECTORY,
+    FILE_DIRECTORY_FILE,
+    FILE_LIST_DIRECTORY,
+    FILE_OPEN,
+    FILE_SHARE_DELETE,
+    FILE_SHARE_READ,
+    FILE_SHARE_WRITE,
+    SMB2_0_INFO_FILE,
+    SMB2_FILE_ACCESS_INFO,
+)
 from impacket.examples.secretsdump import (
     RemoteOperations,
     SAMHashes,
@@ -21,12 +34,11 @@ from impacket.dcerpc.v5.rpcrt import RPC_C_AUTHN_GSS_NEGOTIATE
 from impacket.dcerpc.v5.epm import MSRPC_UUID_PORTMAP
 from impacket.dcerpc.v5.samr import SID_NAME_USE
 from impacket.dcerpc.v5.dtypes import MAXIMUM_ALLOWED
-from impacket.krb5.kerberosv5 import SessionKeyDecryptionError
+from impacket.krb5.kerberosv5 import KerberosError, SessionKeyDecryptionError
 from impacket.krb5.types import KerberosException, Principal
 from impacket.krb5 import constants
-from impacket.dcerpc.v5.dtypes import NULL
 from impacket.dcerpc.v5.dcomrt import DCOMConnection
-from impacket.dcerpc.v5.dcom.wmi import CLSID_WbemLevel1Login, IID_IWbemLevel1Login, IWbemLevel1Login
+from impacket.dcerpc.v5.dcom.wmi import CLSID_WbemLevel1Login, IID_IWbemLevel1Login
 
 from nxc.config import process_secret, host_info_colors
 from nxc.connection import connection, sem, requires_admin, dcom_FirewallChecker
@@ -43,9 +55,13 @@ from nxc.protocols.smb.smbspider import SMBSpider
 from nxc.protocols.smb.passpol import PassPolDump
 from nxc.protocols.smb.samruser import UserSamrDump
 from nxc.protocols.smb.samrfunc import SamrFunc
+from nxc.protocols.smb.netenum import NetEnum
+from nxc.protocols.smb.remoteregistry import RemoteRegistry
+from nxc.protocols.wmi.wmisession import WMISession
 from nxc.protocols.ldap.gmsa import MSDS_MANAGEDPASSWORD_BLOB
 from nxc.helpers.logger import highlight
 from nxc.helpers.bloodhound import add_user_bh
+from nxc.helpers.kerberos import ticket_cache
 from nxc.helpers.powershell import create_ps_command
 
 from dploot.triage.vaults import VaultsTriage
@@ -57,10 +73,12 @@ from dploot.lib.target import Target
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.triage.sccm import SCCMTriage
 
-from pywerview.cli.helpers import get_localdisks, get_netsession, get_netgroupmember, get_netgroup, get_netcomputer, get_netloggedon, get_netlocalgroup
+from pywerview.cli.helpers import get_netgroupmember, get_netgroup, get_netcomputer
 
 from time import time
 from datetime import datetime
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from traceback import format_exc
 import logging
@@ -70,6 +88,11 @@ import contextlib
 smb_share_name = gen_random_string(5).upper()
 smb_server = None
 
+# Domain wide results (groups, computers) are the same for every target of a domain, so query the DCs only once per run
+dc_enum_cache = {}
+dc_enum_locks = {}
+dc_enum_lock = Lock()
+
 smb_error_status = [
     "STATUS_ACCOUNT_DISABLED",
     "STATUS_ACCOUNT_EXPIRED",
@@ -147,7 +170,7 @@ class smb(connection):
     def __init__(self, args, db, host):
         self.domain = None
         self.server_os = None
-        self.os_arch = 0
+        self._os_arch = None
         self.hash = None
         self.lmhash = ""
         self.nthash = ""
@@ -162,6 +185,11 @@ class smb(connection):
         self.no_ntlm = False
         self.protocol = "SMB"
         self.is_guest = None
+        self.net_enum = None
+        self.shares_cache = {}
+        self.registry = RemoteRegistry(self)
+        self.wmi_session = WMISession(self, self.connect_wmi)
+        self.conn_reusable = False
 
         connection.__init__(self, args, db, host)
 
@@ -175,6 +203,25 @@ class smb(connection):
             }
         )
 
+    @property
+    def os_arch(self):
+        """Architecture of the target OS (32, 64 or 0 if unknown), probed over RPC on first use if it is not known yet"""
+        if self._os_arch is None:
+            self._os_arch = self.get_os_arch()
+            self.db.add_host(self.host, self.hostname, self.domain, self.server_os, self.smbv1, self.signing, os_arch=self._os_arch)
+        return self._os_arch
+
+    def infer_os_arch(self):
+        """Returns 64 for the Windows versions which only exist in 64-bit, None if it can't be told from the OS version"""
+        try:
+            build = self.conn.getServerOSBuild()
+        except Exception:
+            return None
+        # Windows 11 and Server 2022+ (build 22000+), and Server 2008 R2+ which SMBv1 reports by its edition name
+        if build >= 22000 or (self.smbv1 and "Server" in self.server_os and build >= 7600):
+            return 64
+        return None
+
     def get_os_arch(self):
         try:
             string_binding = rf"ncacn_ip_tcp:{self.host}[135]"
@@ -241,7 +288,12 @@ class smb(connection):
         except Exception as e:
             self.logger.debug(e)
 
-        self.os_arch = self.get_os_arch()
+        # The RPC probe costs a connection to port 135 (and its timeout where it is filtered), skip it when possible
+        self._os_arch = self.infer_os_arch()
+        if self._os_arch is None:
+            self._os_arch = self.db.get_host_os_arch(self.host)
+        if self._os_arch is None and self.args.probe_os_arch:
+            self._os_arch = self.get_os_arch()
         self.output_filename = os.path.expanduser(f"~/.nxc/logs/{self.hostname}_{self.host}_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}".replace(":", "-"))
 
         self.db.add_host(
@@ -251,6 +303,7 @@ class smb(connection):
             self.server_os,
             self.smbv1,
             self.signing,
+            os_arch=self._os_arch,
         )
 
         try:
@@ -258,7 +311,9 @@ class smb(connection):
             self.conn.logoff()
         except Exception as e:
             self.logger.debug(f"Error logging off system: {e}")
-        
+        # The first authentication reuses this connection, session_setup() re-connects if it was reset meanwhile
+        self.reset_session()
+
         # DCOM connection with kerberos needed
         self.remoteName = self.host if not self.kerberos else f"{self.hostname}.{self.domain}"
 
@@ -270,14 +325,29 @@ class smb(connection):
     def print_host_info(self):
         signing = colored(f"signing:{self.signing}", host_info_colors[0], attrs=["bold"]) if self.signing else colored(f"signing:{self.signing}", host_info_colors[1], attrs=["bold"])
         smbv1 = colored(f"SMBv1:{self.smbv1}", host_info_colors[2], attrs=["bold"]) if self.smbv1 else colored(f"SMBv1:{self.smbv1}", host_info_colors[3], attrs=["bold"])
-        self.logger.display(f"{self.server_os}{f' x{self.os_arch}' if self.os_arch else ''} (name:{self.hostname}) (domain:{self.targetDomain}) ({signing}) ({smbv1})")
+        self.logger.display(f"{self.server_os}{f' x{self._os_arch}' if self._os_arch else ''} (name:{self.hostname}) (domain:{self.targetDomain}) ({signing}) ({smbv1})")
         return True
 
+    def call_cmd_args(self):
+        # The enumeration pipes are shared by the options, close them once they all ran
+        try:
+            connection.call_cmd_args(self)
+        finally:
+            self.close_net_enum()
+
+    def call_modules(self):
+        # Hold the registry and WMI sessions while all modules run, so they share a single RemoteRegistry start and
+        # \winreg binding, and a single DCOM connection for their WMI queries
+        with self.registry, self.wmi_session:
+            connection.call_modules(self)
+
     def kerberos_login(self, domain, username, password="", ntlm_hash="", aesKey="", kdcHost="", useCache=False):
         logging.getLogger("impacket").disabled = True
-        # Re-connect since we logged off
         self.logger.debug(f"KDC set to: {kdcHost}")
-        self.create_conn_obj()
+        # Re-connect if the connection holds an authenticated session, or was opened before the hostname was known: the
+        # SPN of the service ticket is taken from its remote name, which must be hostname.domain and not the IP
+        if not self.conn_reusable or self.conn.getRemoteName() != self.remoteName:
+            self.create_conn_obj()
         lmhash = ""
         nthash = ""
 
@@ -309,8 +379,10 @@ class smb(connection):
                 serverName = Principal(f"cifs/{self.hostname}", type=constants.PrincipalNameType.NT_SRV_INST.value)
                 tgs = kerberos_login_with_S4U(domain, self.hostname, username, password, nthash, lmhash, aesKey, kdcHost, self.args.delegate, serverName, useCache, no_s4u2proxy=self.args.no_s4u2proxy)
                 self.logger.debug(f"Got TGS for {self.args.delegate} through S4U")
+            elif not useCache and username:
+                tgs = ticket_cache.get_tgs(f"cifs/{self.conn.getRemoteName()}", username, password, domain, lmhash, nthash, aesKey, kdcHost)
 
-            self.conn.kerberosLogin(self.username, password, domain, lmhash, nthash, aesKey, kdcHost, useCache=useCache, TGS=tgs)
+            self.session_setup("kerberosLogin", self.username, password, domain, lmhash, nthash, aesKey, kdcHost, useCache=useCache, TGS=tgs)
             self.check_if_admin()
 
             if username == "":
@@ -354,6 +426,9 @@ class smb(connection):
                 used_ccache = f" through S4U with {username}"
             self.logger.fail(f"{domain}\\{self.username}{used_ccache} {e}")
         except (SessionError, Exception) as e:
+            # Only a rejected authentication leaves the connection usable for the next one, otherwise it stays dropped
+            if isinstance(e, (SessionError, KerberosError)):
+                self.reset_session()
             error, desc = e.getErrorString()
             used_ccache = " from ccache" if useCache else f":{process_secret(kerb_pass)}"
             if self.args.delegate:
@@ -368,22 +443,22 @@ class smb(connection):
             return False
 
     def plaintext_login(self, domain, username, password):
-        # Re-connect since we logged off
-        self.create_conn_obj()
+        # Re-connect only if the connection holds an authenticated session
+        if not self.conn_reusable:
+            self.create_conn_obj()
         try:
             self.password = password
             self.username = username
             self.domain = domain
 
-            self.conn.login(self.username, self.password, domain)
+            self.session_setup("login", self.username, self.password, domain)
             self.logger.debug(f"Logged in with password to SMB with {domain}/{self.username}")
             self.is_guest = bool(self.conn.isGuestSession())
             self.logger.debug(f"{self.is_guest=}")
             self.check_if_admin()
             self.logger.debug(f"Adding credential: {domain}/{self.username}:{self.password}")
-            self.db.add_credential("plaintext", domain, self.username, self.password)
-            user_id = self.db.get_credential("plaintext", domain, self.username, self.password)
-            host_id = self.db.get_hosts(self.host)[0].id
+            user_id = self.db.add_credential("plaintext", domain, self.username, self.password)
+            host_id = self.db.get_host_id(self.host)
 
             self.db.add_loggedin_relation(user_id, host_id)
 
@@ -411,6 +486,7 @@ class smb(connection):
                 self.create_conn_obj()
             return True
         except SessionError as e:
+            self.reset_session()
             error, desc = e.getErrorString()
             self.logger.fail(
                 f'{domain}\\{self.username}:{process_secret(self.password)} {error} {f"({desc})" if self.args.verbose else ""}',
@@ -427,8 +503,9 @@ class smb(connection):
             return False
 
     def hash_login(self, domain, username, ntlm_hash):
-        # Re-connect since we logged off
-        self.create_conn_obj()
+        # Re-connect only if the connection holds an authenticated session
+        if not self.conn_reusable:
+            self.create_conn_obj()
         lmhash = ""
         nthash = ""
         try:
@@ -446,13 +523,13 @@ class smb(connection):
             if nthash:
                 self.nthash = nthash
 
-            self.conn.login(self.username, "", domain, lmhash, nthash)
+            self.session_setup("login", self.username, "", domain, lmhash, nthash)
             self.logger.debug(f"Logged in with hash to SMB with {domain}/{self.username}")
             self.is_guest = bool(self.conn.isGuestSession())
             self.logger.debug(f"{self.is_guest=}")
             self.check_if_admin()
             user_id = self.db.add_credential("hash", domain, self.username, self.hash)
-            host_id = self.db.get_hosts(self.host)[0].id
+            host_id = self.db.get_host_id(self.host)
 
             self.db.add_loggedin_relation(user_id, host_id)
 
@@ -472,6 +549,7 @@ class smb(connection):
                 self.create_conn_obj()
             return True
         except SessionError as e:
+            self.reset_session()
             error, desc = e.getErrorString()
             self.logger.fail(
                 f"{domain}\\{self.username}:{process_secret(self.hash)} {error} {f'({desc})' if self.args.verbose else ''}",
@@ -533,7 +611,37 @@ class smb(connection):
         return True
 
     def create_conn_obj(self):
-        return bool(self.create_smbv1_conn() or self.create_smbv3_conn())
+        # Only the first connection probes for SMBv1, re-connections use the dialect found by it
+        if self.smbv1 is False:
+            self.conn_reusable = self.create_smbv3_conn()
+        else:
+            self.conn_reusable = bool(self.create_smbv1_conn() or self.create_smbv3_conn())
+        return self.conn_reusable
+
+    def reset_session(self):
+        """Forgets the session of the connection after a logoff or a failed authentication, so it serves the next one"""
+        with contextlib.suppress(Exception):
+            if self.smbv1:
+                self.conn.getSMBServer()._uid = 0
+            else:
+                self.conn.getSMBServer()._Session["SessionID"] = 0
+            self.conn_reusable = True
+
+    def session_setup(self, method, *args, **kwargs):
+        """Authenticates with a login method of SMBConnection, retrying once on a new connection if the server dropped it.
+
+        The connection is reused after the host enumeration and after failed attempts, instead of a new TCP connection
+        and negotiation for each credential, but the server may have closed it meanwhile.
+        """
+        self.conn_reusable = False
+        try:
+            return getattr(self.conn, method)(*args, **kwargs)
+        except (NetBIOSError, ConnectionResetError, BrokenPipeError) as e:
+            self.logger.debug(f"Connection dropped by the server ({e}), re-connecting")
+            if not self.create_conn_obj():
+                raise
+            self.conn_reusable = False
+            return getattr(self.conn, method)(*args, **kwargs)
 
     def check_if_admin(self):
         self.logger.debug(f"Checking if user is admin on {self.host}")
@@ -735,16 +843,62 @@ class smb(connection):
         self.logger.debug(f"ps_execute response: {response}")
         return response
 
-    def shares(self):
-        temp_dir = ntpath.normpath("\\" + gen_random_string())
-        permissions = []
+    def check_share_access(self, share_name):
+        """Returns the (read, write) access of the current user on the share root.
 
+        On SMBv2+ the root is opened once with MAXIMUM_ALLOWED and the granted access mask is queried, which needs no
+        directory listing and leaves no trace on the share. Raises if the server refuses the query.
+        """
+        smb_server = self.conn.getSMBServer()
+        tree_id = smb_server.connectTree(share_name)
         try:
-            self.logger.debug(f"domain: {self.domain}")
-            user_id = self.db.get_user(self.domain.upper(), self.username)[0][0]
-        except Exception as e:
+            file_id = smb_server.create(tree_id, "", MAXIMUM_ALLOWED, FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE, FILE_DIRECTORY_FILE, FILE_OPEN, 0)
+            try:
+                info = smb_server.queryInfo(tree_id, file_id, infoType=SMB2_0_INFO_FILE, fileInfoClass=SMB2_FILE_ACCESS_INFO)
+            finally:
+                smb_server.close(tree_id, file_id)
+        finally:
+            smb_server.disconnectTree(tree_id)
+
+        access = FILE_ACCESS_INFORMATION(info)["AccessFlags"]
+        return bool(access & FILE_LIST_DIRECTORY), bool(access & (FILE_ADD_FILE | FILE_ADD_SUBDIRECTORY))
+
+    def check_share_access_legacy(self, share_name, temp_dir):
+        read = False
+        write = False
+        try:
+            self.conn.listPath(share_name, "*")
+            read = True
+        except SessionError as e:
             error = get_error_string(e)
-            self.logger.fail(f"Error getting user: {error}")
+            self.logger.debug(f"Error checking READ access on share {share_name}: {error}")
+
+        if not self.args.no_write_check:
+            try:
+                self.conn.createDirectory(share_name, temp_dir)
+                write = True
+            except SessionError as e:
+                error = get_error_string(e)
+                self.logger.debug(f"Error checking WRITE access on share {share_name}: {error}")
+
+            if write:
+                try:
+                    self.conn.deleteDirectory(share_name, temp_dir)
+                except SessionError as e:
+                    error = get_error_string(e)
+                    self.logger.debug(f"Error DELETING created temp dir {temp_dir} on share {share_name}: {error}")
+        return read, write
+
+    def shares(self):
+        # Modules and --shares may ask for the shares several times on the same connection, only check them once per user
+        cache_key = (self.domain, self.username)
+        if cache_key in self.shares_cache:
+            permissions = self.shares_cache[cache_key]
+            self.print_shares(permissions)
+            return permissions
+
+        temp_dir = ntpath.normpath("\\" + gen_random_string())
+        permissions = []
 
         try:
             shares = self.conn.listShares()
@@ -764,46 +918,48 @@ class smb(connection):
             )
             return permissions
 
+        db_shares = []
         for share in shares:
             share_name = share["shi1_netname"][:-1]
             share_remark = share["shi1_remark"][:-1]
             share_info = {"name": share_name, "remark": share_remark, "access": []}
-            read = False
-            write = False
-            try:
-                self.conn.listPath(share_name, "*")
-                read = True
-                share_info["access"].append("READ")
-            except SessionError as e:
-                error = get_error_string(e)
-                self.logger.debug(f"Error checking READ access on share {share_name}: {error}")
-
-            if not self.args.no_write_check:
+            # The maximal access query needs SMBv2+, SMBv1 connections list and create on the share directly
+            if self.conn.getDialect() == SMB_DIALECT:
+                read, write = self.check_share_access_legacy(share_name, temp_dir)
+            else:
                 try:
-                    self.conn.createDirectory(share_name, temp_dir)
-                    write = True
-                    share_info["access"].append("WRITE")
-                except SessionError as e:
-                    error = get_error_string(e)
-                    self.logger.debug(f"Error checking WRITE access on share {share_name}: {error}")
-
-                if write:
-                    try:
-                        self.conn.deleteDirectory(share_name, temp_dir)
-                    except SessionError as e:
-                        error = get_error_string(e)
-                        self.logger.debug(f"Error DELETING created temp dir {temp_dir} on share {share_name}: {error}")
+                    read, write = self.check_share_access(share_name)
+                except Exception as e:
+                    self.logger.debug(f"Maximal access query failed on share {share_name}, falling back to listing/creating: {get_error_string(e)}")
+                    read, write = self.check_share_access_legacy(share_name, temp_dir)
 
+            if read:
+                share_info["access"].append("READ")
+            if write:
+                share_info["access"].append("WRITE")
             permissions.append(share_info)
 
             if share_name != "IPC$":
-                try:
-                    # TODO: check if this already exists in DB before adding
-                    self.db.add_share(self.hostname, user_id, share_name, share_remark, read, write)
-                except Exception as e:
-                    error = get_error_string(e)
-                    self.logger.debug(f"Error adding share: {error}")
+                db_shares.append({"name": share_name, "remark": share_remark, "read": read, "write": write})
 
+        try:
+            self.logger.debug(f"domain: {self.domain}")
+            user_id = self.db.get_user(self.domain.upper(), self.username)[0][0]
+        except Exception as e:
+            error = get_error_string(e)
+            self.logger.fail(f"Error getting user: {error}")
+        else:
+            try:
+                self.db.add_shares(self.hostname, user_id, db_shares)
+            except Exception as e:
+                error = get_error_string(e)
+                self.logger.debug(f"Error adding shares: {error}")
+
+        self.shares_cache[cache_key] = permissions
+        self.print_shares(permissions)
+        return permissions
+
+    def print_shares(self, permissions):
         self.logger.display("Enumerated shares")
         self.logger.highlight(f"{'Share':<15} {'Permissions':<15} {'Remark'}")
         self.logger.highlight(f"{'-----':<15} {'-----------':<15} {'------'}")
@@ -814,7 +970,6 @@ class smb(connection):
             if self.args.filter_shares and not any(x in perms for x in self.args.filter_shares):
                 continue
             self.logger.highlight(f"{name:<15} {','.join(perms):<15} {remark}")
-        return permissions
 
     def get_dc_ips(self):
         dc_ips = [dc[1] for dc in self.db.get_domain_controllers(domain=self.domain)]
@@ -822,40 +977,61 @@ class smb(connection):
             dc_ips.append(self.host)
         return dc_ips
 
+    def get_net_enum(self):
+        # Bind the enumeration pipes on the current session, re-bind if the connection was re-created in the meantime
+        if self.net_enum is None or self.net_enum.conn is not self.conn:
+            self.close_net_enum()
+            self.net_enum = NetEnum(self)
+        return self.net_enum
+
+    def close_net_enum(self):
+        if self.net_enum is not None:
+            self.net_enum.close()
+            self.net_enum = None
+
+    def query_domain_controllers(self, kind, query, func):
+        """Runs func(dc_ip) against the known DCs of the domain until one succeeds.
+
+        The result is cached per domain, user and query for the whole run, so the same domain wide enumeration
+        is only sent to the DCs once instead of once per target. Failures are cached as an empty result as well, and
+        only the targets waiting for the same query are held while the DCs are queried.
+        """
+        key = (str(self.domain).lower(), self.username.lower(), kind, query)
+        with dc_enum_lock:
+            key_lock = dc_enum_locks.setdefault(key, Lock())
+        with key_lock:
+            if key not in dc_enum_cache:
+                dc_enum_cache[key] = []
+                for dc_ip in self.get_dc_ips():
+                    try:
+                        dc_enum_cache[key] = func(dc_ip)
+                        break
+                    except Exception as e:
+                        self.logger.fail(f"Error enumerating domain {kind} using dc ip {dc_ip}: {e}")
+            else:
+                self.logger.debug(f"Using cached domain {kind} results for {self.domain}")
+            return dc_enum_cache[key]
+
     def sessions(self):
         try:
-            sessions = get_netsession(
-                self.host,
-                self.domain,
-                self.username,
-                self.password,
-                self.lmhash,
-                self.nthash,
-            )
+            sessions = self.get_net_enum().sessions()
             self.logger.display("Enumerated sessions")
-            for session in sessions:
-                if session.sesi10_cname.find(self.local_ip) == -1:
-                    self.logger.highlight(f"{session.sesi10_cname:<25} User:{session.sesi10_username}")
+            for cname, username in sessions:
+                if cname.find(self.local_ip) == -1:
+                    self.logger.highlight(f"{cname:<25} User:{username}")
             return sessions
-        except Exception:
-            pass
+        except Exception as e:
+            self.logger.debug(f"Error enumerating sessions: {e}")
 
     def disks(self):
         disks = []
         try:
-            disks = get_localdisks(
-                self.host,
-                self.domain,
-                self.username,
-                self.password,
-                self.lmhash,
-                self.nthash,
-            )
+            disks = self.get_net_enum().disks()
             self.logger.display("Enumerated disks")
             for disk in disks:
-                self.logger.highlight(disk.disk)
+                self.logger.highlight(disk)
         except Exception as e:
-            error, desc = e.getErrorString()
+            error = get_error_string(e)
             self.logger.fail(
                 f"Error enumerating disks: {error}",
                 color="magenta" if error in smb_error_status else "red",
@@ -865,71 +1041,49 @@ class smb(connection):
 
     def local_groups(self):
         groups = []
-        # To enumerate local groups the DC IP is optional
-        # if specified it will resolve the SIDs and names of any domain accounts in the local group
-        for dc_ip in self.get_dc_ips():
-            try:
-                groups = get_netlocalgroup(
-                    self.host,
-                    dc_ip,
-                    "",
-                    self.username,
-                    self.password,
-                    self.lmhash,
-                    self.nthash,
-                    queried_groupname=self.args.local_groups,
-                    list_groups=bool(not self.args.local_groups),
-                    recurse=False,
-                )
-
-                if self.args.local_groups:
-                    self.logger.success("Enumerated members of local group")
-                else:
-                    self.logger.success("Enumerated local groups")
+        try:
+            if self.args.local_groups:
+                groups = self.get_net_enum().local_group_members(self.args.local_groups)
+                self.logger.success("Enumerated members of local group")
+            else:
+                groups = self.get_net_enum().local_groups()
+                self.logger.success("Enumerated local groups")
+        except Exception as e:
+            self.logger.fail(f"Error enumerating local groups of {self.host}: {e}")
+            self.logger.display("Trying with SAMRPC protocol")
+            groups = SamrFunc(self).get_local_groups()
+            if groups:
+                self.logger.success("Enumerated local groups")
+                self.logger.debug(f"Local groups: {groups}")
+
+            for group_name, group_rid in groups.items():
+                self.logger.highlight(f"rid => {group_rid} => {group_name}")
+                group_id = self.db.add_group(self.hostname, group_name, rid=group_rid)[0]
+                self.logger.debug(f"Added group, returned id: {group_id}")
+            return groups
+
+        if not self.args.local_groups:
+            for group in groups:
+                self.logger.highlight(f"{group['name']:<40} membercount: {group['membercount']}")
+                self.db.add_group(self.hostname, group["name"], rid=group["rid"], member_count_ad=group["membercount"])
+            return groups
+
+        # members of the same local group share the same group id
+        group_ids = {}
+        for member in groups:
+            domain, name = member["domain"], member["name"]
+            self.logger.highlight(f"{domain.upper()}\\{name}" if domain else name)
+            if domain not in group_ids:
+                try:
+                    group_ids[domain] = self.db.get_groups(group_name=self.args.local_groups, group_domain=domain)[0][0]
+                except IndexError:
+                    group_ids[domain] = self.db.add_group(domain, self.args.local_groups, member_count_ad=len(groups))[0]
 
-                for group in groups:
-                    if group.name:
-                        if not self.args.local_groups:
-                            self.logger.highlight(f"{group.name:<40} membercount: {group.membercount}")
-                            group_id = self.db.add_group(
-                                self.hostname,
-                                group.name,
-                                member_count_ad=group.membercount,
-                            )[0]
-                        else:
-                            domain, name = group.name.split("/")
-                            self.logger.highlight(f"domain: {domain}, name: {name}")
-                            self.logger.highlight(f"{domain.upper()}\\{name}")
-                            try:
-                                group_id = self.db.get_groups(
-                                    group_name=self.args.local_groups,
-                                    group_domain=domain,
-                                )[0][0]
-                            except IndexError:
-                                group_id = self.db.add_group(
-                                    domain,
-                                    self.args.local_groups,
-                                    member_count_ad=group.membercount,
-                                )[0]
-
-                            # domain groups can be part of a local group which is also part of another local group
-                            if not group.isgroup:
-                                self.db.add_credential("plaintext", domain, name, "", group_id, "")
-                            elif group.isgroup:
-                                self.db.add_group(domain, name, member_count_ad=group.membercount)
-                break
-            except Exception as e:
-                self.logger.fail(f"Error enumerating local groups of {self.host}: {e}")
-                self.logger.display("Trying with SAMRPC protocol")
-                groups = SamrFunc(self).get_local_groups()
-                if groups:
-                    self.logger.success("Enumerated local groups")
-                    self.logger.debug(f"Local groups: {groups}")
-
-                for group_name, group_rid in groups.items():
-                    self.logger.highlight(f"rid => {group_rid} => {group_name}")
-                    group_id = self.db.add_group(self.hostname, group_name, rid=group_rid)[0]
-                    self.logger.debug(f"Added group, returned id: {group_id}")
+            # domain groups can be part of a local group which is also part of another local group
+            if not member["isgroup"]:
+                self.db.add_credential("plaintext", domain, name, "", group_ids[domain], "")
+            else:
+                self.db.add_group(domain, name)
         return groups
 
     def domainfromdsn(self, dsn):
@@ -947,141 +1101,128 @@ class smb(connection):
         return domain, dnsparts[0] + "$"
 
     def groups(self):
-        groups = []
-        for dc_ip in self.get_dc_ips():
-            if self.args.groups:
-                try:
-                    groups = get_netgroupmember(
-                        dc_ip,
-                        self.domain,
-                        self.username,
-                        password=self.password,
-                        lmhash=self.lmhash,
-                        nthash=self.nthash,
-                        queried_groupname=self.args.groups,
-                        queried_sid="",
-                        queried_domain="",
-                        ads_path="",
-                        recurse=False,
-                        use_matching_rule=False,
-                        full_data=False,
-                        custom_filter="",
-                    )
-
-                    self.logger.success("Enumerated members of domain group")
-                    for group in groups:
-                        member_count = len(group.member) if hasattr(group, "member") else 0
-                        self.logger.highlight(f"{group.memberdomain}\\{group.membername}")
-                        try:
-                            group_id = self.db.get_groups(
-                                group_name=self.args.groups,
-                                group_domain=group.groupdomain,
-                            )[0][0]
-                        except IndexError:
-                            group_id = self.db.add_group(
-                                group.groupdomain,
-                                self.args.groups,
-                                member_count_ad=member_count,
-                            )[0]
-                        if not group.isgroup:
-                            self.db.add_credential(
-                                "plaintext",
-                                group.memberdomain,
-                                group.membername,
-                                "",
-                                group_id,
-                                "",
-                            )
-                        elif group.isgroup:
-                            group_id = self.db.add_group(
-                                group.groupdomain,
-                                group.groupname,
-                                member_count_ad=member_count,
-                            )[0]
-                    break
-                except Exception as e:
-                    self.logger.fail(f"Error enumerating domain group members using dc ip {dc_ip}: {e}")
-            else:
-                try:
-                    groups = get_netgroup(
-                        dc_ip,
-                        self.domain,
-                        self.username,
-                        password=self.password,
-                        lmhash=self.lmhash,
-                        nthash=self.nthash,
-                        queried_groupname="",
-                        queried_sid="",
-                        queried_username="",
-                        queried_domain="",
-                        ads_path="",
-                        admin_count=False,
-                        full_data=True,
-                        custom_filter="",
-                    )
-
-                    self.logger.success("Enumerated domain group(s)")
-                    for group in groups:
-                        member_count = len(group.member) if hasattr(group, "member") else 0
-                        self.logger.highlight(f"{group.samaccountname:<40} membercount: {member_count}")
-
-                        if bool(group.isgroup) is True:
-                            # Since there isn't a groupmember attribute on the returned object from get_netgroup
-                            # we grab it from the distinguished name
-                            domain = self.domainfromdsn(group.distinguishedname)
-                            group_id = self.db.add_group(
-                                domain,
-                                group.samaccountname,
-                                member_count_ad=member_count,
-                            )[0]
-                    break
-                except Exception as e:
-                    self.logger.fail(f"Error enumerating domain group using dc ip {dc_ip}: {e}")
-        return groups
-
-    def users(self):
-        if len(self.args.users) > 0:
-            self.logger.debug(f"Dumping users: {', '.join(self.args.users)}")
-        return UserSamrDump(self).dump(self.args.users)
-
-    def computers(self):
-        hosts = []
-        for dc_ip in self.get_dc_ips():
-            try:
-                hosts = get_netcomputer(
+        if self.args.groups:
+            def get_group_members(dc_ip):
+                groups = get_netgroupmember(
                     dc_ip,
                     self.domain,
                     self.username,
                     password=self.password,
                     lmhash=self.lmhash,
                     nthash=self.nthash,
+                    queried_groupname=self.args.groups,
+                    queried_sid="",
                     queried_domain="",
                     ads_path="",
+                    recurse=False,
+                    use_matching_rule=False,
+                    full_data=False,
                     custom_filter="",
                 )
+                for group in groups:
+                    member_count = len(group.member) if hasattr(group, "member") else 0
+                    try:
+                        group_id = self.db.get_groups(
+                            group_name=self.args.groups,
+                            group_domain=group.groupdomain,
+                        )[0][0]
+                    except IndexError:
+                        group_id = self.db.add_group(
+                            group.groupdomain,
+                            self.args.groups,
+                            member_count_ad=member_count,
+                        )[0]
+                    if not group.isgroup:
+                        self.db.add_credential(
+                            "plaintext",
+                            group.memberdomain,
+                            group.membername,
+                            "",
+                            group_id,
+                            "",
+                        )
+                    elif group.isgroup:
+                        group_id = self.db.add_group(
+                            group.groupdomain,
+                            group.groupname,
+                            member_count_ad=member_count,
+                        )[0]
+                return groups
+
+            groups = self.query_domain_controllers("group members", self.args.groups, get_group_members)
+            if groups:
+                self.logger.success("Enumerated members of domain group")
+                for group in groups:
+                    self.logger.highlight(f"{group.memberdomain}\\{group.membername}")
+        else:
+            def get_groups(dc_ip):
+                groups = get_netgroup(
+                    dc_ip,
+                    self.domain,
+                    self.username,
+                    password=self.password,
+                    lmhash=self.lmhash,
+                    nthash=self.nthash,
+                    queried_groupname="",
+                    queried_sid="",
+                    queried_username="",
+                    queried_domain="",
+                    ads_path="",
+                    admin_count=False,
+                    full_data=True,
+                    custom_filter="",
+                )
+                for group in groups:
+                    if bool(group.isgroup) is True:
+                        # Since there isn't a groupmember attribute on the returned object from get_netgroup
+                        # we grab it from the distinguished name
+                        domain = self.domainfromdsn(group.distinguishedname)
+                        self.db.add_group(
+                            domain,
+                            group.samaccountname,
+                            member_count_ad=len(group.member) if hasattr(group, "member") else 0,
+                        )
+                return groups
+
+            groups = self.query_domain_controllers("group(s)", "", get_groups)
+            if groups:
+                self.logger.success("Enumerated domain group(s)")
+                for group in groups:
+                    member_count = len(group.member) if hasattr(group, "member") else 0
+                    self.logger.highlight(f"{group.samaccountname:<40} membercount: {member_count}")
+        return groups
 
-                self.logger.success("Enumerated domain computer(s)")
-                for host in hosts:
-                    domain, host_clean = self.domainfromdnshostname(host.dnshostname)
-                    self.logger.highlight(f"{domain}\\{host_clean:<30}")
-                break
-            except Exception as e:
-                self.logger.fail(f"Error enumerating domain computers using dc ip {dc_ip}: {e}")
-                break
-        return hosts
+    def users(self):
+        if len(self.args.users) > 0:
+            self.logger.debug(f"Dumping users: {', '.join(self.args.users)}")
+        return UserSamrDump(self).dump(self.args.users)
 
-    def loggedon_users(self):
-        logged_on = []
-        try:
-            logged_on = get_netloggedon(
-                self.host,
+    def computers(self):
+        def get_computers(dc_ip):
+            return get_netcomputer(
+                dc_ip,
                 self.domain,
                 self.username,
-                self.password,
+                password=self.password,
                 lmhash=self.lmhash,
                 nthash=self.nthash,
+                queried_domain="",
+                ads_path="",
+                custom_filter="",
             )
-            logged_on = {(f"{user.wkui1_logon_domain}\\{user.wkui1_username}", user.wkui1_logon_server) for user in logged_on}
+
+        hosts = self.query_domain_controllers("computers", "", get_computers)
+        if hosts:
+            self.logger.success("Enumerated domain computer(s)")
+            for host in hosts:
+                domain, host_clean = self.domainfromdnshostname(host.dnshostname)
+                self.logger.highlight(f"{domain}\\{host_clean:<30}")
+        return hosts
+
+    def loggedon_users(self):
+        logged_on = []
+        try:
+            logged_on = self.get_net_enum().loggedon_users()
             self.logger.success("Enumerated logged_on users")
             if self.args.loggedon_users_filter:
                 for user in logged_on:
@@ -1096,17 +1237,10 @@ class smb(connection):
     def pass_pol(self):
         return PassPolDump(self).dump()
 
-    @requires_admin
-    def wmi(self, wmi_query=None, namespace=None):
-        records = []
-        if not wmi_query:
-            wmi_query = self.args.wmi.strip("\n")
-
-        if not namespace:
-            namespace = self.args.wmi_namespace
-
+    def connect_wmi(self):
+        """Makes the DCOM connection of the WMI session, returns it with the IWbemLevel1Login interface"""
+        dcom = DCOMConnection(self.remoteName, self.username, self.password, self.domain, self.lmhash, self.nthash, oxidResolver=True, doKerberos=self.kerberos, kdcHost=self.kdcHost, aesKey=self.aesKey, remoteHost=self.host)
         try:
-            dcom = DCOMConnection(self.remoteName, self.username, self.password, self.domain, self.lmhash, self.nthash, oxidResolver=True, doKerberos=self.kerberos, kdcHost=self.kdcHost, aesKey=self.aesKey, remoteHost=self.host)
             iInterface = dcom.CoCreateInstanceEx(CLSID_WbemLevel1Login, IID_IWbemLevel1Login)
             flag, stringBinding = dcom_FirewallChecker(iInterface, self.host, self.args.dcom_timeout)
             if not flag or not stringBinding:
@@ -1116,32 +1250,33 @@ class smb(connection):
                     error_msg = "WMI Query: Dcom initialization failed: can't get target stringbinding, maybe cause by IPv6 or any other issues, please check your target again"
 
                 self.logger.fail(error_msg) if not flag else self.logger.debug(error_msg)
-                # Make it force break function
-                dcom.disconnect()
-            iWbemLevel1Login = IWbemLevel1Login(iInterface)
-            iWbemServices = iWbemLevel1Login.NTLMLogin(namespace, NULL, NULL)
-            iWbemLevel1Login.RemRelease()
-            iEnumWbemClassObject = iWbemServices.ExecQuery(wmi_query)
-        except Exception as e:
-            self.logger.fail(f"Execute WQL error: {e}")
-            if "iWbemLevel1Login" in locals():
-                dcom.disconnect()
-        else:
-            self.logger.info(f"Executing WQL syntax: {wmi_query}")
-            while True:
-                try:
-                    wmi_results = iEnumWbemClassObject.Next(0xFFFFFFFF, 1)[0]
-                    record = wmi_results.getProperties()
+                raise Exception("DCOM initialization failed")
+        except Exception:
+            dcom.disconnect()
+            raise
+        return dcom, iInterface
+
+    @requires_admin
+    def wmi(self, wmi_query=None, namespace=None):
+        records = []
+        if not wmi_query:
+            wmi_query = self.args.wmi.strip("\n")
+
+        if not namespace:
+            namespace = self.args.wmi_namespace
+
+        # Rows are printed batch by batch as they come in, over the WMI session held by the modules if any
+        with self.wmi_session as session:
+            try:
+                self.logger.info(f"Executing WQL syntax: {wmi_query}")
+                for record in session.query(wmi_query, namespace):
                     records.append(record)
                     for k, v in record.items():
                         if k != "TimeGenerated":  # from the wcc module, but this is a small hack to get it to stop spamming - TODO: add in method to disable output for this function
                             self.logger.highlight(f"{k} => {v['value']}")
-                except Exception as e:
-                    if str(e).find("S_FALSE") < 0:
-                        raise e
-                    else:
-                        break
-            dcom.disconnect()
+            except Exception as e:
+                self.logger.fail(f"Execute WQL error: {e}")
+                session.close()
         return records if records else False
 
     def spider(
@@ -1183,52 +1318,48 @@ class smb(connection):
 
         return spider.results
 
-    def rid_brute(self, max_rid=None):
-        entries = []
-        if not max_rid:
-            max_rid = int(self.args.rid_brute)
-
+    def get_lsat_binding(self):
+        """Opens a new DCE/RPC binding to the LSA and returns it together with a policy handle"""
         KNOWN_PROTOCOLS = {
             135: {"bindstr": rf"ncacn_ip_tcp:{self.host}"},
             139: {"bindstr": rf"ncacn_np:{self.host}[\pipe\lsarpc]"},
             445: {"bindstr": rf"ncacn_np:{self.host}[\pipe\lsarpc]"},
         }
 
-        try:
-            string_binding = KNOWN_PROTOCOLS[self.port]["bindstr"]
-            logging.debug(f"StringBinding {string_binding}")
-            rpc_transport = transport.DCERPCTransportFactory(string_binding)
-            rpc_transport.setRemoteHost(self.host)
+        string_binding = KNOWN_PROTOCOLS[self.port]["bindstr"]
+        logging.debug(f"StringBinding {string_binding}")
+        rpc_transport = transport.DCERPCTransportFactory(string_binding)
+        rpc_transport.setRemoteHost(self.host)
 
-            if hasattr(rpc_transport, "set_credentials"):
-                # This method exists only for selected protocol sequences.
-                rpc_transport.set_credentials(self.username, self.password, self.domain, self.lmhash, self.nthash, self.aesKey)
+        if hasattr(rpc_transport, "set_credentials"):
+            # This method exists only for selected protocol sequences.
+            rpc_transport.set_credentials(self.username, self.password, self.domain, self.lmhash, self.nthash, self.aesKey)
 
-            if self.kerberos:
-                rpc_transport.set_kerberos(self.kerberos, self.kdcHost)
+        if self.kerberos:
+            rpc_transport.set_kerberos(self.kerberos, self.kdcHost)
 
-            dce = rpc_transport.get_dce_rpc()
-            if self.kerberos:
-                dce.set_auth_type(RPC_C_AUTHN_GSS_NEGOTIATE)
-
-            dce.connect()
-        except Exception as e:
-            self.logger.fail(f"Error creating DCERPC connection: {e}")
-            return entries
+        dce = rpc_transport.get_dce_rpc()
+        if self.kerberos:
+            dce.set_auth_type(RPC_C_AUTHN_GSS_NEGOTIATE)
 
-        # Want encryption? Uncomment next line
-        # But make simultaneous variable <= 100
+        dce.connect()
+        dce.bind(lsat.MSRPC_UUID_LSAT)
+        resp = lsad.hLsarOpenPolicy2(dce, MAXIMUM_ALLOWED | lsat.POLICY_LOOKUP_NAMES)
+        return dce, resp["PolicyHandle"]
 
-        # Want fragmentation? Uncomment next line
+    def rid_brute(self, max_rid=None):
+        entries = []
+        if not max_rid:
+            max_rid = int(self.args.rid_brute)
 
-        dce.bind(lsat.MSRPC_UUID_LSAT)
         try:
-            resp = lsad.hLsarOpenPolicy2(dce, MAXIMUM_ALLOWED | lsat.POLICY_LOOKUP_NAMES)
+            dce, policy_handle = self.get_lsat_binding()
         except lsad.DCERPCSessionError as e:
             self.logger.fail(f"Error connecting: {e}")
             return entries
-
-        policy_handle = resp["PolicyHandle"]
+        except Exception as e:
+            self.logger.fail(f"Error creating DCERPC connection: {e}")
+            return entries
 
         resp = lsad.hLsarQueryInformationPolicy2(
             dce,
@@ -1237,43 +1368,115 @@ class smb(connection):
         )
         domain_sid = resp["PolicyInformation"]["PolicyAccountDomainInfo"]["DomainSid"].formatCanonical()
 
-        so_far = 0
-        simultaneous = 1000
-        for _j in range(max_rid // simultaneous + 1):
-            sids_to_check = (max_rid - so_far) % simultaneous if (max_rid - so_far) // simultaneous == 0 else simultaneous
+        # Batches start with 1000 SIDs and are split in half whenever the server refuses a lookup of that size
+        min_batch_size = 50
+        size_faults = ("STATUS_INVALID_PARAMETER", "STATUS_INSUFFICIENT_RESOURCES", "STATUS_NO_MEMORY", "nca_s_fault_remote_no_memory")
+        stop_after = self.args.rid_brute_stop
+        state = {"next_rid": 0, "batch_size": 1000, "last_mapped": 0, "pending": set()}
+        retry = []
+        lock = Lock()
 
-            if sids_to_check == 0:
+        bindings = [(dce, policy_handle)]
+        for _ in range(min(self.args.rid_brute_bindings, -(-max_rid // state["batch_size"])) - 1):
+            try:
+                bindings.append(self.get_lsat_binding())
+            except Exception as e:
+                self.logger.debug(f"Could not open additional LSA binding, continuing with {len(bindings)}: {e}")
                 break
+        self.logger.debug(f"RID bruteforcing up to {max_rid} with {len(bindings)} parallel LSA binding(s)")
 
-            sids = [f"{domain_sid}-{i:d}" for i in range(so_far, so_far + sids_to_check)]
-            try:
-                lsat.hLsarLookupSids(dce, policy_handle, sids, lsat.LSAP_LOOKUP_LEVEL.LsapLookupWksta)
-            except DCERPCException as e:
-                if str(e).find("STATUS_NONE_MAPPED") >= 0:
-                    so_far += simultaneous
-                    continue
-                elif str(e).find("STATUS_SOME_NOT_MAPPED") >= 0:
-                    resp = e.get_packet()
+        def next_range():
+            with lock:
+                if retry:
+                    rid_range = retry.pop()
                 else:
-                    raise
+                    start = state["next_rid"]
+                    if start >= max_rid:
+                        return None
+                    # Only count the gap below the lowest range still in flight, as it could still contain a mapped RID
+                    completed = min((pending[0] for pending in state["pending"] | set(retry)), default=start)
+                    if stop_after and completed - state["last_mapped"] >= stop_after * state["batch_size"]:
+                        self.logger.debug(f"No RID mapped in {stop_after} batch(es) after RID {state['last_mapped']}, stopping at RID {start}")
+                        state["next_rid"] = max_rid
+                        return None
+                    rid_range = (start, min(start + state["batch_size"], max_rid))
+                    state["next_rid"] = rid_range[1]
+                state["pending"].add(rid_range)
+                return rid_range
+
+        # Workers add their entries to the shared list as they resolve them, so a worker failing midway keeps the RIDs
+        # it already resolved
+        def lookup_sids(dce, policy_handle):
+            while True:
+                rid_range = next_range()
+                if rid_range is None:
+                    return
+                start, end = rid_range
+                sids = [f"{domain_sid}-{i:d}" for i in range(start, end)]
+                try:
+                    resp = lsat.hLsarLookupSids(dce, policy_handle, sids, lsat.LSAP_LOOKUP_LEVEL.LsapLookupWksta)
+                except Exception as e:
+                    if str(e).find("STATUS_NONE_MAPPED") >= 0:
+                        resp = None
+                    elif str(e).find("STATUS_SOME_NOT_MAPPED") >= 0:
+                        resp = e.get_packet()
+                    elif isinstance(e, DCERPCException) and any(fault in str(e) for fault in size_faults) and end - start > min_batch_size:
+                        half = (end - start) // 2
+                        self.logger.debug(f"Lookup of {end - start} SIDs failed ({e}), retrying with batches of {half}")
+                        with lock:
+                            state["batch_size"] = max(min(state["batch_size"], half), min_batch_size)
+                            retry.extend([(start + half, end), (start, start + half)])
+                            state["pending"].discard(rid_range)
+                        continue
+                    else:
+                        # The binding is likely unusable, leave the range to the other ones
+                        self.logger.debug(f"Lookup of RIDs {start}-{end - 1} failed, dropping the LSA binding: {e}")
+                        with lock:
+                            retry.append(rid_range)
+                            state["pending"].discard(rid_range)
+                        return
 
-            for n, item in enumerate(resp["TranslatedNames"]["Names"]):
-                if item["Use"] != SID_NAME_USE.SidTypeUnknown:
-                    rid = so_far + n
-                    domain = resp["ReferencedDomains"]["Domains"][item["DomainIndex"]]["Name"]
-                    user = item["Name"]
-                    sid_type = SID_NAME_USE.enumItems(item["Use"]).name
-                    self.logger.highlight(f"{rid}: {domain}\\{user} ({sid_type})")
-                    entries.append(
-                        {
-                            "rid": rid,
-                            "domain": domain,
-                            "username": user,
-                            "sidtype": sid_type,
-                        }
-                    )
-            so_far += simultaneous
-        dce.disconnect()
+                last_mapped = 0
+                if resp is not None:
+                    for n, item in enumerate(resp["TranslatedNames"]["Names"]):
+                        if item["Use"] != SID_NAME_USE.SidTypeUnknown:
+                            last_mapped = start + n
+                            entries.append(
+                                {
+                                    "rid": start + n,
+                                    "domain": resp["ReferencedDomains"]["Domains"][item["DomainIndex"]]["Name"],
+                                    "username": item["Name"],
+                                    "sidtype": SID_NAME_USE.enumItems(item["Use"]).name,
+                                }
+                            )
+                with lock:
+                    state["last_mapped"] = max(state["last_mapped"], last_mapped)
+                    state["pending"].discard(rid_range)
+
+        with ThreadPoolExecutor(max_workers=len(bindings)) as executor:
+            futures = [executor.submit(lookup_sids, binding_dce, binding_handle) for binding_dce, binding_handle in bindings]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.fail(f"Error looking up SIDs: {e}")
+
+        for binding_dce, _ in bindings:
+            with contextlib.suppress(Exception):
+                binding_dce.disconnect()
+
+        # Ranges left once every binding failed
+        unresolved = sorted(retry + ([(state["next_rid"], max_rid)] if state["next_rid"] < max_rid else []))
+        if unresolved:
+            self.logger.fail(f"Could not look up RIDs {', '.join(f'{start}-{end - 1}' for start, end in unresolved)}, all LSA bindings failed")
+
+        entries.sort(key=lambda entry: entry["rid"])
+        for entry in entries:
+            self.logger.highlight(f"{entry['rid']}: {entry['domain']}\\{entry['username']} ({entry['sidtype']})")
+
+        users = [(entry["domain"], entry["username"]) for entry in entries if entry["sidtype"] == "SidTypeUser"]
+        if users:
+            self.db.add_users(users)
         return entries
 
     def put_file_single(self, src, dst):
@@ -1321,7 +1524,7 @@ class smb(connection):
     def sam(self):
         try:
             self.enable_remoteops()
-            host_id = self.db.get_hosts(filter_term=self.host)[0][0]
+            host_id = self.db.get_host_id(self.host)
 
             def add_sam_hash(sam_hash, host_id):
                 add_sam_hash.sam_hashes += 1
@@ -1698,7 +1901,7 @@ class smb(connection):
         self.enable_remoteops()
         use_vss_method = False
         NTDSFileName = None
-        host_id = self.db.get_hosts(filter_term=self.host)[0][0]
+        host_id = self.db.get_host_id(self.host)
 
         def add_ntds_hash(ntds_hash, host_id):
             add_ntds_hash.ntds_hashes += 1
@@ -3,7 +3,7 @@ import warnings
 from datetime import datetime
 from pathlib import Path
 
-from sqlalchemy import MetaData, func, Table, select, delete
+from sqlalchemy import MetaData, func, Table, select, delete, text
 from sqlalchemy.dialects.sqlite import Insert  # used for upsert
 from sqlalchemy.exc import (
     IllegalStateChangeError,
@@ -15,6 +15,7 @@ from sqlalchemy.orm import sessionmaker, scoped_session
 
 from nxc.logger import nxc_logger
 import sys
+from threading import Lock
 from typing import Optional
 
 # if there is an issue with SQLAlchemy and a connection cannot be cleaned up properly it spews out annoying warnings
@@ -35,6 +36,13 @@ class database:
         self.DpapiBackupkey = None
         self.DpapiSecrets = None
 
+        # In-process identity maps so logins and relation inserts don't have to look up IDs in SQLite every time
+        self.id_lock = Lock()
+        self.host_ids = {}
+        self.user_ids = {}
+        self.admin_relations = set()
+        self.loggedin_relations = set()
+
         self.db_engine = db_engine
         self.db_path = self.db_engine.url.database
         self.protocol = Path(self.db_path).stem.upper()
@@ -60,7 +68,8 @@ class database:
             "signing" boolean,
             "spooler" boolean,
             "zerologon" boolean,
-            "petitpotam" boolean
+            "petitpotam" boolean,
+            "os_arch" integer
             )"""
         )
         db_conn.execute(
@@ -176,9 +185,13 @@ class database:
         #    )''')
 
     def reflect_tables(self):
-        with self.db_engine.connect():
+        with self.db_engine.connect() as conn:
             try:
                 self.HostsTable = Table("hosts", self.metadata, autoload_with=self.db_engine)
+                if "os_arch" not in self.HostsTable.c:
+                    # Workspaces created before the OS architecture was stored, add the column in place
+                    conn.execute(text('ALTER TABLE "hosts" ADD COLUMN "os_arch" integer'))
+                    self.HostsTable = Table("hosts", self.metadata, autoload_with=self.db_engine, extend_existing=True)
                 self.UsersTable = Table("users", self.metadata, autoload_with=self.db_engine)
                 self.GroupsTable = Table("groups", self.metadata, autoload_with=self.db_engine)
                 self.SharesTable = Table("shares", self.metadata, autoload_with=self.db_engine)
@@ -211,6 +224,49 @@ class database:
     def clear_database(self):
         for table in self.metadata.sorted_tables:
             self.conn.execute(table.delete())
+        self.clear_id_cache()
+
+    def clear_id_cache(self):
+        with self.id_lock:
+            self.host_ids.clear()
+            self.user_ids.clear()
+            self.admin_relations.clear()
+            self.loggedin_relations.clear()
+
+    @staticmethod
+    def user_key(credtype, domain, username):
+        return (str(credtype).lower(), str(domain).lower(), str(username).lower())
+
+    def get_host_id(self, ip):
+        """Return the ID of the host with exactly this IP, cached for the rest of the run"""
+        with self.id_lock:
+            if ip in self.host_ids:
+                return self.host_ids[ip]
+        result = self.conn.execute(select(self.HostsTable.c.id).filter(self.HostsTable.c.ip == ip)).first()
+        if result is None:
+            return None
+        with self.id_lock:
+            self.host_ids[ip] = result.id
+        return result.id
+
+    def get_user_id(self, credtype, domain, username):
+        """Return the ID of the credential, cached for the rest of the run"""
+        key = self.user_key(credtype, domain, username)
+        with self.id_lock:
+            if key in self.user_ids:
+                return self.user_ids[key]
+        result = self.conn.execute(
+            select(self.UsersTable.c.id).filter(
+                func.lower(self.UsersTable.c.domain) == func.lower(domain),
+                func.lower(self.UsersTable.c.username) == func.lower(username),
+                func.lower(self.UsersTable.c.credtype) == func.lower(credtype),
+            )
+        ).first()
+        if result is None:
+            return None
+        with self.id_lock:
+            self.user_ids[key] = result.id
+        return result.id
 
     # pull/545
     def add_host(
@@ -225,6 +281,7 @@ class database:
         zerologon=None,
         petitpotam=None,
         dc=None,
+        os_arch=None,
     ):
         """Check if this host has already been added to the database, if not, add it in."""
         hosts = []
@@ -246,6 +303,7 @@ class database:
                 "spooler": spooler,
                 "zerologon": zerologon,
                 "petitpotam": petitpotam,
+                "os_arch": os_arch,
             }
             hosts = [new_host]
         # update existing hosts data
@@ -273,6 +331,8 @@ class database:
                     host_data["petitpotam"] = petitpotam
                 if dc is not None:
                     host_data["dc"] = dc
+                if os_arch is not None:
+                    host_data["os_arch"] = os_arch
                 # only add host to be updated if it has changed
                 if host_data not in hosts:
                     hosts.append(host_data)
@@ -285,19 +345,42 @@ class database:
         q = q.on_conflict_do_update(index_elements=self.HostsTable.primary_key, set_=update_columns)
 
         self.conn.execute(q, hosts)  # .scalar()
+        if updated_ids:
+            with self.id_lock:
+                self.host_ids[ip] = updated_ids[0]
+        else:
+            self.get_host_id(ip)
         # we only return updated IDs for now - when RETURNING clause is allowed we can return inserted
         if updated_ids:
             nxc_logger.debug(f"add_host() - Host IDs Updated: {updated_ids}")
             return updated_ids
 
+    def get_host_os_arch(self, ip):
+        """Returns the OS architecture stored for a host: 32, 64, 0 if the detection failed or None if never detected"""
+        q = select(self.HostsTable.c.os_arch).filter(self.HostsTable.c.ip == ip)
+        return self.conn.execute(q).scalar()
+
     def add_credential(self, credtype, domain, username, password, group_id=None, pillaged_from=None):
         """Check if this credential has already been added to the database, if not add it in."""
         credentials = []
         groups = []
 
-        if (group_id and not self.is_group_valid(group_id)) or (pillaged_from and not self.is_host_valid(pillaged_from)):
+        if (group_id and not self.is_group_valid(group_id)) or (pillaged_from and pillaged_from not in self.host_ids.values() and not self.is_host_valid(pillaged_from)):
             nxc_logger.debug("Invalid group or host")
-            return
+            return None
+
+        key = self.user_key(credtype, domain, username)
+        with self.id_lock:
+            user_id = self.user_ids.get(key)
+        # known credential without a new group relation, just update it by its ID
+        if user_id is not None and group_id is None:
+            cred_data = {"id": user_id, "credtype": credtype, "domain": domain, "username": username, "password": password}
+            if pillaged_from is not None:
+                cred_data["pillaged_from_hostid"] = pillaged_from
+            q = Insert(self.UsersTable)
+            q = q.on_conflict_do_update(index_elements=self.UsersTable.primary_key, set_={col: q.excluded[col] for col in cred_data if col != "id"})
+            self.conn.execute(q, [cred_data])
+            return user_id
 
         q = select(self.UsersTable).filter(
             func.lower(self.UsersTable.c.domain) == func.lower(domain),
@@ -353,6 +436,12 @@ class database:
 
             self.conn.execute(q_groups, groups)
 
+        if not results:
+            return self.get_user_id(credtype, domain, username)
+        with self.id_lock:
+            self.user_ids[key] = results[0].id
+        return results[0].id
+
     def remove_credentials(self, creds_id):
         """Removes a credential ID from the database"""
         del_hosts = []
@@ -360,33 +449,29 @@ class database:
             q = delete(self.UsersTable).filter(self.UsersTable.c.id == cred_id)
             del_hosts.append(q)
         self.conn.execute(q)
+        self.clear_id_cache()
 
     def add_admin_user(self, credtype, domain, username, password, host, user_id=None):
-        add_links = []
-
-        creds_q = select(self.UsersTable)
-        creds_q = creds_q.filter(self.UsersTable.c.id == user_id) if user_id else creds_q.filter(func.lower(self.UsersTable.c.credtype) == func.lower(credtype), func.lower(self.UsersTable.c.domain) == func.lower(domain), func.lower(self.UsersTable.c.username) == func.lower(username), self.UsersTable.c.password == password)
-        users = self.conn.execute(creds_q)
-        hosts = self.get_hosts(host)
-
-        if users and hosts:
-            for user, host in zip(users, hosts):
-                user_id = user[0]
-                host_id = host[0]
-                link = {"userid": user_id, "hostid": host_id}
-                admin_relations_select = select(self.AdminRelationsTable).filter(
-                    self.AdminRelationsTable.c.userid == user_id,
-                    self.AdminRelationsTable.c.hostid == host_id,
-                )
-                links = self.conn.execute(admin_relations_select).all()
+        if user_id is None:
+            user_id = self.get_user_id(credtype, domain, username)
+        host_id = self.get_host_id(host)
+        if user_id is None or host_id is None:
+            nxc_logger.debug(f"add_admin_user() - unknown user {domain}\\{username} or host {host}")
+            return
 
-                if not links:
-                    add_links.append(link)
+        with self.id_lock:
+            if (user_id, host_id) in self.admin_relations:
+                return
 
-        admin_relations_insert = Insert(self.AdminRelationsTable)
+        admin_relations_select = select(self.AdminRelationsTable).filter(
+            self.AdminRelationsTable.c.userid == user_id,
+            self.AdminRelationsTable.c.hostid == host_id,
+        )
+        if not self.conn.execute(admin_relations_select).all():
+            self.conn.execute(Insert(self.AdminRelationsTable), [{"userid": user_id, "hostid": host_id}])
 
-        if add_links:
-            self.conn.execute(admin_relations_insert, add_links)
+        with self.id_lock:
+            self.admin_relations.add((user_id, host_id))
 
     def get_admin_relations(self, user_id=None, host_id=None):
         if user_id:
@@ -407,6 +492,8 @@ class database:
             for host_id in host_ids:
                 q = q.filter(self.AdminRelationsTable.c.hostid == host_id)
         self.conn.execute(q)
+        with self.id_lock:
+            self.admin_relations.clear()
 
     def is_credential_valid(self, credential_id):
         """Check if this credential ID is valid."""
@@ -435,6 +522,11 @@ class database:
         return self.conn.execute(q).all()
 
     def get_credential(self, cred_type, domain, username, password):
+        key = self.user_key(cred_type, domain, username)
+        with self.id_lock:
+            if key in self.user_ids:
+                return self.user_ids[key]
+
         q = select(self.UsersTable).filter(
             self.UsersTable.c.domain == domain,
             self.UsersTable.c.username == username,
@@ -636,6 +728,25 @@ class database:
         )
         return self.conn.execute(q).all()
 
+    def add_users(self, users):
+        """Add a list of (domain, username) tuples without a secret, e.g. from RID bruteforcing, in a single insert.
+
+        Users already in the database (with any credential type) are left untouched.
+        """
+        q = select(self.UsersTable.c.domain, self.UsersTable.c.username)
+        existing = {(str(domain).lower(), str(username).lower()) for domain, username in self.conn.execute(q).all()}
+
+        new_users = []
+        for domain, username in users:
+            if (domain.lower(), username.lower()) not in existing:
+                existing.add((domain.lower(), username.lower()))
+                new_users.append({"credtype": "plaintext", "domain": domain, "username": username, "password": ""})
+
+        if new_users:
+            nxc_logger.debug(f"Adding {len(new_users)} users")
+            self.conn.execute(Insert(self.UsersTable), new_users)
+        return len(new_users)
+
     def get_domain_controllers(self, domain=None):
         return self.get_hosts(filter_term="dc", domain=domain)
 
@@ -661,6 +772,18 @@ class database:
             share_data,
         )  # .scalar_one()
 
+    def add_shares(self, host_id, user_id, shares):
+        """Upsert the shares of a host for a user in a single statement, updating the access of already known shares"""
+        if not shares:
+            return
+        share_data = [{"hostid": host_id, "userid": user_id, **share} for share in shares]
+        q = Insert(self.SharesTable)
+        q = q.on_conflict_do_update(
+            index_elements=[self.SharesTable.c.hostid, self.SharesTable.c.userid, self.SharesTable.c.name],
+            set_={"remark": q.excluded.remark, "read": q.excluded.read, "write": q.excluded.write},
+        )
+        self.conn.execute(q, share_data)
+
     def get_shares(self, filter_term=None):
         if self.is_share_valid(filter_term):
             q = select(self.SharesTable).filter(self.SharesTable.c.id == filter_term)
@@ -803,6 +926,10 @@ class database:
         return results
 
     def add_loggedin_relation(self, user_id, host_id):
+        with self.id_lock:
+            if (user_id, host_id) in self.loggedin_relations:
+                return None
+
         relation_query = select(self.LoggedinRelationsTable).filter(
             self.LoggedinRelationsTable.c.userid == user_id,
             self.LoggedinRelationsTable.c.hostid == host_id,
@@ -818,11 +945,16 @@ class database:
                 q = Insert(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
 
                 self.conn.execute(q, [relation])  # .scalar()
+                with self.id_lock:
+                    self.loggedin_relations.add((user_id, host_id))
                 inserted_id_results = self.get_loggedin_relations(user_id, host_id)
                 nxc_logger.debug(f"Checking if relation was added: {inserted_id_results}")
                 return inserted_id_results[0].id
             except Exception as e:
                 nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
+        else:
+            with self.id_lock:
+                self.loggedin_relations.add((user_id, host_id))
 
     def get_loggedin_relations(self, user_id=None, host_id=None):
         q = select(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
@@ -839,6 +971,8 @@ class database:
         elif host_id:
             q = q.filter(self.LoggedinRelationsTable.c.hostid == host_id)
         self.conn.execute(q)
+        with self.id_lock:
+            self.loggedin_relations.clear()
 
     def get_checks(self):
         q = select(self.ConfChecksTable)
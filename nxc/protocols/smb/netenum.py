@@ -0,0 +1,159 @@
+import contextlib
+
+from impacket.dcerpc.v5 import srvs, wkst, samr, lsat, lsad
+from impacket.dcerpc.v5.dtypes import NULL, MAXIMUM_ALLOWED
+from impacket.dcerpc.v5.rpcrt import DCERPCException
+from impacket.dcerpc.v5.samr import SID_NAME_USE
+from impacket.dcerpc.v5.transport import SMBTransport
+
+
+class NetEnum:
+    """Host enumeration (sessions, disks, logged on users, local groups) over named pipes of the already authenticated SMB session.
+
+    Every pipe is bound once and kept until close(), so combining several enumeration options only costs one extra bind
+    per pipe instead of a whole new SMB connection and authentication per option.
+    """
+
+    PIPES = {
+        "srvsvc": srvs.MSRPC_UUID_SRVS,
+        "wkssvc": wkst.MSRPC_UUID_WKST,
+        "samr": samr.MSRPC_UUID_SAMR,
+        "lsarpc": lsat.MSRPC_UUID_LSAT,
+    }
+
+    def __init__(self, connection):
+        self.logger = connection.logger
+        self.conn = connection.conn
+        self.port = connection.port
+        self.dces = {}
+        self.samr_server_handle = None
+        self.samr_domain_handles = None
+
+    def get_dce(self, pipe):
+        if pipe not in self.dces:
+            rpc_transport = SMBTransport(self.conn.getRemoteHost(), self.port, f"\\{pipe}", smb_connection=self.conn)
+            dce = rpc_transport.get_dce_rpc()
+            dce.connect()
+            dce.bind(self.PIPES[pipe])
+            self.logger.debug(f"Bound to \\pipe\\{pipe} over the existing SMB session")
+            self.dces[pipe] = dce
+        return self.dces[pipe]
+
+    def close(self):
+        """Closes the SAMR handles and the pipes, ignoring errors as the SMB session may already be gone"""
+        if "samr" in self.dces:
+            for handle in [*(self.samr_domain_handles or {}).values(), self.samr_server_handle]:
+                if handle is not None:
+                    with contextlib.suppress(Exception):
+                        samr.hSamrCloseHandle(self.dces["samr"], handle)
+        self.samr_server_handle = None
+        self.samr_domain_handles = None
+        for dce in self.dces.values():
+            with contextlib.suppress(Exception):
+                dce.disconnect()
+        self.dces = {}
+
+    def sessions(self):
+        """Returns a list of (client name, username) tuples of the SMB sessions on the target"""
+        resp = srvs.hNetrSessionEnum(self.get_dce("srvsvc"), NULL, NULL, 10)
+        return [(session["sesi10_cname"][:-1], session["sesi10_username"][:-1]) for session in resp["InfoStruct"]["SessionInfo"]["Level10"]["Buffer"]]
+
+    def disks(self):
+        """Returns the list of local disks of the target, e.g. ['C:', 'D:']"""
+        resp = srvs.hNetrServerDiskEnum(self.get_dce("srvsvc"), 0)
+        return [disk["Disk"][:-1] for disk in resp["DiskInfoStruct"]["Buffer"] if disk["Disk"][:-1]]
+
+    def loggedon_users(self):
+        r"""Returns a set of (domain\username, logon server) tuples of the users logged on the target"""
+        resp = wkst.hNetrWkstaUserEnum(self.get_dce("wkssvc"), 1)
+        return {(f"{user['wkui1_logon_domain'][:-1]}\\{user['wkui1_username'][:-1]}", user["wkui1_logon_server"][:-1]) for user in resp["UserInfo"]["WkstaUserInfo"]["Level1"]["Buffer"]}
+
+    def get_samr_domain_handles(self):
+        if self.samr_domain_handles is None:
+            dce = self.get_dce("samr")
+            self.samr_server_handle = samr.hSamrConnect(dce)["ServerHandle"]
+            self.samr_domain_handles = {}
+            for domain in samr.hSamrEnumerateDomainsInSamServer(dce, self.samr_server_handle)["Buffer"]["Buffer"]:
+                resp = samr.hSamrLookupDomainInSamServer(dce, self.samr_server_handle, domain["Name"])
+                self.samr_domain_handles[domain["Name"]] = samr.hSamrOpenDomain(dce, serverHandle=self.samr_server_handle, domainId=resp["DomainId"])["DomainHandle"]
+        return self.samr_domain_handles
+
+    def get_domain_aliases(self, domain_handle):
+        dce = self.get_dce("samr")
+        aliases = []
+        enumeration_context = 0
+        while True:
+            try:
+                resp = samr.hSamrEnumerateAliasesInDomain(dce, domain_handle, enumerationContext=enumeration_context)
+            except DCERPCException as e:
+                if str(e).find("STATUS_MORE_ENTRIES") < 0:
+                    raise
+                resp = e.get_packet()
+            aliases.extend(resp["Buffer"]["Buffer"])
+            enumeration_context = resp["EnumerationContext"]
+            if resp["ErrorCode"] == 0:
+                return aliases
+
+    def local_groups(self):
+        """Returns a list of dicts with the name, rid and member count of every local group of the target"""
+        dce = self.get_dce("samr")
+        groups = []
+        for domain_handle in self.get_samr_domain_handles().values():
+            for alias in self.get_domain_aliases(domain_handle):
+                alias_handle = samr.hSamrOpenAlias(dce, domain_handle, aliasId=alias["RelativeId"])["AliasHandle"]
+                info = samr.hSamrQueryInformationAlias(dce, alias_handle)["Buffer"]["General"]
+                groups.append({"name": info["Name"], "rid": alias["RelativeId"], "membercount": info["MemberCount"]})
+                samr.hSamrCloseHandle(dce, alias_handle)
+        return groups
+
+    def local_group_members(self, group_name):
+        """Returns a list of dicts with domain, name, sid and isgroup of each member of the local group
+
+        Member SIDs are resolved in a single LsarLookupSids call on the target itself, which also translates domain accounts
+        through the host's secure channel, so no separate connection to a domain controller is needed.
+        """
+        dce = self.get_dce("samr")
+        for domain_handle in self.get_samr_domain_handles().values():
+            try:
+                rid = samr.hSamrLookupNamesInDomain(dce, domain_handle, [group_name])["RelativeIds"]["Element"][0]["Data"]
+            except DCERPCException:
+                continue
+            alias_handle = samr.hSamrOpenAlias(dce, domain_handle, aliasId=rid)["AliasHandle"]
+            sids = [member["SidPointer"].formatCanonical() for member in samr.hSamrGetMembersInAlias(dce, alias_handle)["Members"]["Sids"]]
+            samr.hSamrCloseHandle(dce, alias_handle)
+            break
+        else:
+            raise ValueError(f"The group '{group_name}' was not found on the target")
+
+        return self.lookup_sids(sids)
+
+    def lookup_sids(self, sids):
+        if not sids:
+            return []
+        dce = self.get_dce("lsarpc")
+        policy_handle = lsad.hLsarOpenPolicy2(dce, MAXIMUM_ALLOWED | lsat.POLICY_LOOKUP_NAMES)["PolicyHandle"]
+        try:
+            resp = lsat.hLsarLookupSids(dce, policy_handle, sids, lsat.LSAP_LOOKUP_LEVEL.LsapLookupWksta)
+        except DCERPCException as e:
+            if str(e).find("STATUS_SOME_NOT_MAPPED") >= 0:
+                resp = e.get_packet()
+            elif str(e).find("STATUS_NONE_MAPPED") >= 0:
+                return [{"domain": "", "name": sid, "sid": sid, "isgroup": False} for sid in sids]
+            else:
+                raise
+        finally:
+            lsad.hLsarClose(dce, policy_handle)
+
+        group_types = (SID_NAME_USE.SidTypeGroup, SID_NAME_USE.SidTypeAlias, SID_NAME_USE.SidTypeWellKnownGroup)
+        members = []
+        for sid, item in zip(sids, resp["TranslatedNames"]["Names"]):
+            if item["Use"] == SID_NAME_USE.SidTypeUnknown:
+                members.append({"domain": "", "name": sid, "sid": sid, "isgroup": False})
+                continue
+            members.append({
+                "domain": resp["ReferencedDomains"]["Domains"][item["DomainIndex"]]["Name"],
+                "name": item["Name"],
+                "sid": sid,
+                "isgroup": item["Use"] in group_types,
+            })
+        return members
@@ -18,6 +18,7 @@ def proto_args(parser, parents):
     smb_parser.add_argument("--smb-server-port", default="445", help="specify a server port for SMB", type=int)
     smb_parser.add_argument("--gen-relay-list", metavar="OUTPUT_FILE", help="outputs all hosts that don't require SMB signing to the specified file")
     smb_parser.add_argument("--smb-timeout", help="SMB connection timeout", type=int, default=2)
+    smb_parser.add_argument("--os-arch", dest="probe_os_arch", action="store_true", help="detect the OS architecture over RPC (port 135) on hosts where it can't be inferred and isn't in the workspace yet")
     smb_parser.add_argument("--laps", dest="laps", metavar="LAPS", type=str, help="LAPS authentification", nargs="?", const="administrator")
     self_delegate_arg.make_required = [delegate_arg]
 
@@ -46,6 +47,8 @@ def proto_args(parser, parents):
     mapping_enum_group.add_argument("--local-groups", nargs="?", const="", metavar="GROUP", help="enumerate local groups, if a group is specified then its members are enumerated")
     mapping_enum_group.add_argument("--pass-pol", action="store_true", help="dump password policy")
     mapping_enum_group.add_argument("--rid-brute", nargs="?", type=int, const=4000, metavar="MAX_RID", help="enumerate users by bruteforcing RIDs")
+    mapping_enum_group.add_argument("--rid-brute-bindings", type=int, default=4, metavar="NUM", help="number of parallel LSA bindings used for RID bruteforcing")
+    mapping_enum_group.add_argument("--rid-brute-stop", type=int, default=0, metavar="BATCHES", help="stop RID bruteforcing after this many batches without any mapped RID (0 = never)")
     
     wmi_group = smb_parser.add_argument_group("WMI", "Options for WMI Queries")
     wmi_group.add_argument("--wmi", metavar="QUERY", type=str, help="issues the specified WMI query")
@@ -0,0 +1,147 @@
+from impacket.dcerpc.v5 import rrp
+from impacket.dcerpc.v5.rrp import DCERPCSessionError
+from impacket.examples.secretsdump import RemoteOperations
+from impacket.system_errors import ERROR_FILE_NOT_FOUND, ERROR_NO_MORE_ITEMS
+
+
+class RemoteRegistry:
+    r"""Remote registry session of an SMB connection shared by everything running against the host.
+
+    The RemoteRegistry service is started and \winreg bound once, on first use, and opened key handles are cached by
+    path. Users hold the session with `with connection.registry as reg:`, the service is only restored and the handles
+    closed once the last holder leaves, so modules running one after the other on the same host share the same setup.
+    """
+
+    ROOT_KEYS = {
+        "HKLM": rrp.hOpenLocalMachine,
+        "HKEY_LOCAL_MACHINE": rrp.hOpenLocalMachine,
+        "HKU": rrp.hOpenUsers,
+        "HKEY_USERS": rrp.hOpenUsers,
+        "HKCU": rrp.hOpenCurrentUser,
+        "HKEY_CURRENT_USER": rrp.hOpenCurrentUser,
+        "HKCR": rrp.hOpenClassesRoot,
+        "HKEY_CLASSES_ROOT": rrp.hOpenClassesRoot,
+        "HKCC": rrp.hOpenCurrentConfig,
+        "HKEY_CURRENT_CONFIG": rrp.hOpenCurrentConfig,
+    }
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.holders = 0
+        self.conn = None
+        self.remote_ops = None
+        self.handles = {}
+
+    @property
+    def logger(self):
+        return self.connection.logger
+
+    def __enter__(self):
+        self.holders += 1
+        return self
+
+    def __exit__(self, *args):
+        self.holders -= 1
+        if self.holders == 0:
+            self.close()
+
+    def get_remote_ops(self):
+        """Returns the RemoteOperations with the registry enabled, the svcctl binding of it can be reused as well"""
+        if self.remote_ops is None or self.conn is not self.connection.conn:
+            self.close()
+            self.conn = self.connection.conn
+            self.remote_ops = RemoteOperations(self.conn, self.connection.kerberos, self.connection.kdcHost)
+            self.remote_ops.enableRegistry()
+            self.logger.debug("Remote registry enabled and \\winreg bound")
+        return self.remote_ops
+
+    def get_dce(self):
+        return self.get_remote_ops()._RemoteOperations__rrp
+
+    @staticmethod
+    def normalize(key_name):
+        return key_name.strip("\\").lower()
+
+    def open_key(self, key_name):
+        r"""Returns a handle on a key given by its full path, e.g. HKLM\SOFTWARE\Microsoft. Handles are cached."""
+        dce = self.get_dce()
+        path = self.normalize(key_name)
+        if path not in self.handles:
+            root_key, _, subkey = key_name.strip("\\").partition("\\")
+            if root_key.upper() not in self.ROOT_KEYS:
+                raise ValueError(f"Invalid root key {root_key}, must be one of HKLM, HKU, HKCU, HKCR or HKCC")
+            root_path = self.normalize(root_key)
+            if root_path not in self.handles:
+                self.handles[root_path] = self.ROOT_KEYS[root_key.upper()](dce)["phKey"]
+            if subkey:
+                self.handles[path] = rrp.hBaseRegOpenKey(dce, self.handles[root_path], subkey)["phkResult"]
+        return self.handles[path]
+
+    def close_key(self, key_name):
+        """Closes the cached handles of a key and of all its subkeys, e.g. before unloading a hive"""
+        path = self.normalize(key_name)
+        for cached_path in [p for p in self.handles if p == path or p.startswith(f"{path}\\")]:
+            rrp.hBaseRegCloseKey(self.get_dce(), self.handles.pop(cached_path))
+
+    def query_value(self, key_name, value_name):
+        """Returns the (type, data) tuple of a value, raises DCERPCSessionError if the key or the value does not exist"""
+        return rrp.hBaseRegQueryValue(self.get_dce(), self.open_key(key_name), value_name)
+
+    def query_values(self, key_name, value_names):
+        """Reads several values of the same key through a single key handle.
+
+        Returns a dict mapping each value name to its (type, data) tuple, or None if the value does not exist.
+        Raises DCERPCSessionError if the key itself does not exist.
+        """
+        dce = self.get_dce()
+        key_handle = self.open_key(key_name)
+        values = {}
+        for value_name in value_names:
+            try:
+                values[value_name] = rrp.hBaseRegQueryValue(dce, key_handle, value_name)
+            except DCERPCSessionError as e:
+                if e.error_code != ERROR_FILE_NOT_FOUND:
+                    raise
+                values[value_name] = None
+        return values
+
+    def enum_values(self, key_name):
+        """Returns a list of (name, type, raw data) tuples of all values of a key"""
+        dce = self.get_dce()
+        key_handle = self.open_key(key_name)
+        values = []
+        i = 0
+        while True:
+            try:
+                ans = rrp.hBaseRegEnumValue(dce, key_handle, i)
+            except DCERPCSessionError as e:
+                if e.error_code == ERROR_NO_MORE_ITEMS:
+                    return values
+                raise
+            values.append((ans["lpValueNameOut"][:-1], ans["lpType"], b"".join(ans["lpData"])))
+            i += 1
+
+    def subkeys(self, key_name):
+        """Returns the names of the subkeys of a key"""
+        dce = self.get_dce()
+        key_handle = self.open_key(key_name)
+        count = rrp.hBaseRegQueryInfoKey(dce, key_handle)["lpcSubKeys"]
+        return [rrp.hBaseRegEnumKey(dce, key_handle, i)["lpNameOut"][:-1] for i in range(count)]
+
+    def close(self):
+        if self.remote_ops is None:
+            return
+        # Close the subkeys before their root keys
+        dce = self.remote_ops._RemoteOperations__rrp
+        for path in sorted(self.handles, key=len, reverse=True):
+            try:
+                rrp.hBaseRegCloseKey(dce, self.handles[path])
+            except Exception as e:
+                self.logger.debug(f"Error closing registry key {path}: {e}")
+        self.handles = {}
+        try:
+            self.remote_ops.finish()
+        except Exception as e:
+            self.logger.debug(f"Error restoring the remote registry service: {e}")
+        self.remote_ops = None
+        self.conn = None
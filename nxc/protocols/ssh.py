@@ -1,5 +1,6 @@
 import paramiko
 import re
+import socket
 import uuid
 import logging
 import time
@@ -9,17 +10,20 @@ from nxc.connection import connection, highlight
 from nxc.logger import NXCAdapter
 from paramiko.ssh_exception import (
     AuthenticationException,
-    NoValidConnectionsError,
     SSHException,
 )
 
 
 class ssh(connection):
+    # Seconds between keepalives, so the transport reused for the logins and commands isn't dropped by idle timeouts
+    KEEPALIVE_INTERVAL = 30
+
     def __init__(self, args, db, host):
         self.protocol = "SSH"
         self.remote_version = "Unknown SSH Version"
         self.server_os_platform = "Linux"
         self.uac = ""
+        self.host_id = None
         super().__init__(args, db, host)
 
     def proto_flow(self):
@@ -58,21 +62,58 @@ class ssh(connection):
         if self.conn._transport.remote_version:
             self.remote_version = self.conn._transport.remote_version
         self.logger.debug(f"Remote version: {self.remote_version}")
-        self.db.add_host(self.host, self.port, self.remote_version)
+        self.host_id = self.db.add_host(self.host, self.port, self.remote_version)
 
     def create_conn_obj(self):
         self.conn = paramiko.SSHClient()
         self.conn.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        return self.connect_transport()
+
+    def connect_transport(self):
+        """Connects and negotiates a new transport for self.conn.
+
+        Servers take several authentication attempts per connection (MaxAuthTries), so the logins reuse the transport and
+        only reconnect once the server closed it or a login succeeded on it.
+        """
+        self.conn.close()
         try:
-            self.conn.connect(self.host, port=self.port, timeout=self.args.ssh_timeout, look_for_keys=False, allow_agent=False)
-        except AuthenticationException:
-            return True
-        except SSHException:
-            return True
-        except NoValidConnectionsError:
+            sock = socket.create_connection((self.host, self.port), timeout=self.args.ssh_timeout)
+        except OSError as e:
+            self.logger.debug(f"Could not connect: {e}")
             return False
+        transport = paramiko.Transport(sock)
+        transport.banner_timeout = self.args.ssh_timeout
+        transport.auth_timeout = self.args.ssh_timeout
+        transport.set_keepalive(self.KEEPALIVE_INTERVAL)
+        self.conn._transport = transport
+        try:
+            transport.start_client(timeout=self.args.ssh_timeout)
+        except (SSHException, EOFError) as e:
+            # The banner may have been read nonetheless, enum_host_info() skips the host otherwise
+            self.logger.debug(f"SSH negotiation failed: {e}")
         except OSError:
             return False
+        return True
+
+    def authenticate(self, username, password=None, pkey=None):
+        for retry in (False, True):
+            transport = self.conn._transport
+            if retry or transport is None or not transport.is_active() or transport.is_authenticated():
+                if not self.connect_transport():
+                    raise SSHException("Could not reconnect to the server")
+                transport = self.conn._transport
+            try:
+                if pkey is not None:
+                    transport.auth_publickey(username, pkey)
+                else:
+                    transport.auth_password(username, password)
+                return
+            except AuthenticationException:
+                raise
+            except (SSHException, EOFError):
+                # The server closed the connection, e.g. once MaxAuthTries was reached: try again on a new one
+                if retry or transport.is_active():
+                    raise
 
     def check_if_admin(self):
         self.admin_privs = False
@@ -189,37 +230,23 @@ class ssh(connection):
             if self.args.key_file or private_key:
                 self.logger.debug(f"Logging {self.host} with username: {username}, keyfile: {self.args.key_file}")
 
-                self.conn.connect(
-                    self.host,
-                    port=self.port,
-                    username=username,
-                    passphrase=password if password != "" else None,
-                    key_filename=private_key if private_key else self.args.key_file,
-                    timeout=self.args.ssh_timeout,
-                    look_for_keys=False,
-                    allow_agent=False,
-                    banner_timeout=self.args.ssh_timeout,
-                )
+                pkey = paramiko.PKey.from_path(private_key if private_key else self.args.key_file, passphrase=password if password != "" else None)
+                self.authenticate(username, pkey=pkey)
 
+                if not private_key:
+                    with open(self.args.key_file) as key_file:
+                        private_key = key_file.read()
                 cred_id = self.db.add_credential(
                     "key",
                     username,
                     password if password != "" else "",
                     key=private_key,
+                    fingerprint=pkey.fingerprint,
                 )
 
             else:
                 self.logger.debug(f"Logging {self.host} with username: {self.username}, password: {self.password}")
-                self.conn.connect(
-                    self.host,
-                    port=self.port,
-                    username=username,
-                    password=password,
-                    timeout=self.args.ssh_timeout,
-                    look_for_keys=False,
-                    allow_agent=False,
-                    banner_timeout=self.args.ssh_timeout,
-                )
+                self.authenticate(username, password=password)
                 cred_id = self.db.add_credential("plaintext", username, password)
 
             # Some IOT devices will not raise exception in self.conn._transport.auth_password / self.conn._transport.auth_publickey
@@ -240,7 +267,7 @@ class ssh(connection):
             return False
         else:
             shell_access = False
-            host_id = self.db.get_hosts(self.host)[0].id
+            host_id = self.host_id
 
             if not stdout:
                 _, stdout, _ = self.conn.exec_command("whoami /priv")
@@ -1,6 +1,6 @@
 from sqlalchemy.dialects.sqlite import Insert
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import MetaData, Table, select, func, delete
+from sqlalchemy import MetaData, Table, select, func, delete, or_, text
 from sqlalchemy.exc import (
     IllegalStateChangeError,
     NoInspectionAvailable,
@@ -8,8 +8,14 @@ from sqlalchemy.exc import (
 )
 
 import os
+import io
+import base64
+import hashlib
+import contextlib
+import paramiko
 from pathlib import Path
 import configparser
+from threading import Lock
 
 from nxc.logger import nxc_logger
 from nxc.paths import NXC_PATH
@@ -29,6 +35,11 @@ class database:
         self.AdminRelationsTable = None
         self.KeysTable = None
 
+        # IDs of the hosts and credentials already stored, so that logins don't look them up again
+        self.id_lock = Lock()
+        self.host_ids = {}
+        self.cred_ids = {}
+
         self.db_engine = db_engine
         self.db_path = self.db_engine.url.database
         self.protocol = Path(self.db_path).stem.upper()
@@ -46,7 +57,8 @@ class database:
             "id" integer PRIMARY KEY,
             "username" text,
             "password" text,
-            "credtype" text
+            "credtype" text,
+            UNIQUE(credtype, username, password)
         )"""
         )
         db_conn.execute(
@@ -55,7 +67,8 @@ class database:
             "host" text,
             "port" integer,
             "banner" text,
-            "os" text
+            "os" text,
+            UNIQUE(host, port)
         )"""
         )
         db_conn.execute(
@@ -65,7 +78,8 @@ class database:
             "hostid" integer,
             "shell" boolean,
             FOREIGN KEY(credid) REFERENCES credentials(id),
-            FOREIGN KEY(hostid) REFERENCES hosts(id)
+            FOREIGN KEY(hostid) REFERENCES hosts(id),
+            UNIQUE(credid, hostid)
         )"""
         )
         # "admin" access with SSH means we have root access, which implies shell access since we run commands to check
@@ -75,7 +89,8 @@ class database:
             "credid" integer,
             "hostid" integer,
             FOREIGN KEY(credid) REFERENCES credentials(id),
-            FOREIGN KEY(hostid) REFERENCES hosts(id)
+            FOREIGN KEY(hostid) REFERENCES hosts(id),
+            UNIQUE(credid, hostid)
         )"""
         )
         db_conn.execute(
@@ -83,18 +98,72 @@ class database:
             "id" integer PRIMARY KEY,
             "credid" integer,
             "data" text,
-            FOREIGN KEY(credid) REFERENCES credentials(id)
+            "fingerprint" text,
+            FOREIGN KEY(credid) REFERENCES credentials(id),
+            UNIQUE(credid, fingerprint)
         )"""
         )
 
+    @staticmethod
+    def key_fingerprint(key):
+        """Fingerprint of the public key of a private key, as stored by the logins, or the digest of the key data if it
+        can't be loaded (encrypted or unsupported keys)
+        """
+        for key_class in (paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.RSAKey):
+            with contextlib.suppress(Exception):
+                return key_class.from_private_key(io.StringIO(key)).fingerprint
+        return "SHA256:" + base64.b64encode(hashlib.sha256((key or "").strip().encode()).digest()).decode().rstrip("=")
+
+    def migrate_unique_keys(self, conn):
+        """Adds the unique keys to a workspace created before them, merging the rows they would reject"""
+        unique_keys = {
+            "hosts": ("host", "port"),
+            "credentials": ("credtype", "username", "password"),
+            "loggedin_relations": ("credid", "hostid"),
+            "admin_relations": ("credid", "hostid"),
+            "keys": ("credid", "fingerprint"),
+        }
+
+        def delete_duplicates(table):
+            columns = ", ".join(f'"{column}"' for column in unique_keys[table])
+            conn.execute(text(f'DELETE FROM "{table}" WHERE "id" NOT IN (SELECT MIN("id") FROM "{table}" GROUP BY {columns})'))
+
+        conn.execute(text('ALTER TABLE "keys" ADD COLUMN "fingerprint" text'))
+        for key_id, data in conn.execute(text('SELECT "id", "data" FROM "keys"')).all():
+            conn.execute(text('UPDATE "keys" SET "fingerprint" = :fingerprint WHERE "id" = :id'), {"fingerprint": self.key_fingerprint(data), "id": key_id})
+
+        # Duplicated hosts and credentials are merged into their first row, the rows referencing them are moved there
+        for table, references in (
+            ("hosts", (("loggedin_relations", "hostid"), ("admin_relations", "hostid"))),
+            ("credentials", (("loggedin_relations", "credid"), ("admin_relations", "credid"), ("keys", "credid"))),
+        ):
+            same = " AND ".join(f'd."{column}" IS t."{column}"' for column in unique_keys[table])
+            for ref_table, ref_column in references:
+                first = f'SELECT MIN(t."id") FROM "{table}" t JOIN "{table}" d ON {same} WHERE d."id" = "{ref_table}"."{ref_column}"'
+                conn.execute(text(f'UPDATE "{ref_table}" SET "{ref_column}" = ({first}) WHERE "{ref_column}" IN (SELECT "id" FROM "{table}")'))
+            delete_duplicates(table)
+
+        # A merged loggedin relation keeps the shell access found by any of its duplicates
+        conn.execute(text('UPDATE "loggedin_relations" SET "shell" = (SELECT MAX(r."shell") FROM "loggedin_relations" r WHERE r."credid" = "loggedin_relations"."credid" AND r."hostid" = "loggedin_relations"."hostid")'))
+        for table in ("loggedin_relations", "admin_relations", "keys"):
+            delete_duplicates(table)
+
+        for table, columns in unique_keys.items():
+            columns = ", ".join(f'"{column}"' for column in columns)
+            conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table}_unique" ON "{table}" ({columns})'))
+
     def reflect_tables(self):
-        with self.db_engine.connect():
+        with self.db_engine.connect() as conn:
             try:
                 self.CredentialsTable = Table("credentials", self.metadata, autoload_with=self.db_engine)
                 self.HostsTable = Table("hosts", self.metadata, autoload_with=self.db_engine)
                 self.LoggedinRelationsTable = Table("loggedin_relations", self.metadata, autoload_with=self.db_engine)
                 self.AdminRelationsTable = Table("admin_relations", self.metadata, autoload_with=self.db_engine)
                 self.KeysTable = Table("keys", self.metadata, autoload_with=self.db_engine)
+                if "fingerprint" not in self.KeysTable.c:
+                    # Workspaces created before the unique keys the upserts rely on, which came with the key fingerprints
+                    self.migrate_unique_keys(conn)
+                    self.KeysTable = Table("keys", self.metadata, autoload_with=self.db_engine, extend_existing=True)
             except (NoInspectionAvailable, NoSuchTableError):
                 print(
                     f"""
@@ -117,120 +186,63 @@ class database:
     def clear_database(self):
         for table in self.metadata.sorted_tables:
             self.sess.execute(table.delete())
+        self.clear_id_cache()
+
+    def clear_id_cache(self):
+        with self.id_lock:
+            self.host_ids.clear()
+            self.cred_ids.clear()
 
     def add_host(self, host, port, banner, os=None):
-        """Check if this host has already been added to the database, if not, add it in."""
-        hosts = []
-        updated_ids = []
+        """Adds the host to the database or updates its banner and OS, returns the host ID"""
+        new_host = {
+            "host": host,
+            "port": port,
+            "banner": banner if banner is not None else "",
+            "os": os if os is not None else "",
+        }
+        q = Insert(self.HostsTable).values(new_host)
+        # only update column if it is being passed in
+        update_columns = {col.name: col for col in q.excluded if (col.name == "banner" and banner is not None) or (col.name == "os" and os is not None)}
+        index_elements = [self.HostsTable.c.host, self.HostsTable.c.port]
+        q = q.on_conflict_do_update(index_elements=index_elements, set_=update_columns) if update_columns else q.on_conflict_do_nothing(index_elements=index_elements)
+        nxc_logger.debug(f"add_host(): {new_host}")
+        self.sess.execute(q)
+        return self.get_host_id(host, port)
+
+    def get_host_id(self, host, port):
+        """Returns the ID of the host on this port, or None if it is not in the database"""
+        with self.id_lock:
+            if (host, port) in self.host_ids:
+                return self.host_ids[(host, port)]
+
+        q = select(self.HostsTable.c.id).filter(self.HostsTable.c.host == host, self.HostsTable.c.port == port)
+        host_id = self.sess.execute(q).scalar()
+        if host_id is not None:
+            with self.id_lock:
+                self.host_ids[(host, port)] = host_id
+        return host_id
+
+    def add_credential(self, credtype, username, password, key=None, fingerprint=None):
+        """Adds the credential to the database if it is not already in, returns the credential ID.
+
+        Keys are stored with the credential of their user and passphrase, a user can have several keys sharing the same
+        passphrase, and a separate login password.
+        """
+        new_cred = {
+            "credtype": credtype,
+            "username": username,
+            "password": password,
+        }
+        q = Insert(self.CredentialsTable).values(new_cred)
+        q = q.on_conflict_do_nothing(index_elements=[self.CredentialsTable.c.credtype, self.CredentialsTable.c.username, self.CredentialsTable.c.password])
+        nxc_logger.debug(f"Adding credential: {new_cred}")
+        self.sess.execute(q)
 
-        q = select(self.HostsTable).filter(self.HostsTable.c.host == host)
-        results = self.sess.execute(q).all()
-        nxc_logger.debug(f"add_host(): Initial hosts results: {results}")
-
-        # create new host
-        if not results:
-            new_host = {
-                "host": host,
-                "port": port,
-                "banner": banner if banner is not None else "",
-                "os": os if os is not None else "",
-            }
-            hosts = [new_host]
-        # update existing hosts data
-        else:
-            for host_result in results:
-                host_data = host_result._asdict()
-                nxc_logger.debug(f"host: {host_result}")
-                nxc_logger.debug(f"host_data: {host_data}")
-                # only update column if it is being passed in
-                if host is not None:
-                    host_data["host"] = host
-                if port is not None:
-                    host_data["port"] = port
-                if banner is not None:
-                    host_data["banner"] = banner
-                if os is not None:
-                    host_data["os"] = os
-                # only add host to be updated if it has changed
-                if host_data not in hosts:
-                    hosts.append(host_data)
-                    updated_ids.append(host_data["id"])
-        nxc_logger.debug(f"Hosts: {hosts}")
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q = Insert(self.HostsTable)  # .returning(self.HostsTable.c.id)
-        update_columns = {col.name: col for col in q.excluded if col.name not in "id"}
-        q = q.on_conflict_do_update(index_elements=self.HostsTable.primary_key, set_=update_columns)
-
-        self.sess.execute(q, hosts)  # .scalar()
-        # we only return updated IDs for now - when RETURNING clause is allowed we can return inserted
-        if updated_ids:
-            nxc_logger.debug(f"add_host() - Host IDs Updated: {updated_ids}")
-            return updated_ids
-
-    def add_credential(self, credtype, username, password, key=None):
-        """Check if this credential has already been added to the database, if not add it in."""
-        credentials = []
-
-        # a user can have multiple keys, all with passphrases, and a separate login password
+        cred_id = self.get_credential(credtype, username, password)
         if key is not None:
-            q = (
-                select(self.CredentialsTable)
-                .join(self.KeysTable)
-                .filter(
-                    func.lower(self.CredentialsTable.c.username) == func.lower(username),
-                    func.lower(self.CredentialsTable.c.credtype) == func.lower(credtype),
-                    self.KeysTable.c.data == key,
-                )
-            )
-            results = self.sess.execute(q).all()
-        else:
-            q = select(self.CredentialsTable).filter(
-                func.lower(self.CredentialsTable.c.username) == func.lower(username),
-                func.lower(self.CredentialsTable.c.credtype) == func.lower(credtype),
-            )
-            results = self.sess.execute(q).all()
-
-        # add new credential
-        if not results:
-            new_cred = {
-                "credtype": credtype,
-                "username": username,
-                "password": password,
-            }
-            credentials = [new_cred]
-        # update existing cred data
-        else:
-            for creds in results:
-                # this will include the id, so we don't touch it
-                cred_data = creds._asdict()
-                # only update column if it is being passed in
-                if credtype is not None:
-                    cred_data["credtype"] = credtype
-                if username is not None:
-                    cred_data["username"] = username
-                if password is not None:
-                    cred_data["password"] = password
-                # only add cred to be updated if it has changed
-                if cred_data not in credentials:
-                    credentials.append(cred_data)
-
-        # TODO: find a way to abstract this away to a single Upsert call
-        q_users = Insert(self.CredentialsTable)  # .returning(self.CredentialsTable.c.id)
-        update_columns_users = {col.name: col for col in q_users.excluded if col.name not in "id"}
-        q_users = q_users.on_conflict_do_update(index_elements=self.CredentialsTable.primary_key, set_=update_columns_users)
-        nxc_logger.debug(f"Adding credentials: {credentials}")
-
-        self.sess.execute(q_users, credentials)  # .scalar()
-
-        # hacky way to get cred_id since we can't use returning() yet
-        if len(credentials) == 1:
-            cred_id = self.get_credential(credtype, username, password)
-            if key is not None:
-                self.add_key(cred_id, key)
-            return cred_id
-        else:
-            return credentials
+            self.add_key(cred_id, key, fingerprint)
+        return cred_id
 
     def remove_credentials(self, creds_id):
         """Removes a credential ID from the database"""
@@ -239,19 +251,17 @@ class database:
             q = delete(self.CredentialsTable).filter(self.CredentialsTable.c.id == cred_id)
             del_hosts.append(q)
         self.sess.execute(q)
+        self.clear_id_cache()
+
+    def add_key(self, cred_id, key, fingerprint=None):
+        """Stores the key of a credential once per fingerprint (derived from the key data if not given), returns the key ID"""
+        if fingerprint is None:
+            fingerprint = self.key_fingerprint(key)
 
-    def add_key(self, cred_id, key):
-        # check if key relation already exists
-        check_q = self.sess.execute(select(self.KeysTable).filter(self.KeysTable.c.credid == cred_id)).all()
-        nxc_logger.debug(f"check_q: {check_q}")
-        if check_q:
-            nxc_logger.debug(f"Key already exists for cred_id {cred_id}")
-            return None
-
-        key_data = {"credid": cred_id, "data": key}
-        self.sess.execute(Insert(self.KeysTable), key_data)
-        key_id = self.sess.execute(select(self.KeysTable).filter(self.KeysTable.c.credid == cred_id)).all()[0].id
-        nxc_logger.debug(f"Key added: {key_id}")
+        q = Insert(self.KeysTable).values({"credid": cred_id, "data": key, "fingerprint": fingerprint})
+        self.sess.execute(q.on_conflict_do_nothing(index_elements=[self.KeysTable.c.credid, self.KeysTable.c.fingerprint]))
+        key_id = self.sess.execute(select(self.KeysTable.c.id).filter(self.KeysTable.c.credid == cred_id, self.KeysTable.c.fingerprint == fingerprint)).scalar()
+        nxc_logger.debug(f"Key {fingerprint} of cred_id {cred_id}: {key_id}")
         return key_id
 
     def get_keys(self, key_id=None, cred_id=None):
@@ -263,38 +273,14 @@ class database:
         return self.sess.execute(q).all()
 
     def add_admin_user(self, credtype, username, secret, host_id=None, cred_id=None):
-        add_links = []
-
-        creds_q = select(self.CredentialsTable)
-        if cred_id:  # noqa: SIM108
-            creds_q = creds_q.filter(self.CredentialsTable.c.id == cred_id)
-        else:
-            creds_q = creds_q.filter(
-                func.lower(self.CredentialsTable.c.credtype) == func.lower(credtype),
-                func.lower(self.CredentialsTable.c.username) == func.lower(username),
-                self.CredentialsTable.c.password == secret,
-            )
-        creds = self.sess.execute(creds_q)
-        hosts = self.get_hosts(host_id)
-
-        if creds and hosts:
-            for cred, host in zip(creds, hosts):
-                cred_id = cred[0]
-                host_id = host[0]
-                link = {"credid": cred_id, "hostid": host_id}
-                admin_relations_select = select(self.AdminRelationsTable).filter(
-                    self.AdminRelationsTable.c.credid == cred_id,
-                    self.AdminRelationsTable.c.hostid == host_id,
-                )
-                links = self.sess.execute(admin_relations_select).all()
-
-                if not links:
-                    add_links.append(link)
+        if cred_id is None:
+            cred_id = self.get_credential(credtype, username, secret)
+        if cred_id is None or host_id is None:
+            nxc_logger.debug(f"add_admin_user() - unknown credential {username} or host {host_id}")
+            return
 
-        admin_relations_insert = Insert(self.AdminRelationsTable)
-
-        if add_links:
-            self.sess.execute(admin_relations_insert, add_links)
+        q = Insert(self.AdminRelationsTable).values({"credid": cred_id, "hostid": host_id})
+        self.sess.execute(q.on_conflict_do_nothing(index_elements=[self.AdminRelationsTable.c.credid, self.AdminRelationsTable.c.hostid]))
 
     def get_admin_relations(self, cred_id=None, host_id=None):
         if cred_id:
@@ -343,14 +329,20 @@ class database:
         return self.sess.execute(q).all()
 
     def get_credential(self, cred_type, username, password):
-        q = select(self.CredentialsTable).filter(
+        with self.id_lock:
+            if (cred_type, username, password) in self.cred_ids:
+                return self.cred_ids[(cred_type, username, password)]
+
+        q = select(self.CredentialsTable.c.id).filter(
             self.CredentialsTable.c.username == username,
             self.CredentialsTable.c.password == password,
             self.CredentialsTable.c.credtype == cred_type,
         )
-        results = self.sess.execute(q).first()
-        if results is not None:
-            return results.id
+        cred_id = self.sess.execute(q).scalar()
+        if cred_id is not None:
+            with self.id_lock:
+                self.cred_ids[(cred_type, username, password)] = cred_id
+        return cred_id
 
     def is_host_valid(self, host_id):
         """Check if this host ID is valid."""
@@ -398,26 +390,18 @@ class database:
         return self.sess.execute(q).all()
 
     def add_loggedin_relation(self, cred_id, host_id, shell=False):
-        relation_query = select(self.LoggedinRelationsTable).filter(
-            self.LoggedinRelationsTable.c.credid == cred_id,
-            self.LoggedinRelationsTable.c.hostid == host_id,
+        relation = {"credid": cred_id, "hostid": host_id, "shell": shell}
+        nxc_logger.debug(f"Upserting loggedin_relations: {relation}")
+        q = Insert(self.LoggedinRelationsTable).values(relation)
+        # a shell found once is kept when a later login of the same credential doesn't get one
+        q = q.on_conflict_do_update(
+            index_elements=[self.LoggedinRelationsTable.c.credid, self.LoggedinRelationsTable.c.hostid],
+            set_={"shell": or_(self.LoggedinRelationsTable.c.shell, q.excluded.shell)},
         )
-        results = self.sess.execute(relation_query).all()
-
-        # only add one if one doesn't already exist
-        if not results:
-            relation = {"credid": cred_id, "hostid": host_id, "shell": shell}
-            try:
-                nxc_logger.debug(f"Inserting loggedin_relations: {relation}")
-                # TODO: find a way to abstract this away to a single Upsert call
-                q = Insert(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
-
-                self.sess.execute(q, [relation])  # .scalar()
-                inserted_id_results = self.get_loggedin_relations(cred_id, host_id)
-                nxc_logger.debug(f"Checking if relation was added: {inserted_id_results}")
-                return inserted_id_results[0].id
-            except Exception as e:
-                nxc_logger.debug(f"Error inserting LoggedinRelation: {e}")
+        try:
+            self.sess.execute(q)
+        except Exception as e:
+            nxc_logger.debug(f"Error upserting LoggedinRelation: {e}")
 
     def get_loggedin_relations(self, cred_id=None, host_id=None, shell=None):
         q = select(self.LoggedinRelationsTable)  # .returning(self.LoggedinRelationsTable.c.id)
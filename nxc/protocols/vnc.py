@@ -1,6 +1,7 @@
 import asyncio
 import os
 from datetime import datetime
+from threading import local
 
 from aardwolf.commons.target import RDPTarget
 
@@ -13,6 +14,28 @@ from aardwolf.commons.queuedata.constants import VIDEO_FORMAT
 from asyauth.common.credentials import UniCredential
 from asyauth.common.constants import asyauthSecret, asyauthProtocol
 
+# Connection attempts retried with a doubling delay while the server answers that there were too many attempts
+THROTTLE_RETRIES = 5
+
+loops = local()
+
+
+def run(coroutine):
+    """Runs a coroutine on the event loop of the worker thread, which is kept for all the hosts and attempts it runs
+    instead of one loop being created and torn down per connection attempt with asyncio.run()
+    """
+    if not hasattr(loops, "loop"):
+        loops.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loops.loop)
+    try:
+        return loops.loop.run_until_complete(coroutine)
+    finally:
+        # The connections leave their reader tasks behind, cancel them like asyncio.run() would but keep the loop
+        pending = asyncio.all_tasks(loops.loop)
+        for task in pending:
+            task.cancel()
+        loops.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
 
 class vnc(connection):
     def __init__(self, args, db, host):
@@ -23,6 +46,8 @@ class vnc(connection):
         self.url = None
         self.target = None
         self.credential = None
+        # Security types offered by the server, from the handshake made by create_conn_obj
+        self.security_types = []
         connection.__init__(self, args, db, host)
 
     def proto_flow(self):
@@ -52,20 +77,32 @@ class vnc(connection):
         try:
             self.target = RDPTarget(ip=self.host, port=self.port)
             credential = UniCredential(protocol=asyauthProtocol.PLAIN, stype=asyauthSecret.NONE)
-            self.conn = VNCConnection(target=self.target, credentials=credential, iosettings=self.iosettings)
-            asyncio.run(self.connect_vnc(True))
+            run(self.connect_vnc(credential, disconnect=True))
         except Exception as e:
             self.logger.debug(str(e))
             if "Server supports:" not in str(e):
                 return False
+        finally:
+            if self.conn is not None:
+                self.security_types = self.conn.server_supp_security_types
         return True
 
-    async def connect_vnc(self, discover=False):
-        _, err = await self.conn.connect()
-        if err is not None:
-            if not discover:
-                await asyncio.sleep(self.args.vnc_sleep)
-            raise err
+    async def connect_vnc(self, credential, disconnect=False):
+        """Connects with the given credential, backing off only while the server answers there were too many attempts"""
+        delay = self.args.vnc_sleep
+        for attempt in range(THROTTLE_RETRIES + 1):
+            self.conn = VNCConnection(target=self.target, credentials=credential, iosettings=self.iosettings)
+            _, err = await self.conn.connect()
+            if err is None:
+                break
+            # e.g. "Too many authentication failures" (RealVNC, libvncserver) or "Too many security failures" (TigerVNC)
+            if "too many" not in str(err).lower() or attempt == THROTTLE_RETRIES:
+                raise err
+            self.logger.debug(f"Rate limited by the server ({err}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay *= 2
+        if disconnect:
+            await self.conn.terminate()
         return True
 
     def plaintext_login(self, username, password):
@@ -73,13 +110,12 @@ class vnc(connection):
             stype = asyauthSecret.PASS
             if password == "":
                 stype = asyauthSecret.NONE
+            # No need to connect if the server does not offer the security type (1: None, 2: VNC authentication)
+            security_type = 1 if stype == asyauthSecret.NONE else 2
+            if self.security_types and security_type not in self.security_types:
+                raise Exception(f"Server supports: {','.join(map(str, self.security_types))}")
             self.credential = UniCredential(secret=password, protocol=asyauthProtocol.PLAIN, stype=stype)
-            self.conn = VNCConnection(
-                target=self.target,
-                credentials=self.credential,
-                iosettings=self.iosettings,
-            )
-            asyncio.run(self.connect_vnc())
+            run(self.connect_vnc(self.credential, disconnect=True))
 
             self.admin_privs = True
             self.logger.success(
@@ -104,14 +140,16 @@ class vnc(connection):
             return False
 
     async def screen(self):
-        self.conn = VNCConnection(target=self.target, credentials=self.credential, iosettings=self.iosettings)
-        await self.connect_vnc()
-        await asyncio.sleep(int(self.args.screentime))
-        if self.conn is not None and self.conn.desktop_buffer_has_data is True:
-            buffer = self.conn.get_desktop_buffer(VIDEO_FORMAT.PIL)
-            filename = os.path.expanduser(f"~/.nxc/screenshots/{self.hostname}_{self.host}_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.png")
-            buffer.save(filename, "png")
-            self.logger.highlight(f"Screenshot saved {filename}")
+        await self.connect_vnc(self.credential)
+        try:
+            await asyncio.sleep(int(self.args.screentime))
+            if self.conn is not None and self.conn.desktop_buffer_has_data is True:
+                buffer = self.conn.get_desktop_buffer(VIDEO_FORMAT.PIL)
+                filename = os.path.expanduser(f"~/.nxc/screenshots/{self.hostname}_{self.host}_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.png")
+                buffer.save(filename, "png")
+                self.logger.highlight(f"Screenshot saved {filename}")
+        finally:
+            await self.conn.terminate()
 
     def screenshot(self):
-        asyncio.run(self.screen())
+        run(self.screen())
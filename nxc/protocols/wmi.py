@@ -8,6 +8,7 @@ from nxc.config import process_secret
 from nxc.connection import connection, dcom_FirewallChecker, requires_admin
 from nxc.logger import NXCAdapter
 from nxc.protocols.wmi import wmiexec, wmiexec_event
+from nxc.protocols.wmi.wmisession import WMISession
 
 from impacket import ntlm
 from impacket.uuid import uuidtup_to_bin
@@ -31,6 +32,7 @@ class wmi(connection):
         self.server_os = None
         self.doKerberos = False
         self.stringBinding = None
+        self.wmi_session = WMISession(self, self.connect_wmi)
         # from: https://learn.microsoft.com/en-us/openspecs/windows_protocols/ms-erref/18d8fbe8-a967-4f1c-ae50-99ca8e491d2d
         self.rpc_error_status = {
             "0000052F": "STATUS_ACCOUNT_RESTRICTION",
@@ -365,11 +367,25 @@ class wmi(connection):
                 self.logger.success(out)
                 return True
 
+    def call_modules(self):
+        # Hold the WMI session while all modules run, so their queries share a single DCOM connection
+        with self.wmi_session:
+            connection.call_modules(self)
+
     # It's very complex to use wmi from rpctansport "convert" to dcom, so let we use dcom directly.
+    def connect_wmi(self):
+        """Makes the DCOM connection of the WMI session, returns it with the IWbemLevel1Login interface"""
+        dcom = DCOMConnection(self.remoteName, self.username, self.password, self.domain, self.lmhash, self.nthash, oxidResolver=True, doKerberos=self.doKerberos, kdcHost=self.kdcHost, aesKey=self.aesKey, remoteHost=self.host)
+        try:
+            return dcom, dcom.CoCreateInstanceEx(CLSID_WbemLevel1Login, IID_IWbemLevel1Login)
+        except Exception:
+            dcom.disconnect()
+            raise
+
     @requires_admin
     def wmi(self, wql=None, namespace=None):
         """Execute WQL syntax via WMI
-        
+
         This is done via the --wmi flag
         """
         records = []
@@ -379,34 +395,22 @@ class wmi(connection):
         if not namespace:
             namespace = self.args.wmi_namespace
 
-        try:
-            dcom = DCOMConnection(self.remoteName, self.username, self.password, self.domain, self.lmhash, self.nthash, oxidResolver=True, doKerberos=self.doKerberos, kdcHost=self.kdcHost, aesKey=self.aesKey, remoteHost=self.host)
-            iInterface = dcom.CoCreateInstanceEx(CLSID_WbemLevel1Login, IID_IWbemLevel1Login)
-            iWbemLevel1Login = IWbemLevel1Login(iInterface)
-            iWbemServices = iWbemLevel1Login.NTLMLogin(namespace, NULL, NULL)
-            iWbemLevel1Login.RemRelease()
-            iEnumWbemClassObject = iWbemServices.ExecQuery(wql)
-        except Exception as e:
-            dcom.disconnect()
-            self.logger.debug(str(e))
-            self.logger.fail(f"Execute WQL error: {e}")
-            return False
-        else:
+        with self.wmi_session as session:
             self.logger.info(f"Executing WQL syntax: {wql}")
             try:
-                while True:
-                    wmi_results = iEnumWbemClassObject.Next(0xFFFFFFFF, 1)[0]
-                    record = wmi_results.getProperties()
+                # Rows are printed batch by batch as they come in
+                for record in session.query(wql, namespace):
                     records.append(record)
                     for k, v in record.items():
                         self.logger.highlight(f"{k} => {v['value']}")
             except Exception as e:
-                if str(e).find("S_FALSE") < 0:
-                    self.logger.debug(e)
-
-            dcom.disconnect()
+                self.logger.debug(str(e))
+                session.close()
+                if not records:
+                    self.logger.fail(f"Execute WQL error: {e}")
+                    return False
 
-            return records
+        return records
 
     @requires_admin
     def execute(self, command=None, get_output=False):
@@ -0,0 +1,97 @@
+import contextlib
+
+from impacket.dcerpc.v5.dcom.wmi import DCERPCSessionError, IWbemClassObject, IWbemLevel1Login, WBEM_FLAG_FORWARD_ONLY, WBEM_FLAG_RETURN_IMMEDIATELY
+from impacket.dcerpc.v5.dcomrt import INTERFACE
+from impacket.dcerpc.v5.dtypes import NULL
+
+S_FALSE = 0x00000001
+
+
+class WMISession:
+    """WMI session of a connection shared by all the WQL queries run against the host.
+
+    The DCOM connection is made with the connect callable of the protocol (returning the DCOMConnection and the
+    IWbemLevel1Login interface) on first use, and the IWbemServices of each namespace is kept for the next queries.
+    Users hold the session with `with connection.wmi_session as session:`, it is only released once the last holder
+    leaves, so the queries of the modules running one after the other on the same host share the same setup.
+    """
+
+    # Objects returned by each IEnumWbemClassObject::Next call, instead of one round trip per object
+    BATCH_SIZE = 256
+
+    def __init__(self, connection, connect):
+        self.connection = connection
+        self.connect = connect
+        self.holders = 0
+        self.dcom = None
+        self.login = None
+        self.services = {}
+
+    @property
+    def logger(self):
+        return self.connection.logger
+
+    def __enter__(self):
+        self.holders += 1
+        return self
+
+    def __exit__(self, *args):
+        self.holders -= 1
+        if self.holders == 0:
+            self.close()
+
+    def get_services(self, namespace):
+        key = namespace.lower()
+        if key not in self.services:
+            if self.login is None:
+                self.dcom, interface = self.connect()
+                self.login = IWbemLevel1Login(interface)
+            self.services[key] = self.login.NTLMLogin(namespace, NULL, NULL)
+            self.logger.debug(f"Logged in to WMI namespace {namespace}")
+        return self.services[key]
+
+    def next_batch(self, enum, services):
+        """Returns the next objects of an enumeration and whether it is over"""
+        try:
+            return enum.Next(0xFFFFFFFF, self.BATCH_SIZE), False
+        except DCERPCSessionError as e:
+            # The last batch is answered with S_FALSE, which impacket raises with the objects still in the packet
+            if e.get_error_code() != S_FALSE or e.get_packet() is None:
+                raise
+            return [
+                IWbemClassObject(INTERFACE(enum.get_cinstance(), b"".join(obj["abData"]), enum.get_ipidRemUnknown(), oxid=enum.get_oxid(), target=enum.get_target()), services)
+                for obj in e.get_packet()["apObjects"]
+            ], True
+
+    def query(self, wql, namespace="root\\cimv2"):
+        """Runs a WQL query and yields the properties of each object as the batches come in"""
+        services = self.get_services(namespace)
+        # Semi-synchronous and forward-only: the first objects come back while the query still runs on the target,
+        # and the target doesn't keep the objects already sent
+        enum = services.ExecQuery(wql, WBEM_FLAG_RETURN_IMMEDIATELY | WBEM_FLAG_FORWARD_ONLY)
+        try:
+            done = False
+            while not done:
+                objects, done = self.next_batch(enum, services)
+                for obj in objects:
+                    yield obj.getProperties()
+        finally:
+            with contextlib.suppress(Exception):
+                enum.RemRelease()
+
+    def close(self):
+        if self.dcom is None:
+            return
+        for services in self.services.values():
+            with contextlib.suppress(Exception):
+                services.RemRelease()
+        if self.login is not None:
+            with contextlib.suppress(Exception):
+                self.login.RemRelease()
+        try:
+            self.dcom.disconnect()
+        except Exception as e:
+            self.logger.debug(f"Error disconnecting the WMI session: {e}")
+        self.dcom = None
+        self.login = None
+        self.services = {}
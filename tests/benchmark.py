@@ -0,0 +1,455 @@
+"""End to end throughput benchmark of nxc against local stand-in servers.
+
+Local stand-ins (impacket's SimpleSMBServer, a paramiko SSH server, a minimal FTP server and a fake LDAP responder) run in
+a separate process and listen on all addresses, so every address of 127.0.0.0/8 reaches them without having to configure
+loopback aliases. nxc is then run against thousands of these addresses and the results are written to a JSON file:
+hosts/sec, logins/sec and DB rows/sec of the run, percentiles of the connection latency seen by the stand-ins, and the
+peak RSS and thread count of the nxc process. Comparing against a previous result file flags throughput regressions.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shlex
+import socketserver
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+from ipaddress import ip_address
+from multiprocessing import Pipe, Process
+from os.path import abspath, dirname, isfile, join
+from time import perf_counter, sleep, time
+
+from rich.console import Console
+
+script_dir = dirname(abspath(__file__))
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "Bench123!"
+BENCH_DOMAIN = "bench.local"
+
+# Metrics where a higher value is better, the others are compared the other way around
+HIGHER_IS_BETTER = ("hosts_per_sec", "logins_per_sec", "db_rows_per_sec")
+LOWER_IS_BETTER = ("latency_p50", "latency_p90", "latency_p99", "peak_rss_kb", "peak_threads")
+
+
+def get_cli_args():
+    parser = argparse.ArgumentParser(description="Benchmark the scan throughput of nxc against local stand-in servers")
+    parser.add_argument("--executable", default="netexec")
+    parser.add_argument("--poetry", action="store_true", help="Use poetry to run nxc")
+    parser.add_argument("--protocols", nargs="+", default=["smb", "ssh", "ftp"], choices=["smb", "ssh", "ftp", "ldap"], help="Protocols to benchmark, ldap needs to listen on port 389 (root)")
+    parser.add_argument("-n", "--targets", type=int, default=2000, help="Number of synthetic targets per protocol")
+    parser.add_argument("--base-ip", default="127.1.0.1", help="First loopback address of the synthetic targets")
+    parser.add_argument("--listen", default="0.0.0.0", help="Address the stand-ins listen on, it must cover the synthetic targets")
+    parser.add_argument("--threads", type=int, default=256, help="nxc --threads")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per protocol, the best one is kept")
+    parser.add_argument("--smb-port", type=int, default=14445)
+    parser.add_argument("--ssh-port", type=int, default=12222)
+    parser.add_argument("--ftp-port", type=int, default=12121)
+    parser.add_argument("-o", "--output", default=join(script_dir, "benchmark_results.json"), help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change against the baseline reported as regression")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Display the nxc output")
+    return parser.parse_args()
+
+
+class ConnectionStats:
+    """Connection latencies and login attempts seen by a stand-in, shared by its handler threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.logins = 0
+
+    def add_latency(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def add_login(self):
+        with self.lock:
+            self.logins += 1
+
+    def to_dict(self):
+        with self.lock:
+            return {"latencies": list(self.latencies), "logins": self.logins}
+
+
+def time_connections(server, stats):
+    """Records how long each connection handled by a socketserver based server stays open"""
+    finish_request = server.finish_request
+
+    def timed_finish_request(request, client_address):
+        start = perf_counter()
+        try:
+            finish_request(request, client_address)
+        finally:
+            stats.add_latency(perf_counter() - start)
+
+    server.finish_request = timed_finish_request
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, handler, stats):
+        self.stats = stats
+        super().__init__(address, handler)
+
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    """Minimal FTP control connection: greeting, USER/PASS, QUIT"""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 nxc benchmark FTP stand-in")
+        user = None
+        for line in self.rfile:
+            command, _, argument = line.decode(errors="replace").strip().partition(" ")
+            command = command.upper()
+            if command == "USER":
+                user = argument
+                self.reply("331 Password required")
+            elif command == "PASS":
+                self.server.stats.add_login()
+                if user == BENCH_USER and argument == BENCH_PASSWORD:
+                    self.reply("230 Login successful")
+                else:
+                    self.reply("530 Login incorrect")
+            elif command == "QUIT":
+                self.reply("221 Goodbye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class LDAPHandler(socketserver.BaseRequestHandler):
+    """Fake LDAP responder: answers the rootDSE search and rejects every bind like a DC would a wrong password"""
+
+    def handle(self):
+        from impacket.ldap import ldapasn1
+        from pyasn1.codec.ber import decoder, encoder
+        from pyasn1.error import SubstrateUnderrunError
+
+        data = b""
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return
+            data += chunk
+            while data:
+                try:
+                    message, data = decoder.decode(data, asn1Spec=ldapasn1.LDAPMessage())
+                except SubstrateUnderrunError:
+                    break
+                operation = message["protocolOp"].getName()
+                replies = []
+                if operation == "searchRequest":
+                    entry = ldapasn1.SearchResultEntry()
+                    entry["objectName"] = ""
+                    for i, (name, value) in enumerate([("defaultNamingContext", "DC=bench,DC=local"), ("dnsHostName", f"dc.{BENCH_DOMAIN}")]):
+                        entry["attributes"][i]["type"] = name
+                        entry["attributes"][i]["vals"][0] = value
+                    replies.append(("searchResEntry", entry))
+                    done = ldapasn1.SearchResultDone()
+                    done["resultCode"] = ldapasn1.ResultCode("success")
+                    done["matchedDN"] = ""
+                    done["diagnosticMessage"] = ""
+                    replies.append(("searchResDone", done))
+                elif operation == "bindRequest":
+                    self.server.stats.add_login()
+                    bind = ldapasn1.BindResponse()
+                    bind["resultCode"] = ldapasn1.ResultCode("invalidCredentials")
+                    bind["matchedDN"] = ""
+                    bind["diagnosticMessage"] = "80090308: LdapErr: DSID-0C090569, comment: AcceptSecurityContext error, data 52e, v4563"
+                    replies.append(("bindResponse", bind))
+                elif operation == "unbindRequest":
+                    return
+                for name, reply in replies:
+                    answer = ldapasn1.LDAPMessage()
+                    answer["messageID"] = message["messageID"]
+                    answer["protocolOp"][name] = reply
+                    self.request.sendall(encoder.encode(answer))
+
+
+def ssh_handler(host_key):
+    import paramiko
+
+    class SSHInterface(paramiko.ServerInterface):
+        def __init__(self, stats):
+            self.stats = stats
+
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_auth_password(self, username, password):
+            self.stats.add_login()
+            if username == BENCH_USER and password == BENCH_PASSWORD:
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_exec_request(self, channel, command):
+            # Answer as an unprivileged Linux user once the exec request has been acknowledged
+            def reply():
+                channel.sendall(f"uid=1000({BENCH_USER}) gid=1000({BENCH_USER}) groups=1000({BENCH_USER})\n".encode())
+                channel.send_exit_status(0)
+                channel.close()
+
+            threading.Thread(target=reply, daemon=True).start()
+            return True
+
+    class SSHHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            transport = paramiko.Transport(self.request)
+            transport.local_version = "SSH-2.0-OpenSSH_9.6"
+            transport.add_server_key(host_key)
+            try:
+                transport.start_server(server=SSHInterface(self.server.stats))
+                while transport.is_active():
+                    transport.join(1)
+            except Exception:
+                pass
+            finally:
+                transport.close()
+
+    return SSHHandler
+
+
+def start_smb(listen, port, stats):
+    from impacket import smbserver
+    from impacket.ntlm import compute_nthash
+
+    share_path = tempfile.mkdtemp(prefix="nxc_bench_")
+    server = smbserver.SimpleSMBServer(listen, port)
+    server.addShare("BENCH", share_path)
+    server.setSMB2Support(True)
+    server.setSMBChallenge("")
+    server.setLogFile(os.devnull)
+    server.addCredential(BENCH_USER, 1000, "aad3b435b51404eeaad3b435b51404ee", compute_nthash(BENCH_PASSWORD).hex())
+
+    def auth_callback(smbServer, connData, domain_name, user_name, host_name):
+        # The anonymous session used to fingerprint the host is not a login attempt
+        if user_name:
+            stats.add_login()
+
+    server.setAuthCallback(auth_callback)
+    time_connections(server.getServer(), stats)
+    threading.Thread(target=server.start, daemon=True).start()
+
+
+def start_socketserver(listen, port, handler, stats):
+    server = StandInServer((listen, port), handler, stats)
+    time_connections(server, stats)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def run_stand_in(protocol, listen, port, pipe, verbose):
+    """Runs the stand-in of a protocol, its stats are reset and sent back on "reset" and "stats" requests on the pipe"""
+    if not verbose:
+        # impacket's SMB server prints the tracebacks of the dialects it refuses, nxc probes for SMBv1 on each target
+        logging.disable(logging.CRITICAL)
+        sys.stderr = open(os.devnull, "w")  # noqa: SIM115
+    stats = ConnectionStats()
+    try:
+        if protocol == "smb":
+            start_smb(listen, port, stats)
+        elif protocol == "ssh":
+            import paramiko
+            start_socketserver(listen, port, ssh_handler(paramiko.RSAKey.generate(2048)), stats)
+        elif protocol == "ftp":
+            start_socketserver(listen, port, FTPHandler, stats)
+        elif protocol == "ldap":
+            start_socketserver(listen, port, LDAPHandler, stats)
+    except Exception as e:
+        pipe.send({"error": str(e)})
+        return
+    pipe.send({"ready": True})
+    while (command := pipe.recv()) != "stop":
+        if command == "reset":
+            stats.__init__()
+            pipe.send({})
+        elif command == "stats":
+            pipe.send(stats.to_dict())
+
+
+def generate_targets(base_ip, count, path):
+    """Writes count consecutive addresses starting at base_ip, skipping the .0 and .255 ones"""
+    address = ip_address(base_ip)
+    written = 0
+    with open(path, "w") as targets:
+        while written < count:
+            if address.packed[-1] not in (0, 255):
+                targets.write(f"{address}\n")
+                written += 1
+            address += 1
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def count_db_rows(home, protocol):
+    db_path = join(home, ".nxc", "workspaces", "default", f"{protocol}.db")
+    if not isfile(db_path):
+        return 0
+    with sqlite3.connect(db_path) as db:
+        tables = [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        return sum(db.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables)
+
+
+def read_proc_status(pid):
+    """Returns the (peak RSS in kB, thread count) of a process, (0, 0) where /proc is not available"""
+    peak_rss = threads = 0
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    peak_rss = int(line.split()[1])
+                elif line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+    except OSError:
+        pass
+    return peak_rss, threads
+
+
+def nxc_command(args, protocol, target, port):
+    command = [*shlex.split(args.executable), protocol, target, "-u", BENCH_USER, "-p", BENCH_PASSWORD, "--threads", str(args.threads), "--no-progress"]
+    if protocol == "ldap":
+        command.append("--no-smb")
+    else:
+        command += ["--port", str(port)]
+    if args.poetry:
+        command = ["poetry", "run", *command]
+    return command
+
+
+def run_nxc(args, command, home):
+    """Runs nxc with its own home (so its own fresh workspace) and samples its memory and thread usage"""
+    env = dict(os.environ, HOME=home)
+    output = subprocess.DEVNULL if not args.verbose else None
+    start = perf_counter()
+    process = subprocess.Popen(command, env=env, stdin=subprocess.DEVNULL, stdout=output, stderr=subprocess.STDOUT, cwd=join(script_dir, ".."))
+    peak_rss = peak_threads = 0
+    while process.poll() is None:
+        rss, threads = read_proc_status(process.pid)
+        peak_rss = max(peak_rss, rss)
+        peak_threads = max(peak_threads, threads)
+        sleep(0.05)
+    return perf_counter() - start, process.returncode, peak_rss, peak_threads
+
+
+def benchmark_protocol(args, console, protocol):
+    port = {"smb": args.smb_port, "ssh": args.ssh_port, "ftp": args.ftp_port, "ldap": 389}[protocol]
+    parent_pipe, child_pipe = Pipe()
+    stand_in = Process(target=run_stand_in, args=(protocol, args.listen, port, child_pipe, args.verbose), daemon=True)
+    stand_in.start()
+    status = parent_pipe.recv()
+    if "error" in status:
+        console.log(f"[bold red]Could not start the {protocol} stand-in on port {port}: {status['error']}")
+        stand_in.join()
+        return None
+
+    best = None
+    with tempfile.TemporaryDirectory(prefix="nxc_bench_") as work_dir:
+        targets_file = join(work_dir, "targets.txt")
+        generate_targets(args.base_ip, args.targets, targets_file)
+
+        for run in range(args.repeat):
+            home = join(work_dir, f"home_{run}")
+            os.makedirs(home)
+            # Warm up run on a single target: first run setup of nxc and creation of the workspace are not measured
+            run_nxc(args, nxc_command(args, protocol, args.base_ip, port), home)
+            rows_before = count_db_rows(home, protocol)
+
+            parent_pipe.send("reset")
+            parent_pipe.recv()
+            elapsed, returncode, peak_rss, peak_threads = run_nxc(args, nxc_command(args, protocol, targets_file, port), home)
+            parent_pipe.send("stats")
+            stats = parent_pipe.recv()
+            rows = count_db_rows(home, protocol) - rows_before
+
+            result = {
+                "targets": args.targets,
+                "threads": args.threads,
+                "returncode": returncode,
+                "elapsed": round(elapsed, 3),
+                "hosts_per_sec": round(args.targets / elapsed, 2),
+                "logins_per_sec": round(stats["logins"] / elapsed, 2),
+                "db_rows_per_sec": round(rows / elapsed, 2),
+                "connections": len(stats["latencies"]),
+                "latency_p50": percentile(stats["latencies"], 0.5),
+                "latency_p90": percentile(stats["latencies"], 0.9),
+                "latency_p99": percentile(stats["latencies"], 0.99),
+                "peak_rss_kb": peak_rss,
+                "peak_threads": peak_threads,
+            }
+            console.log(f"{protocol} run {run + 1}/{args.repeat}: {result['hosts_per_sec']} hosts/s, {result['logins_per_sec']} logins/s, {result['db_rows_per_sec']} DB rows/s, {peak_rss} kB peak RSS, {peak_threads} threads")
+            if best is None or result["hosts_per_sec"] > best["hosts_per_sec"]:
+                best = result
+
+    parent_pipe.send("stop")
+    stand_in.join(timeout=5)
+    if stand_in.is_alive():
+        stand_in.terminate()
+    return best
+
+
+def compare_to_baseline(console, results, baseline, tolerance):
+    regressions = []
+    for protocol, result in results["protocols"].items():
+        previous = baseline.get("protocols", {}).get(protocol)
+        if not previous or not result:
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (metric in HIGHER_IS_BETTER and change < -tolerance) or (metric in LOWER_IS_BETTER and change > tolerance):
+                regressions.append(f"{protocol} {metric}: {old} -> {new} ({change:+.1%})")
+    for regression in regressions:
+        console.log(f"[bold red]Regression: {regression}")
+    if not regressions:
+        console.log(f"[bold green]No regression over {tolerance:.0%} against the baseline")
+    return regressions
+
+
+def run_benchmark(args):
+    console = Console()
+    results = {
+        "timestamp": int(time()),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "protocols": {},
+    }
+    for protocol in args.protocols:
+        console.log(f"Benchmarking {protocol} against {args.targets} targets")
+        results["protocols"][protocol] = benchmark_protocol(args, console, protocol)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_to_baseline(console, results, json.load(baseline_file), args.tolerance)
+
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=4)
+    console.log(f"Results written to {args.output}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_benchmark(get_cli_args())
@@ -123,8 +123,26 @@ def test_update_host(db, sess):
     assert host.dc is False
 
 
-def test_add_credential():
-    pass
+def test_host_os_arch(db):
+    assert db.get_host_os_arch("127.0.0.1") is None
+    db.add_host("127.0.0.1", "localhost", "TEST.DEV", "Windows Testing 2023", False, True)
+    assert db.get_host_os_arch("127.0.0.1") is None
+    db.add_host("127.0.0.1", "localhost", "TEST.DEV", "Windows Testing 2023", False, True, os_arch=64)
+    assert db.get_host_os_arch("127.0.0.1") == 64
+    # a later sweep without detection keeps the stored architecture
+    db.add_host("127.0.0.1", "localhost", "TEST.DEV", "Windows Testing 2023", False, True)
+    assert db.get_host_os_arch("127.0.0.1") == 64
+
+
+def test_add_credential(db):
+    user_id = db.add_credential("plaintext", "TEST.DEV", "user", "Password1")
+    assert user_id == db.get_user_id("plaintext", "test.dev", "USER")
+    assert user_id == db.get_credential("plaintext", "TEST.DEV", "user", "Password1")
+    # adding it again updates the existing row through the cached ID
+    assert db.add_credential("plaintext", "TEST.DEV", "user", "Password2") == user_id
+    credentials = db.get_credentials()
+    assert len(credentials) == 1
+    assert credentials[0].password == "Password2"
 
 
 def test_update_credential():
@@ -135,8 +153,15 @@ def test_remove_credential():
     pass
 
 
-def test_add_admin_user():
-    pass
+def test_add_admin_user(db):
+    db.add_host("127.0.0.1", "localhost", "TEST.DEV", "Windows Testing 2023", False, True)
+    db.add_host("127.0.0.10", "localhost10", "TEST.DEV", "Windows Testing 2023", False, True)
+    user_id = db.add_credential("plaintext", "TEST.DEV", "user", "Password1")
+    db.add_admin_user("plaintext", "TEST.DEV", "user", "Password1", "127.0.0.1", user_id=user_id)
+    db.add_admin_user("plaintext", "TEST.DEV", "user", "Password1", "127.0.0.1")
+    relations = db.get_admin_relations(user_id=user_id)
+    assert len(relations) == 1
+    assert relations[0].hostid == db.get_host_id("127.0.0.1")
 
 
 def test_get_admin_relations():
@@ -171,6 +196,16 @@ def test_get_hosts():
     pass
 
 
+def test_get_host_id(db):
+    assert db.get_host_id("127.0.0.1") is None
+    db.add_host("127.0.0.1", "localhost", "TEST.DEV", "Windows Testing 2023", False, True)
+    host_id = db.get_hosts()[0].id
+    assert db.get_host_id("127.0.0.1") == host_id
+    assert db.host_ids["127.0.0.1"] == host_id
+    db.clear_database()
+    assert db.host_ids == {}
+
+
 def test_is_group_valid():
     pass
 
@@ -215,6 +250,22 @@ def test_add_share():
     pass
 
 
+def test_add_shares(db):
+    user_id = db.add_credential("plaintext", "TEST.DEV", "user", "Password1")
+    db.add_shares("localhost", user_id, [
+        {"name": "C$", "remark": "Default share", "read": False, "write": False},
+        {"name": "data", "remark": "", "read": True, "write": False},
+    ])
+    # known shares get their access updated instead of being skipped
+    db.add_shares("localhost", user_id, [{"name": "C$", "remark": "Default share", "read": True, "write": True}])
+    shares = {share.name: share for share in db.get_shares()}
+    assert len(shares) == 2
+    assert shares["C$"].read
+    assert shares["C$"].write
+    assert shares["data"].read
+    assert not shares["data"].write
+
+
 def test_get_shares():
     pass
 
@@ -247,8 +298,13 @@ def test_get_dpapi_secrets():
     pass
 
 
-def test_add_loggedin_relation():
-    pass
+def test_add_loggedin_relation(db):
+    db.add_host("127.0.0.1", "localhost", "TEST.DEV", "Windows Testing 2023", False, True)
+    user_id = db.add_credential("hash", "TEST.DEV", "user", "aad3b435b51404eeaad3b435b51404ee:31d6cfe0d16ae931b73c59d7e0c089c0")
+    host_id = db.get_host_id("127.0.0.1")
+    db.add_loggedin_relation(user_id, host_id)
+    db.add_loggedin_relation(user_id, host_id)
+    assert len(db.get_loggedin_relations(user_id, host_id)) == 1
 
 
 def test_get_loggedin_relations():